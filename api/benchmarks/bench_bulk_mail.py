@@ -0,0 +1,156 @@
+"""
+Benchmark del envío masivo de correo: un sendMail por destinatario frente a lotes $batch.
+
+Levanta un Graph falso en local (http.server) que implementa POST /users/{upn}/sendMail y
+POST /$batch con una latencia fija por petición y throttling simulado: una fracción de los
+elementos de cada lote responde 429 con Retry-After, como hace Outlook al superar la
+concurrencia por buzón. Comprueba además que cada mensaje se entrega exactamente una vez.
+
+Uso (desde api/):
+    python -m benchmarks.bench_bulk_mail --messages 200 --latency-ms 120 --throttle 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.http_client import close_http_client, request as http_request
+from services.graph_batch import BulkMessage, GraphBatchMailer
+
+
+class FakeGraph:
+    def __init__(self, latency: float, throttle: float, retry_after: float, seed: int = 0):
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.delivered = Counter()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def send_one(self, payload: dict) -> dict:
+        with self.lock:
+            throttled = self.random.random() < self.throttle
+            if not throttled:
+                self.delivered[payload["message"]["subject"]] += 1
+        if throttled:
+            return {"status": 429, "headers": {"Retry-After": str(self.retry_after)},
+                    "body": {"error": {"code": "ApplicationThrottled", "message": "Too many requests"}}}
+        return {"status": 202, "headers": {}, "body": None}
+
+    def handler(self):
+        graph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with graph.lock:
+                    graph.requests += 1
+                time.sleep(graph.latency)
+                if self.path.endswith("/$batch"):
+                    responses = []
+                    for r in body["requests"]:
+                        responses.append({"id": r["id"], **graph.send_one(r["body"])})
+                    self._reply(200, {"responses": responses})
+                elif self.path.endswith("/sendMail"):
+                    r = graph.send_one(body)
+                    if r["status"] == 429:
+                        self.send_response(429)
+                        self.send_header("Retry-After", str(graph.retry_after))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                    else:
+                        self._reply(202)
+                else:
+                    self._reply(404, {"error": {"code": "NotFound", "message": self.path}})
+
+        return Handler
+
+
+def _messages(n: int):
+    return [
+        BulkMessage(id=str(i), sender="/users/novios@example.com", payload={
+            "message": {
+                "subject": f"msg-{i}",
+                "body": {"contentType": "Text", "content": "Vuestro video ya está listo"},
+                "toRecipients": [{"emailAddress": {"address": f"invitado{i}@example.com"}}],
+            },
+            "saveToSentItems": True,
+        })
+        for i in range(n)
+    ]
+
+
+async def _token() -> str:
+    return "fake-token"
+
+
+async def send_sequential(base: str, messages, concurrency: int):
+    # Lo que había antes: un sendMail por destinatario (aquí, al menos, con concurrencia acotada)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(m):
+        async with slots:
+            r = await http_request("POST", f"{base}{m.sender}/sendMail",
+                                   headers={"Authorization": "Bearer fake-token"}, json=m.payload, retries=5)
+            return r.status_code in (200, 202)
+
+    return await asyncio.gather(*(one(m) for m in messages))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=120.0, help="latencia por petición HTTP del Graph falso")
+    parser.add_argument("--throttle", type=float, default=0.1, help="fracción de elementos que reciben 429")
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    rows = []
+    for name in ("sendMail x N", "$batch"):
+        graph = FakeGraph(args.latency_ms / 1000, args.throttle, args.retry_after)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), graph.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}/v1.0"
+        messages = _messages(args.messages)
+        t0 = time.perf_counter()
+        if name == "$batch":
+            mailer = GraphBatchMailer(base, _token, max_concurrency=args.concurrency, max_attempts=10, backoff=0.1)
+            results = await mailer.send(messages)
+            sent = sum(r.status == "sent" for r in results)
+        else:
+            sent = sum(await send_sequential(base, messages, args.concurrency))
+        elapsed = time.perf_counter() - t0
+        server.shutdown()
+        duplicated = sum(1 for c in graph.delivered.values() if c > 1)
+        rows.append((name, elapsed, graph.requests, sent, len(graph.delivered), duplicated))
+        await close_http_client()
+
+    print(f"{args.messages} mensajes, latencia {args.latency_ms:.0f} ms, throttling {args.throttle:.0%}, "
+          f"concurrencia {args.concurrency}")
+    print(f"{'modo':14} {'tiempo':>8} {'peticiones':>11} {'enviados':>9} {'entregados':>11} {'duplicados':>11}")
+    for name, elapsed, reqs, sent, delivered, dup in rows:
+        print(f"{name:14} {elapsed:7.2f}s {reqs:11d} {sent:9d} {delivered:11d} {dup:11d}")
+    print(f"speedup: {rows[0][1] / rows[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
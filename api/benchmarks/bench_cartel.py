@@ -0,0 +1,147 @@
+"""
+Benchmark del render del cartel "Save the Date" (cartels/s).
+
+Compara el camino original de routers/image_generation.py (abre la plantilla, carga las
+fuentes y difumina una capa 1920x1080 por línea en cada petición) con CartelRenderer
+(plantilla y fuentes cacheadas, sombra difuminada solo en la caja del texto) y comprueba
+que ambos producen el mismo cartel. Después mide el encode en memoria de cada formato de
+salida (tiempo y tamaño) y la latencia de la previsualización (render reducido + JPEG 80)
+simulando a alguien que escribe los nombres, frente a un objetivo de p95.
+
+Uso (desde api/):
+    python -m benchmarks.bench_cartel --renders 30 --target-ms 50
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps, UnidentifiedImageError
+
+from services.cartel_renderer import (
+    BASE_IMAGE, CRIMSON_FONT, IMAGE_FORMATS, PLAYFAIR_FONT, W, H, CartelRenderer, encode_image, layout_for,
+)
+
+NAMES = [("Lucía", "Juan"), ("Maximiliano", "Guadalupe"), ("Ana", "Leo"), ("Bartolomé", "Inmaculada")]
+
+
+def legacy_render(input_image, names, date_str, layout):
+    """Copia del camino original (antes de CartelRenderer), sin el guardado a disco."""
+    img = Image.open(input_image).convert("RGBA")
+    img = ImageOps.exif_transpose(img)
+    draw = ImageDraw.Draw(img)
+
+    def visible_height(font, text):
+        dummy = Image.new("L", (10, 10), 0)
+        d = ImageDraw.Draw(dummy)
+        bbox = d.textbbox((0, 0), text if text else " ", font=font)
+        return bbox[3] - bbox[1]
+
+    def draw_text_with_shadow(base_img, text, font, x, y):
+        shadow_layer = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
+        sd = ImageDraw.Draw(shadow_layer)
+        sx, sy = layout.shadow_offset
+        sd.text((x + sx, y + sy), text, font=font, fill=layout.shadow_color)
+        shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=layout.shadow_blur))
+        base_img = Image.alpha_composite(base_img, shadow_layer)
+        ImageDraw.Draw(base_img).text((x, y), text, font=font, fill="#FFFFFF")
+        return base_img
+
+    f1 = ImageFont.truetype(CRIMSON_FONT, size=layout.l1_size)
+    f2 = ImageFont.truetype(PLAYFAIR_FONT, size=layout.l2_size)
+    f3 = ImageFont.truetype(PLAYFAIR_FONT, size=layout.l3_size)
+    lines = [("Save the Date", f1), (names, f2), (date_str, f3)]
+    h1, h2, h3 = (visible_height(f, t) for t, f in lines)
+    cur_y = (H - (h1 + layout.line_spacing_top + h2 + layout.line_spacing_main + h3)) // 2 + layout.vertical_shift
+    for (text, font), step in zip(lines, (h1 + layout.line_spacing_top, h2 + layout.line_spacing_main, 0)):
+        x = (W - int(draw.textlength(text, font=font))) // 2
+        img = draw_text_with_shadow(img, text, font, x, cur_y)
+        cur_y += step
+    return img
+
+
+def _base_image(path):
+    """La plantilla real, o una sintética si no está disponible (p. ej. puntero de Git LFS)."""
+    try:
+        with Image.open(path) as im:
+            im.verify()
+        return path
+    except (FileNotFoundError, UnidentifiedImageError):
+        out = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False).name
+        rng = np.random.default_rng(0)
+        grad = np.linspace(60, 180, W, dtype=np.float32)[None, :, None]
+        arr = np.clip(grad + rng.normal(0, 12, (H, W, 3)), 0, 255).astype(np.uint8)
+        Image.fromarray(arr).save(out, quality=95)
+        print(f"(plantilla {path} no disponible: usando una sintética)\n")
+        return out
+
+
+def _bench(fn, n):
+    fn(0)  # calentamiento
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    return n / elapsed, elapsed * 1000.0 / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default=BASE_IMAGE)
+    parser.add_argument("--renders", type=int, default=30)
+    parser.add_argument("--scales", default="0.5,0.33,0.25", help="Escalas de previsualización")
+    parser.add_argument("--target-ms", type=float, default=50.0, help="Objetivo de p95 por previsualización")
+    args = parser.parse_args()
+
+    base = _base_image(args.base)
+    renderer = CartelRenderer(base)
+
+    def case(i):
+        n1, n2 = NAMES[i % len(NAMES)]
+        return f"{n1} y {n2}", "26/07/26", layout_for(n1, n2)
+
+    print(f"{'camino':<24}{'cartels/s':>12}{'ms/cartel':>12}")
+    l_rate, l_ms = _bench(lambda i: legacy_render(base, *case(i)), args.renders)
+    r_rate, r_ms = _bench(lambda i: renderer.render(*case(i)), args.renders)
+    print(f"{'original':<24}{l_rate:>12.1f}{l_ms:>12.2f}")
+    print(f"{'CartelRenderer':<24}{r_rate:>12.1f}{r_ms:>12.2f}")
+    print(f"{'  speedup':<24}{r_rate / l_rate:>11.2f}x")
+
+    diffs = []
+    for i in range(len(NAMES)):
+        a = np.asarray(legacy_render(base, *case(i)), dtype=np.int16)
+        b = np.asarray(renderer.render(*case(i)), dtype=np.int16)
+        diffs.append(int(np.abs(a - b).max()))
+    print(f"{'  diferencia máx. (LSB)':<24}{max(diffs):>12}")
+
+    img = renderer.render(*case(0))
+    print(f"\n{'encode':<24}{'ms':>12}{'KB':>12}")
+    for fmt in IMAGE_FORMATS:
+        try:
+            _, ms = _bench(lambda i: encode_image(img, fmt), max(1, args.renders // 3))
+        except ValueError as e:
+            print(f"{fmt:<24}{'-':>12}{'-':>12}  ({e})")
+            continue
+        print(f"{fmt:<24}{ms:>12.2f}{len(encode_image(img, fmt)) / 1024:>12.1f}")
+
+
+    # Previsualización: cada pulsación es un render nuevo (prefijos crecientes del nombre)
+    typed = [("Maximiliano"[:i], "Guadalupe") for i in range(1, 12)] * max(1, args.renders // 11)
+    print(f"\n{'previsualización':<24}{'p50 ms':>12}{'p95 ms':>12}{'KB':>12}")
+    for scale in (float(x) for x in args.scales.split(",")):
+        renderer.render(*case(0), scale=scale)  # calentamiento (plantilla reducida)
+        times, size = [], 0
+        for n1, n2 in typed:
+            start = time.perf_counter()
+            content = encode_image(renderer.render(f"{n1} y {n2}", "26/07/26", layout_for(n1, n2), scale=scale),
+                                   "jpeg", 80)
+            times.append((time.perf_counter() - start) * 1000.0)
+            size = len(content)
+        p95 = statistics.quantiles(times, n=20)[-1] if len(times) > 1 else times[0]
+        verdict = "ok" if p95 <= args.target_ms else f"> {args.target_ms:g} ms"
+        print(f"{f'escala {scale:g}':<24}{statistics.median(times):>12.2f}{p95:>12.2f}{size / 1024:>12.1f}  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
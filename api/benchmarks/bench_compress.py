@@ -0,0 +1,102 @@
+"""
+Benchmark de compress_image sobre un corpus de fotos de móvil.
+
+Compara el algoritmo original (bajar la calidad de 10 en 10 desde 85 a resolución completa)
+con el actual (reducción previa con draft() + bisección de calidad): encodes, tiempo,
+tamaño de salida y resolución.
+
+Sin --corpus se generan fotos sintéticas con tamaños típicos de móvil (12 y 48 MP,
+horizontales y verticales) guardadas a calidad alta, como llegan de la cámara.
+
+Uso (desde api/):
+    python -m benchmarks.bench_compress --corpus ~/fotos --max-size-mb 4.5
+"""
+import argparse
+import glob
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.images import MAX_DIMENSION, compress_image_with_stats
+
+PHONE_SIZES = [(4032, 3024), (3024, 4032), (4000, 3000), (8064, 6048)]
+
+
+def legacy_compress(image_data: bytes, max_size_mb: float = 4.5, quality: int = 85):
+    """Copia del compress_image original; devuelve (bytes, encodes)."""
+    img = Image.open(io.BytesIO(image_data))
+    if img.mode == "RGBA":
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.split()[3])
+        img = bg
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    encodes = 1
+    while len(out.getvalue()) / (1024 * 1024) > max_size_mb and quality > 30:
+        quality -= 10
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        encodes += 1
+    return out.getvalue(), encodes
+
+
+def _synthetic_photo(size, seed) -> bytes:
+    """Foto "de cámara": degradado + textura fina (ruido) a calidad 95, difícil de comprimir."""
+    w, h = size
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (h // 64 + 1, w // 64 + 1, 3), dtype=np.uint8)
+    base = np.asarray(Image.fromarray(small).resize((w, h), Image.BICUBIC), dtype=np.int16)
+    arr = np.clip(base + rng.normal(0, 18, (h, w, 3)), 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(arr).save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def _corpus(pattern):
+    if pattern:
+        paths = sorted(glob.glob(os.path.join(os.path.expanduser(pattern), "*")) if os.path.isdir(
+            os.path.expanduser(pattern)) else glob.glob(os.path.expanduser(pattern)))
+        for path in paths:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+    else:
+        for i, size in enumerate(PHONE_SIZES):
+            yield f"sintética {size[0]}x{size[1]}", _synthetic_photo(size, i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directorio o glob con las fotos")
+    parser.add_argument("--max-size-mb", type=float, default=4.5)
+    parser.add_argument("--max-dimension", type=int, default=MAX_DIMENSION)
+    parser.add_argument("--skip-legacy", action="store_true", help="No medir el algoritmo original (lento)")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'foto':<28}{'MB':>7} | {'orig enc':>8}{'ms':>8}{'MB':>7} | {'nuevo enc':>9}{'ms':>8}{'MB':>7}{'q':>4}  resolución")
+    for name, data in _corpus(args.corpus):
+        if args.skip_legacy:
+            l_enc, l_ms, l_mb = 0, 0.0, 0.0
+        else:
+            start = time.perf_counter()
+            out, l_enc = legacy_compress(data, args.max_size_mb)
+            l_ms = (time.perf_counter() - start) * 1000.0
+            l_mb = len(out) / 1024 ** 2
+        _, st = compress_image_with_stats(data, args.max_size_mb, max_dimension=args.max_dimension)
+        rows.append((l_ms, st.elapsed_ms, l_enc, st.encodes))
+        print(f"{name[:27]:<28}{len(data) / 1024 ** 2:>7.2f} | {l_enc:>8}{l_ms:>8.0f}{l_mb:>7.2f} | "
+              f"{st.encodes:>9}{st.elapsed_ms:>8.0f}{st.size / 1024 ** 2:>7.2f}{st.quality:>4}  "
+              f"{st.original_size[0]}x{st.original_size[1]} -> {st.final_size[0]}x{st.final_size[1]}")
+
+    if rows:
+        l_ms, n_ms, l_enc, n_enc = zip(*rows)
+        print(f"\nmedia: original {statistics.mean(l_ms):.0f} ms / {statistics.mean(l_enc):.1f} encodes, "
+              f"actual {statistics.mean(n_ms):.0f} ms / {statistics.mean(n_enc):.1f} encodes")
+
+
+if __name__ == "__main__":
+    main()
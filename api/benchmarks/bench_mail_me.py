@@ -0,0 +1,160 @@
+"""
+Benchmark de /mail/me: aplicación MSAL nueva por petición frente al registro compartido.
+
+Reproduce el cuerpo del endpoint (cargar la caché de la sesión, construir la aplicación,
+get_accounts + acquire_token_silent con un token aún válido) sin red: MSAL habla con un
+http_client falso que sirve la openid-configuration y el endpoint de token de Entra ID con
+una latencia simulada. Antes, cada petición construía su aplicación con su propio cliente
+HTTP y sin caché de metadatos, así que pagaba el descubrimiento de la authority; con el
+registro los metadatos se descargan una vez (o se cargan pre-sembrados) y se comparten.
+
+Uso (desde api/):
+    python -m benchmarks.bench_mail_me --requests 200 --latency-ms 80
+"""
+import argparse
+import base64
+import json
+import statistics
+import time
+import uuid
+
+import msal
+
+from core.msal_registry import MsalAppRegistry
+from core.token_cache_store import MemoryTokenCacheBackend, TokenCacheStore
+
+TENANT = "00000000-0000-0000-0000-000000000001"
+CLIENT_ID = "11111111-1111-1111-1111-111111111111"
+AUTHORITY = f"https://login.microsoftonline.com/{TENANT}"
+SCOPES = ["Mail.Send", "User.Read"]
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.headers = {"Content-Type": "application/json"}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeEntraId:
+    """http_client para MSAL (interfaz get/post/close de requests) que simula Entra ID."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {"discovery": 0, "token": 0}
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        time.sleep(self.latency)
+        self.calls["discovery"] += 1
+        base = f"https://login.microsoftonline.com/{TENANT}"
+        return FakeResponse(200, {
+            "authorization_endpoint": f"{base}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{base}/oauth2/v2.0/token",
+            "device_authorization_endpoint": f"{base}/oauth2/v2.0/devicecode",
+            "issuer": f"{base}/v2.0",
+        })
+
+    def post(self, url, params=None, data=None, headers=None, **kwargs):
+        time.sleep(self.latency)
+        self.calls["token"] += 1
+        oid = "22222222-2222-2222-2222-222222222222"
+        now = int(time.time())
+        return FakeResponse(200, {
+            "token_type": "Bearer",
+            "scope": " ".join(SCOPES),
+            "expires_in": 3600,
+            "access_token": "fake-access-token",
+            "refresh_token": "fake-refresh-token",
+            "client_info": _b64({"uid": oid, "utid": TENANT}),
+            "id_token": ".".join([
+                _b64({"alg": "none", "typ": "JWT"}),
+                _b64({"iss": f"https://login.microsoftonline.com/{TENANT}/v2.0", "aud": CLIENT_ID,
+                      "oid": oid, "tid": TENANT, "preferred_username": "novios@example.com",
+                      "iat": now, "exp": now + 3600}),
+                "",
+            ]),
+        })
+
+    def close(self):
+        pass
+
+
+def _login(store: TokenCacheStore, registry: MsalAppRegistry, sid: str):
+    cache = store.load(sid)
+    registry.for_cache(cache).acquire_token_by_authorization_code(
+        "fake-code", scopes=SCOPES, redirect_uri="http://localhost/mail/callback"
+    )
+    store.save(sid, cache)
+
+
+def _me(store: TokenCacheStore, sid: str, build) -> bool:
+    # Mismo trabajo que el endpoint /mail/me
+    cache = store.load(sid)
+    cca = build(cache)
+    accounts = cca.get_accounts()
+    result = accounts and cca.acquire_token_silent(SCOPES, account=accounts[0])
+    store.save(sid, cache)
+    return bool(result and "access_token" in result)
+
+
+def _percentiles(samples):
+    q = statistics.quantiles(samples, n=100)
+    return statistics.median(samples), q[94]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="latencia simulada de Entra ID")
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    store = TokenCacheStore(MemoryTokenCacheBackend())
+    login_idp = FakeEntraId(latency)
+    login_registry = MsalAppRegistry(CLIENT_ID, AUTHORITY, "secret", http_client=login_idp)
+    sids = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    for sid in sids:
+        _login(store, login_registry, sid)
+
+    # Antes: build_cca por petición, con su propio cliente HTTP y sin caché de metadatos
+    before_idp = FakeEntraId(latency)
+
+    def build_legacy(cache):
+        return msal.ConfidentialClientApplication(
+            CLIENT_ID, authority=AUTHORITY, client_credential="secret", token_cache=cache,
+            http_client=before_idp, http_cache={},
+        )
+
+    # Después: registro compartido, con los metadatos pre-sembrados (copia de la caché del login)
+    after_idp = FakeEntraId(latency)
+    registry = MsalAppRegistry(CLIENT_ID, AUTHORITY, "secret", http_client=after_idp,
+                               http_cache=dict(login_registry.http_cache))
+
+    rows = []
+    for name, idp, build in (("antes", before_idp, build_legacy), ("registro", after_idp, registry.for_cache)):
+        samples, ok = [], 0
+        for i in range(args.requests):
+            t0 = time.perf_counter()
+            ok += _me(store, sids[i % len(sids)], build)
+            samples.append((time.perf_counter() - t0) * 1000)
+        p50, p95 = _percentiles(samples)
+        rows.append((name, p50, p95, ok, dict(idp.calls)))
+
+    print(f"{args.requests} peticiones /mail/me, {args.sessions} sesiones, latencia Entra ID {args.latency_ms:.0f} ms")
+    print(f"{'modo':10} {'p50 ms':>8} {'p95 ms':>8} {'autenticadas':>13}  llamadas a Entra ID")
+    for name, p50, p95, ok, calls in rows:
+        print(f"{name:10} {p50:8.2f} {p95:8.2f} {ok:13d}  {calls}")
+    print(f"speedup p50: {rows[0][1] / rows[1][1]:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
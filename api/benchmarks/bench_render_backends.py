@@ -0,0 +1,69 @@
+"""
+Compara los backends de render del video final (tiempo y equivalencia de frames).
+
+Renderiza el mismo timeline con cada backend (sin subir a blob) y mide el PSNR de
+cada salida frente a la de MoviePy con el filtro psnr de ffmpeg.
+
+Uso (desde api/):
+    python -m benchmarks.bench_render_backends --cartel cartel.mp4 --pareja pareja.mp4
+"""
+import argparse
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from services.ffmpeg_render import ffmpeg_exe
+from services.video_service import VideoService, RENDER_BACKENDS
+
+_PSNR_RE = re.compile(r"average:(\S+)")
+
+
+def psnr(reference: str, candidate: str) -> str:
+    proc = subprocess.run(
+        [ffmpeg_exe(), "-hide_banner", "-i", candidate, "-i", reference,
+         "-lavfi", "[0:v][1:v]psnr", "-f", "null", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    m = _PSNR_RE.search(proc.stderr)
+    return m.group(1) if m else "?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cartel", required=True, help="Clip de Runway del cartel (local)")
+    parser.add_argument("--pareja", required=True, help="Clip de Runway de la pareja (local)")
+    parser.add_argument("--static-videos", default="static/videos")
+    parser.add_argument("--overlay", default="static/overlay/efectoluces-logo.mov")
+    parser.add_argument("--audio", default="static/audio/audio.mp4")
+    parser.add_argument("--backends", nargs="+", default=list(RENDER_BACKENDS))
+    args = parser.parse_args()
+
+    out_dir = tempfile.mkdtemp(prefix="bench_render_")
+    outputs = {}
+    print(f"{'backend':<12}{'segundos':>10}")
+    for backend in args.backends:
+        vs = VideoService(
+            static_videos_dir=args.static_videos,
+            overlay_path=args.overlay,
+            audio_path=args.audio,
+            temp_dir=out_dir,
+            render_backend=backend,
+        )
+        out = os.path.join(out_dir, f"{backend}.mp4")
+        start = time.perf_counter()
+        vs.render_to_file(args.cartel, args.pareja, out)
+        print(f"{backend:<12}{time.perf_counter() - start:>10.2f}")
+        outputs[backend] = out
+
+    reference = outputs.get("moviepy")
+    if reference:
+        for backend, out in outputs.items():
+            if backend != "moviepy":
+                print(f"PSNR {backend} vs moviepy: {psnr(reference, out)} dB")
+    print("Salidas en", out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark del pase de overlay (screen blend) por frame.
+
+Compara el camino float32 original de VideoService._compose_screen con ScreenBlender
+(punto fijo, buffers reutilizados), con y sin máscara.
+
+Uso (desde api/):
+    python -m benchmarks.bench_screen_blend --width 1920 --height 1080 --frames 120
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.blend import ScreenBlender
+
+
+def float_compose(bg, fg, mask):
+    """Copia del camino original en float32 (antes de ScreenBlender)."""
+    if mask is not None:
+        m = mask.astype(np.float32)
+    else:
+        m = np.ones(bg.shape[:2], dtype=np.float32)
+    b = bg.astype(np.float32) / 255.0
+    f = fg.astype(np.float32) / 255.0
+    scr = np.clip((1.0 - (1.0 - b) * (1.0 - f)) * 255.0, 0, 255).astype(np.uint8)
+    m3 = m[..., None]
+    out = bg * (1.0 - m3) + scr * m3
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _fps(fn, frames, n):
+    # una pasada de calentamiento (reserva de buffers, caches)
+    fn(*frames[0])
+    start = time.perf_counter()
+    for i in range(n):
+        fn(*frames[i % len(frames)])
+    elapsed = time.perf_counter() - start
+    return n / elapsed, elapsed * 1000.0 / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=120)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (args.height, args.width, 3)
+    pool = []
+    for _ in range(4):
+        bg = rng.integers(0, 256, shape, dtype=np.uint8)
+        fg = rng.integers(0, 256, shape, dtype=np.uint8)
+        mask = rng.random(shape[:2])
+        pool.append((bg, fg, mask))
+
+    blender = ScreenBlender()
+    print(f"Frame {args.width}x{args.height}, {args.frames} frames por caso\n")
+    print(f"{'caso':<28}{'fps':>10}{'ms/frame':>12}")
+    for label, with_mask in (("con máscara", True), ("sin máscara", False)):
+        frames = [(bg, fg, mask if with_mask else None) for bg, fg, mask in pool]
+        f_fps, f_ms = _fps(float_compose, frames, args.frames)
+        i_fps, i_ms = _fps(blender.blend, frames, args.frames)
+        print(f"{'float32 ' + label:<28}{f_fps:>10.1f}{f_ms:>12.2f}")
+        print(f"{'punto fijo ' + label:<28}{i_fps:>10.1f}{i_ms:>12.2f}")
+        print(f"{'  speedup':<28}{i_fps / f_fps:>10.2f}x")
+
+        bg, fg, mask = frames[0]
+        diff = np.abs(float_compose(bg, fg, mask).astype(np.int16) - blender.blend(bg, fg, mask).astype(np.int16))
+        print(f"{'  diferencia máx. (LSB)':<28}{int(diff.max()):>10}\n")
+
+    # Referencia de escala: coste de una simple copia del frame
+    bg = pool[0][0]
+    c_fps, c_ms = _fps(lambda a: a.copy(), [(bg,)], args.frames)
+    print(f"{'copia de frame (ref.)':<28}{c_fps:>10.1f}{c_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
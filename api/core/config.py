@@ -4,6 +4,24 @@ from pydantic import field_validator, model_validator
 
 class Settings(BaseSettings):
     RUNWAY_API_KEY: str
+    # URL base de la API de Runway (None = la del SDK); permite apuntar a un servidor falso en tests
+    RUNWAY_BASE_URL: str | None = None
+    # Sondeo de tareas: espera inicial y máxima entre consultas (backoff x2) y tiempo máximo total
+    RUNWAY_POLL_INITIAL: float = 2.0
+    RUNWAY_POLL_MAX: float = 10.0
+    RUNWAY_TIMEOUT: float = 600.0
+    # Pipeline de generaciones en segundo plano (estado persistido en SQLite para retomarlas)
+    GENERATION_DB_PATH: str = "data/generations.sqlite3"
+    GENERATION_MAX_CONCURRENCY: int = 4
+    # Lease de cada generación en curso: si su worker no lo renueva en este tiempo, otro la retoma.
+    # Las que conduce otro worker se siguen por SSE releyendo la base cada GENERATION_POLL_INTERVAL
+    GENERATION_LEASE_SECONDS: float = 60.0
+    GENERATION_POLL_INTERVAL: float = 2.0
+    # Caché por contenido (imagen + prompt + modelo + ratio + duración) de los videos generados
+    GENERATION_CACHE: bool = True
+    GENERATION_CACHE_DB_PATH: str = "data/generation_cache.sqlite3"
+    GENERATION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    GENERATION_CACHE_MAX_ENTRIES: int = 1000
 
     AZURE_TENANT_ID: str
     AZURE_CLIENT_ID: str
@@ -20,6 +38,24 @@ class Settings(BaseSettings):
     
     # Microsoft Graph API scopes - will be parsed from space-separated string
     GRAPH_SCOPES: str = "Mail.Send User.Read"
+    # Cachés de tokens MSAL por sesión (/mail/*): "sqlite" (compartida por los workers de la máquina),
+    # "redis" (entre máquinas, requiere el paquete redis) o "memory" (solo este proceso)
+    TOKEN_CACHE_BACKEND: str = "sqlite"
+    TOKEN_CACHE_PATH: str = "data/token_caches.sqlite3"
+    TOKEN_CACHE_REDIS_URL: str | None = None
+    TOKEN_CACHE_TTL_SECONDS: int = 14 * 24 * 3600
+    # Metadatos de la authority de MSAL (openid-configuration) persistidos entre reinicios; None = solo en memoria
+    MSAL_HTTP_CACHE_PATH: str | None = "data/msal_http_cache.pickle"
+    # Límites del backend "memory"
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+    TOKEN_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # Segundos antes de caducar en los que el token de Graph se renueva en segundo plano
+    GRAPH_TOKEN_REFRESH_MARGIN: int = 300
+    # Envío masivo por $batch: lotes simultáneos (Outlook admite 4 peticiones a la vez por buzón),
+    # intentos por mensaje con throttling y máximo de mensajes por llamada a /mail/send_bulk
+    GRAPH_BATCH_CONCURRENCY: int = 4
+    GRAPH_BATCH_MAX_ATTEMPTS: int = 4
+    MAIL_BULK_MAX_MESSAGES: int = 500
 
     CORS_ORIGINS: list[str] = Field(default_factory=lambda: ["http://localhost:5173"])
     TEMP_DIR: str = "temp_files"
@@ -30,6 +66,60 @@ class Settings(BaseSettings):
 
     AZURE_STORAGE_CONNECTION_STRING: str | None = Field(None, env="AZURE_STORAGE_CONNECTION_STRING")
     AZURE_BLOB_CONTAINER: str = Field("public-data", env="AZURE_BLOB_CONTAINER")
+    # Clave de cuenta para firmar URLs SAS (opcional)
+    AZURE_STORAGE_ACCOUNT_KEY: str | None = None
+    # Bloques subidos/descargados en paralelo por cada transferencia
+    AZURE_BLOB_MAX_CONCURRENCY: int = 4
+    # Caché local (bajo TEMP_DIR) de los blobs que subimos/descargamos, por ruta + ETag
+    BLOB_CACHE: bool = True
+    BLOB_CACHE_DIR: str = "blob_cache"
+    BLOB_CACHE_MAX_BYTES: int = 2 * 1024 ** 3
+    BLOB_CACHE_MAX_AGE_SECONDS: int = 24 * 3600
+
+    # Cliente HTTP compartido por todas las llamadas salientes (Runway, Graph, WhatsApp, descargas...)
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 10
+    HTTP_TIMEOUT: float = 60.0
+    HTTP2: bool = True
+    HTTP_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.5
+
+    # Cola persistente de notificaciones salientes (correo, WhatsApp, Power Automate)
+    NOTIFICATIONS_DB_PATH: str = "data/notifications.sqlite3"
+    NOTIFICATION_MAX_ATTEMPTS: int = 6
+    NOTIFICATION_RETRY_BASE: float = 2.0
+    NOTIFICATION_RETRY_MAX: float = 300.0
+    NOTIFICATION_RETENTION_SECONDS: int = 7 * 24 * 3600
+    # Lease de una entrega en curso: si su proceso no lo renueva en este tiempo, otro la reencola
+    NOTIFICATION_LEASE_SECONDS: float = 120.0
+    # Por canal: workers simultáneos y ritmo máximo (entregas/segundo, 0 = sin límite)
+    NOTIFY_EMAIL_WORKERS: int = 2
+    NOTIFY_EMAIL_RATE: float = 2.0
+    NOTIFY_WHATSAPP_WORKERS: int = 4
+    NOTIFY_WHATSAPP_RATE: float = 20.0
+    NOTIFY_POWER_AUTOMATE_WORKERS: int = 2
+    NOTIFY_POWER_AUTOMATE_RATE: float = 1.0
+
+    # Subida de fotos (/api/saveImage): tamaño máximo y normalizaciones simultáneas
+    UPLOAD_MAX_BYTES: int = 25 * 1024 * 1024
+    UPLOAD_MAX_CONCURRENCY: int = 4
+
+    # Cola de render del video final: "process" (pool de procesos) o "local" (hilos, para tests)
+    RENDER_QUEUE_BACKEND: str = "process"
+    RENDER_WORKERS: int = 2
+    RENDER_JOB_RETENTION_SECONDS: int = 3600
+    # Render de carteles por lotes: pool de procesos y subidas simultáneas
+    CARTEL_BATCH_BACKEND: str = "process"
+    CARTEL_BATCH_WORKERS: int = 2
+    CARTEL_BATCH_UPLOAD_CONCURRENCY: int = 4
+    CARTEL_BATCH_MAX_ITEMS: int = 500
+    # Motor de composición: "moviepy" (frames en Python) o "ffmpeg" (un único filtergraph)
+    VIDEO_RENDER_BACKEND: str = "moviepy"
+    # Tramos fijos precalculados (normalizados + overlay) para el backend ffmpeg
+    VIDEO_SEGMENT_CACHE: bool = True
+    VIDEO_SEGMENT_CACHE_DIR: str = "segment_cache"
+    # Tramos del video final codificados en paralelo (backend ffmpeg); 1 = secuencial
+    RENDER_SEGMENT_PARALLELISM: int = 3
 
     # Configuración en Pydantic v2 (sustituye a class Config)
     model_config = SettingsConfigDict(
@@ -1,20 +1,60 @@
 from fastapi import Depends
-from runwayml import RunwayML
+from functools import lru_cache
+from runwayml import AsyncRunwayML
 from .config import settings
+from .config import settings as app_settings
 from services.runway_service import RunwayService
 from services.video_service import VideoService
 from services.graph_service import GraphService
 from services.delegated_graph_service import DelegatedGraphService
+from services.render_jobs import RenderJobQueue
+from services.cartel_batch import CartelBatchRenderer
+from services.generation_pipeline import GenerationPipeline, GenerationStore
+from services.generation_cache import GenerationCache
+from services.notifications import NotificationQueue, NotificationStore
+from services import notifiers
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import os
 from core.delegated_graph_config import get_delegated_graph_settings
+from core.msal_client import get_msal_registry
 
-def get_runway_client() -> RunwayML:
-    return RunwayML(api_key=settings.RUNWAY_API_KEY)
+@lru_cache(maxsize=1)
+def get_runway_client() -> AsyncRunwayML:
+    # Un único cliente por proceso: reutiliza el pool de conexiones entre peticiones
+    return AsyncRunwayML(api_key=app_settings.RUNWAY_API_KEY, base_url=app_settings.RUNWAY_BASE_URL)
 
-def get_runway_service(client: RunwayML = Depends(get_runway_client)) -> RunwayService:
-    return RunwayService(client)
+def get_runway_service(client: AsyncRunwayML = Depends(get_runway_client)) -> RunwayService:
+    return RunwayService(
+        client,
+        poll_initial=app_settings.RUNWAY_POLL_INITIAL,
+        poll_max=app_settings.RUNWAY_POLL_MAX,
+        timeout=app_settings.RUNWAY_TIMEOUT,
+    )
+
+@lru_cache(maxsize=1)
+def get_generation_cache() -> Optional[GenerationCache]:
+    # None desactiva la caché: cada petición genera un video nuevo
+    if not app_settings.GENERATION_CACHE:
+        return None
+    return GenerationCache(
+        app_settings.GENERATION_CACHE_DB_PATH,
+        ttl_seconds=app_settings.GENERATION_CACHE_TTL_SECONDS,
+        max_entries=app_settings.GENERATION_CACHE_MAX_ENTRIES,
+    )
+
+@lru_cache(maxsize=1)
+def get_generation_pipeline() -> GenerationPipeline:
+    # Un único coordinador por proceso; debe crearse dentro del event loop (arranque de la app)
+    return GenerationPipeline(
+        store=GenerationStore(app_settings.GENERATION_DB_PATH),
+        runway=get_runway_service(get_runway_client()),
+        cache=get_generation_cache(),
+        max_concurrency=app_settings.GENERATION_MAX_CONCURRENCY,
+        retention_seconds=app_settings.RENDER_JOB_RETENTION_SECONDS,
+        lease_seconds=app_settings.GENERATION_LEASE_SECONDS,
+        poll_interval=app_settings.GENERATION_POLL_INTERVAL,
+    )
 
 def get_video_service() -> VideoService:
     return VideoService(
@@ -22,21 +62,68 @@ def get_video_service() -> VideoService:
         overlay_path=settings.STATIC_OVERLAY,
         audio_path=settings.STATIC_AUDIO,
         temp_dir=settings.TEMP_DIR,
+        render_backend=app_settings.VIDEO_RENDER_BACKEND,
+        segment_cache_dir=app_settings.VIDEO_SEGMENT_CACHE_DIR if app_settings.VIDEO_SEGMENT_CACHE else None,
+        segment_parallelism=app_settings.RENDER_SEGMENT_PARALLELISM,
+    )
+
+@lru_cache(maxsize=1)
+def get_render_queue() -> RenderJobQueue:
+    # Una sola cola por proceso de API: es la que acota los renders simultáneos
+    return RenderJobQueue(
+        backend=app_settings.RENDER_QUEUE_BACKEND,
+        max_workers=app_settings.RENDER_WORKERS,
+        retention_seconds=app_settings.RENDER_JOB_RETENTION_SECONDS,
+    )
+
+@lru_cache(maxsize=1)
+def get_cartel_batch_renderer() -> CartelBatchRenderer:
+    # Pool de procesos compartido por todos los lotes de carteles
+    return CartelBatchRenderer(
+        backend=app_settings.CARTEL_BATCH_BACKEND,
+        max_workers=app_settings.CARTEL_BATCH_WORKERS,
+        upload_concurrency=app_settings.CARTEL_BATCH_UPLOAD_CONCURRENCY,
+    )
+
+@lru_cache(maxsize=1)
+def get_notification_queue() -> NotificationQueue:
+    # Una sola cola por proceso; sus workers se arrancan en el lifespan de la app
+    queue = NotificationQueue(
+        NotificationStore(app_settings.NOTIFICATIONS_DB_PATH),
+        retry_base=app_settings.NOTIFICATION_RETRY_BASE,
+        retry_max=app_settings.NOTIFICATION_RETRY_MAX,
+        retention_seconds=app_settings.NOTIFICATION_RETENTION_SECONDS,
+        lease_seconds=app_settings.NOTIFICATION_LEASE_SECONDS,
     )
+    attempts = app_settings.NOTIFICATION_MAX_ATTEMPTS
+    queue.register("email", notifiers.send_mail, workers=app_settings.NOTIFY_EMAIL_WORKERS,
+                   rate=app_settings.NOTIFY_EMAIL_RATE, max_attempts=attempts)
+    queue.register("whatsapp", notifiers.send_whatsapp, workers=app_settings.NOTIFY_WHATSAPP_WORKERS,
+                   rate=app_settings.NOTIFY_WHATSAPP_RATE, burst=5, max_attempts=attempts)
+    queue.register("power_automate", notifiers.send_power_automate,
+                   workers=app_settings.NOTIFY_POWER_AUTOMATE_WORKERS,
+                   rate=app_settings.NOTIFY_POWER_AUTOMATE_RATE, max_attempts=attempts)
+    return queue
 
 settings = get_delegated_graph_settings()
 
+@lru_cache(maxsize=1)
 def get_graph_service() -> GraphService:
+    # Una sola instancia: la aplicación MSAL (y su caché de tokens app-only) vive todo el proceso
     return GraphService(
         tenant_id=settings.AZURE_TENANT_ID,
         client_id=settings.AZURE_CLIENT_ID,
         client_secret=settings.AZURE_CLIENT_SECRET,
         user_email=settings.AZURE_USER_EMAIL,
         graph_base=settings.GRAPH_BASE,
+        app=get_msal_registry().app,
     )
 
 
-def get_delegated_graph_service():
+@lru_cache(maxsize=1)
+def get_delegated_graph_service() -> DelegatedGraphService:
+    # Una sola instancia por proceso: la caché de tokens vive en memoria y solo se lee
+    # de disco al arrancar, en vez de reconstruir MSAL y releer el fichero por petición
     s = get_delegated_graph_settings()
 
     # Token cache file
@@ -67,4 +154,5 @@ def get_delegated_graph_service():
         scopes=scopes,
         token_cache_path=token_cache_path,
         client_secret=client_secret,
+        refresh_margin=app_settings.GRAPH_TOKEN_REFRESH_MARGIN,
     )
\ No newline at end of file
@@ -0,0 +1,183 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from .config import settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+# Respuestas que se reintentan. 429/503 significan "no se ha procesado": se reintentan
+# siempre; el resto de 5xx solo en métodos idempotentes (un POST podría haberse aplicado).
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+_ALWAYS_RETRY_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+MAX_RETRY_AFTER = 60.0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Cuerpo de la respuesta que devuelve el hueco del host al cerrarse (leída entera o no)."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, slot: asyncio.Semaphore):
+        self._stream = stream
+        self._slot = slot
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self._slot.release()
+        await self._stream.aclose()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte que limita las peticiones simultáneas por host, para no saturar un servicio
+    concreto. El hueco se ocupa desde que se envía la petición hasta que se cierra la
+    respuesta, así que cuenta igual para `request()` que para las descargas con `.stream()`
+    y las peticiones Range en paralelo que van directamente por el cliente compartido.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self.max_per_host = max(1, max_per_host)
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def _slot(self, host: str) -> asyncio.Semaphore:
+        slot = self._slots.get(host)
+        if slot is None:
+            slot = self._slots[host] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        slot = self._slot(request.url.host)
+        await slot.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            slot.release()
+            raise
+        response.stream = _ReleasingStream(response.stream, slot)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = settings.HTTP2 and _http2_available()
+    if settings.HTTP2 and not http2:
+        print("HTTP/2 no disponible (falta el paquete h2): se usa HTTP/1.1 con keep-alive")
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=60.0,
+        ),
+    )
+    return httpx.AsyncClient(
+        transport=HostLimitedTransport(transport, settings.HTTP_MAX_CONNECTIONS_PER_HOST),
+        follow_redirects=True,
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=10.0),
+    )
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """Crea el cliente compartido (lo llama el lifespan de la app al arrancar)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Cliente HTTP asíncrono compartido por todo el proceso.
+
+    Reutiliza conexiones (keep-alive, HTTP/2 si está disponible) y sesiones TLS entre
+    peticiones en vez de abrir una sesión nueva por llamada. Si no se inicializó en el
+    arranque (scripts, workers) se crea perezosamente dentro del event loop.
+    """
+    return init_http_client()
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        # También puede venir como fecha HTTP
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def _backoff(attempt: int) -> float:
+    # Exponencial con jitter para que los reintentos de varias peticiones no coincidan
+    base = settings.HTTP_RETRY_BACKOFF * 2 ** attempt
+    return base / 2 + random.uniform(0, base / 2)
+
+
+async def request(method: str, url: str, *, retries: Optional[int] = None, **kwargs) -> httpx.Response:
+    """
+    Petición por el cliente compartido (con su límite por host) y política de reintentos.
+
+    Se reintenta (backoff exponencial con jitter, o el Retry-After del servidor):
+    - Errores de conexión (la petición no llegó a enviarse), en cualquier método.
+    - 429 y 503, en cualquier método.
+    - Timeouts de lectura, cortes y demás 5xx, solo en métodos idempotentes.
+
+    Devuelve la última respuesta aunque sea un error HTTP: cada llamador decide qué hacer con ella.
+    """
+    method = method.upper()
+    retries = settings.HTTP_RETRIES if retries is None else retries
+    idempotent = method in IDEMPOTENT_METHODS
+    client = get_http_client()
+    attempt = 0
+    while True:
+        delay = None
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            if attempt == retries:
+                raise
+        except (httpx.ReadTimeout, httpx.ReadError, httpx.RemoteProtocolError):
+            if attempt == retries or not idempotent:
+                raise
+        else:
+            retryable = resp.status_code in _ALWAYS_RETRY_STATUSES or (
+                idempotent and resp.status_code in RETRY_STATUSES
+            )
+            if not retryable or attempt == retries:
+                return resp
+            delay = _retry_after(resp)
+            print(f"{method} {url} -> HTTP {resp.status_code}, reintentando ({attempt + 1}/{retries})")
+        await asyncio.sleep(_backoff(attempt) if delay is None else delay)
+        attempt += 1
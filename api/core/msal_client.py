@@ -1,14 +1,29 @@
 # core/msal_client.py
+import asyncio
 import uuid
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Iterator
 import msal
 from fastapi import Request
 from core.config import settings
+from core.token_cache_store import TokenCacheStore, build_token_cache_store
+from core.msal_registry import MsalAppRegistry
 
 AUTHORITY = f"https://login.microsoftonline.com/{settings.AZURE_TENANT_ID}"
 GRAPH_SCOPES = settings.GRAPH_SCOPES.split()
 
-# Cache en memoria por sesión (simple para backend)
-_TOKEN_CACHES: dict[str, msal.SerializableTokenCache] = {}
+@lru_cache(maxsize=1)
+def get_token_cache_store() -> TokenCacheStore:
+    # Cachés de tokens por sesión: acotadas y con caducidad, compartidas entre workers si el backend lo permite
+    return build_token_cache_store(
+        settings.TOKEN_CACHE_BACKEND,
+        path=settings.TOKEN_CACHE_PATH,
+        redis_url=settings.TOKEN_CACHE_REDIS_URL,
+        ttl_seconds=settings.TOKEN_CACHE_TTL_SECONDS,
+        max_entries=settings.TOKEN_CACHE_MAX_ENTRIES,
+        max_bytes=settings.TOKEN_CACHE_MAX_BYTES,
+    )
 
 def _get_sid(request: Request) -> str:
     sid = request.session.get("sid")
@@ -17,22 +32,61 @@ def _get_sid(request: Request) -> str:
         request.session["sid"] = sid
     return sid
 
-def load_cache(request: Request) -> msal.SerializableTokenCache:
-    sid = _get_sid(request)
-    cache = _TOKEN_CACHES.get(sid)
-    if not cache:
-        cache = msal.SerializableTokenCache()
-        _TOKEN_CACHES[sid] = cache
-    return cache
-
-def build_cca(request: Request) -> msal.ConfidentialClientApplication:
-    cache = load_cache(request)
-    return msal.ConfidentialClientApplication(
+def get_session_id(request: Request) -> str:
+    return _get_sid(request)
+
+@lru_cache(maxsize=1)
+def get_msal_registry() -> MsalAppRegistry:
+    # Metadatos de la authority y pool HTTP compartidos por todas las aplicaciones MSAL del proceso
+    return MsalAppRegistry(
         client_id=settings.AZURE_CLIENT_ID,
         authority=AUTHORITY,
         client_credential=settings.AZURE_CLIENT_SECRET,
-        token_cache=cache,
+        http_cache_path=settings.MSAL_HTTP_CACHE_PATH,
     )
 
+@contextmanager
+def session_cca_for(sid: str) -> Iterator[msal.ConfidentialClientApplication]:
+    """
+    Aplicación MSAL con la caché de tokens de la sesión `sid`. Al salir, la caché se guarda
+    en el store solo si MSAL la modificó (login, renovación del token).
+    También la usan los workers de notificaciones, que no tienen la Request a mano.
+    """
+    store = get_token_cache_store()
+    cache = store.load(sid)
+    try:
+        yield get_msal_registry().for_cache(cache)
+    finally:
+        store.save(sid, cache)
+
+@contextmanager
+def session_cca(request: Request) -> Iterator[msal.ConfidentialClientApplication]:
+    with session_cca_for(_get_sid(request)) as cca:
+        yield cca
+
+@asynccontextmanager
+async def asession_cca_for(sid: str) -> AsyncIterator[msal.ConfidentialClientApplication]:
+    """
+    Como `session_cca_for`, para código async: la carga y el guardado de la caché (fichero
+    SQLite o Redis) y la construcción de la aplicación (descarga los metadatos de la
+    authority si aún no están en caché) van en un hilo y no bloquean el event loop.
+    """
+    store = get_token_cache_store()
+
+    def load():
+        cache = store.load(sid)
+        return cache, get_msal_registry().for_cache(cache)
+
+    cache, cca = await asyncio.to_thread(load)
+    try:
+        yield cca
+    finally:
+        await asyncio.to_thread(store.save, sid, cache)
+
+@asynccontextmanager
+async def asession_cca(request: Request) -> AsyncIterator[msal.ConfidentialClientApplication]:
+    async with asession_cca_for(_get_sid(request)) as cca:
+        yield cca
+
 def get_scopes() -> list[str]:
     return GRAPH_SCOPES
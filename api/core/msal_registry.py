@@ -0,0 +1,105 @@
+# core/msal_registry.py
+import functools
+import os
+import pickle
+import threading
+from typing import Any, MutableMapping, Optional
+
+import msal
+
+
+def _default_http_client(timeout: float, pool_size: int):
+    # Mismo cliente que MSAL crea por defecto, pero uno solo para todas las aplicaciones:
+    # las renovaciones de token reutilizan la conexión TLS con login.microsoftonline.com
+    import requests
+
+    session = requests.Session()
+    session.request = functools.partial(session.request, timeout=timeout)
+    adapter = requests.adapters.HTTPAdapter(max_retries=1, pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class MsalAppRegistry:
+    """
+    Aplicaciones MSAL (ConfidentialClientApplication) de larga duración para un mismo
+    client_id/authority.
+
+    Construir una aplicación desde cero descarga los metadatos de la authority
+    (openid-configuration) y abre su propia sesión HTTP. Aquí todas comparten:
+      - `http_cache`: respuestas de descubrimiento, válidas 24 h. Puede cargarse de
+        `http_cache_path` (o pasarse ya rellena, p. ej. en tests) para arrancar sin red.
+      - `http_client`: un único pool de conexiones hacia Entra ID.
+    Con eso, `for_cache(cache)` crea en microsegundos una aplicación ligada a la caché de
+    tokens de una sesión, y `app` es una única instancia para los flujos app-only.
+    """
+
+    def __init__(self, client_id: str, authority: str, client_credential: Any,
+                 http_client: Any = None, http_cache: Optional[MutableMapping] = None,
+                 http_cache_path: Optional[str] = None, timeout: float = 30, pool_size: int = 10):
+        self.client_id = client_id
+        self.authority = authority
+        self.client_credential = client_credential
+        self.http_cache_path = http_cache_path
+        self.http_cache = http_cache if http_cache is not None else self._load_http_cache()
+        self.http_client = http_client or _default_http_client(timeout, pool_size)
+        self._app: Optional[msal.ConfidentialClientApplication] = None
+        self._lock = threading.Lock()
+
+    def _load_http_cache(self) -> MutableMapping:
+        if not self.http_cache_path or not os.path.exists(self.http_cache_path):
+            return {}
+        try:
+            with open(self.http_cache_path, "rb") as f:
+                cache = pickle.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except Exception as e:
+            # Formato de otra versión de MSAL o fichero corrupto: se empieza de cero
+            print(f"No se pudo cargar la caché HTTP de MSAL ({e!r}), se descarta")
+            return {}
+
+    def save_http_cache(self):
+        if not self.http_cache_path:
+            return
+        try:
+            if os.path.dirname(self.http_cache_path):
+                os.makedirs(os.path.dirname(self.http_cache_path), exist_ok=True)
+            tmp_path = f"{self.http_cache_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(dict(self.http_cache), f)
+            os.replace(tmp_path, self.http_cache_path)
+        except Exception as e:
+            print(f"No se pudo guardar la caché HTTP de MSAL: {e!r}")
+
+    def for_cache(self, token_cache: Optional[msal.TokenCache] = None) -> msal.ConfidentialClientApplication:
+        """Aplicación que usa `token_cache` (p. ej. la de una sesión), sin red si los metadatos están en caché."""
+        return msal.ConfidentialClientApplication(
+            client_id=self.client_id,
+            authority=self.authority,
+            client_credential=self.client_credential,
+            token_cache=token_cache,
+            http_client=self.http_client,
+            http_cache=self.http_cache,
+        )
+
+    @property
+    def app(self) -> msal.ConfidentialClientApplication:
+        """Instancia única con su propia caché en memoria (client credentials)."""
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    self._app = self.for_cache()
+        return self._app
+
+    def warm(self):
+        """Descarga los metadatos de la authority antes de la primera petición (síncrono, con red)."""
+        self.app
+        self.save_http_cache()
+
+    def close(self):
+        self.save_http_cache()
+        try:
+            self.http_client.close()
+        except Exception:
+            pass
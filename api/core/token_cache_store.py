@@ -0,0 +1,226 @@
+# core/token_cache_store.py
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import msal
+
+
+class TokenCacheBackend(ABC):
+    """Almacén de cachés MSAL serializadas por id de sesión."""
+
+    @abstractmethod
+    def get(self, sid: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, sid: str, blob: str):
+        ...
+
+    @abstractmethod
+    def delete(self, sid: str):
+        ...
+
+    def close(self):
+        pass
+
+
+class MemoryTokenCacheBackend(TokenCacheBackend):
+    """
+    En memoria del proceso, acotado: LRU por número de sesiones y por bytes, y TTL deslizante
+    (una sesión sin uso durante `ttl_seconds` se descarta). No se comparte entre workers.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 14 * 24 * 3600):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, sid: str):
+        blob, _ = self._entries.pop(sid)
+        self._bytes -= len(blob)
+
+    def get(self, sid: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            blob, expires_at = entry
+            if expires_at <= now:
+                self._drop(sid)
+                return None
+            self._entries[sid] = (blob, now + self.ttl_seconds)
+            self._entries.move_to_end(sid)
+            return blob
+
+    def set(self, sid: str, blob: str):
+        now = time.time()
+        with self._lock:
+            if sid in self._entries:
+                self._drop(sid)
+            self._entries[sid] = (blob, now + self.ttl_seconds)
+            self._bytes += len(blob)
+            # El TTL es deslizante, así que el orden LRU es también el de caducidad: las caducadas
+            # están al principio. Después se descartan las menos usadas hasta volver a los límites.
+            while self._entries and next(iter(self._entries.values()))[1] <= now:
+                self._drop(next(iter(self._entries)))
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def delete(self, sid: str):
+        with self._lock:
+            if sid in self._entries:
+                self._drop(sid)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteTokenCacheBackend(TokenCacheBackend):
+    """
+    En un fichero SQLite: sobrevive a reinicios y lo comparten los workers de uvicorn/gunicorn
+    de la misma máquina. El TTL cuenta desde la última escritura (MSAL escribe en cada renovación).
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str, ttl_seconds: int = 14 * 24 * 3600):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        # Contiene refresh tokens: solo legible por el usuario del proceso. El fichero se crea
+        # ya con 0600 antes de abrirlo (sin ventana con permisos por defecto); SQLite crea los
+        # -wal/-shm con los permisos del fichero principal
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_caches (sid TEXT PRIMARY KEY, blob TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+        # Bases creadas por versiones anteriores, con los permisos del umask
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.chmod(path + suffix, 0o600)
+            except OSError:
+                pass
+        self.purge()
+
+    def get(self, sid: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob FROM token_caches WHERE sid = ? AND updated_at > ?",
+                (sid, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid: str, blob: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO token_caches (sid, blob, updated_at) VALUES (?, ?, ?)",
+                (sid, blob, time.time()),
+            )
+            self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def delete(self, sid: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM token_caches WHERE sid = ?", (sid,))
+
+    def purge(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM token_caches WHERE updated_at <= ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisTokenCacheBackend(TokenCacheBackend):
+    """En Redis (o compatible: Valkey, Azure Cache): compartido entre máquinas; el TTL lo aplica Redis."""
+
+    def __init__(self, url: str, ttl_seconds: int = 14 * 24 * 3600, prefix: str = "msal:token_cache:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("TOKEN_CACHE_BACKEND=redis requiere el paquete 'redis'") from e
+        self._redis = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, sid: str) -> Optional[str]:
+        blob = self._redis.get(self.prefix + sid)
+        return blob.decode("utf-8") if blob is not None else None
+
+    def set(self, sid: str, blob: str):
+        self._redis.set(self.prefix + sid, blob, ex=self.ttl_seconds)
+
+    def delete(self, sid: str):
+        self._redis.delete(self.prefix + sid)
+
+    def close(self):
+        self._redis.close()
+
+
+class TokenCacheStore:
+    """
+    Cachés de tokens MSAL por sesión sobre un backend intercambiable.
+
+    `load` devuelve una SerializableTokenCache con el estado guardado de la sesión (o vacía);
+    `save` solo serializa y escribe si MSAL marcó la caché como modificada (login, renovación),
+    así que una petición que usa un token aún válido no escribe nada.
+    """
+
+    def __init__(self, backend: TokenCacheBackend):
+        self.backend = backend
+
+    def load(self, sid: str) -> msal.SerializableTokenCache:
+        cache = msal.SerializableTokenCache()
+        blob = self.backend.get(sid)
+        if blob:
+            try:
+                cache.deserialize(blob)
+            except ValueError as e:
+                print(f"Caché de tokens corrupta para la sesión {sid[:8]}…, se descarta: {e}")
+                cache = msal.SerializableTokenCache()
+        return cache
+
+    def save(self, sid: str, cache: msal.SerializableTokenCache) -> bool:
+        if not cache.has_state_changed:
+            return False
+        self.backend.set(sid, cache.serialize())
+        cache.has_state_changed = False
+        return True
+
+    def delete(self, sid: str):
+        self.backend.delete(sid)
+
+    def close(self):
+        self.backend.close()
+
+
+def build_token_cache_store(backend: str, path: str = "data/token_caches.sqlite3", redis_url: Optional[str] = None,
+                            ttl_seconds: int = 14 * 24 * 3600, max_entries: int = 10000,
+                            max_bytes: int = 64 * 1024 * 1024) -> TokenCacheStore:
+    if backend == "memory":
+        return TokenCacheStore(MemoryTokenCacheBackend(max_entries, max_bytes, ttl_seconds))
+    if backend == "sqlite":
+        return TokenCacheStore(SqliteTokenCacheBackend(path, ttl_seconds))
+    if backend == "redis":
+        if not redis_url:
+            raise ValueError("TOKEN_CACHE_BACKEND=redis requiere TOKEN_CACHE_REDIS_URL")
+        return TokenCacheStore(RedisTokenCacheBackend(redis_url, ttl_seconds))
+    raise ValueError(f"Backend de caché de tokens desconocido: {backend}")
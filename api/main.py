@@ -1,11 +1,86 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import settings
-from routers import ai_generation, final_video, mail, media, whatsapp, image_generation
+from routers import ai_generation, final_video, mail, media, whatsapp, image_generation, notifications
 from utils.files import init_temp_dir, cleanup_temp_files
+from utils.blob_storage import init_blob_storage, close_blob_storage
+from utils.blob_cache import init_blob_cache
+from core.http_client import init_http_client, close_http_client
+from core.msal_client import get_msal_registry
+from core.deps import (
+    get_render_queue, get_video_service, get_runway_client, get_generation_pipeline, get_cartel_batch_renderer,
+    get_notification_queue,
+)
+
+async def _precompute_static_segments():
+    try:
+        paths = await asyncio.to_thread(get_video_service().precompute_static_segments)
+        if paths:
+            print("Tramos fijos listos en caché:", paths)
+    except Exception as e:
+        print("No se pudieron precalcular los tramos fijos:", repr(e))
+
+async def _warm_msal():
+    try:
+        await asyncio.to_thread(get_msal_registry().warm)
+    except Exception as e:
+        print("No se pudieron precargar los metadatos de MSAL:", repr(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cleanup_temp_files()
+    # Cliente HTTP compartido por todas las llamadas salientes (pool de conexiones, HTTP/2, reintentos)
+    init_http_client()
+    # Clientes de Blob Storage compartidos por todo el proceso (pool de conexiones)
+    init_blob_storage(
+        settings.AZURE_STORAGE_CONNECTION_STRING,
+        container=settings.AZURE_BLOB_CONTAINER,
+        account_key=settings.AZURE_STORAGE_ACCOUNT_KEY,
+        max_concurrency=settings.AZURE_BLOB_MAX_CONCURRENCY,
+    )
+    if settings.BLOB_CACHE:
+        # Subdirectorio de TEMP_DIR: cleanup_temp_files solo borra ficheros sueltos, así que sobrevive al reinicio
+        init_blob_cache(
+            os.path.join(settings.TEMP_DIR, settings.BLOB_CACHE_DIR),
+            max_bytes=settings.BLOB_CACHE_MAX_BYTES,
+            max_age_seconds=settings.BLOB_CACHE_MAX_AGE_SECONDS,
+        )
+    # Retoma las generaciones de Runway que quedaron a medias sin ningún worker vivo que las conduzca
+    resumed = get_generation_pipeline().start()
+    if resumed:
+        print("Generaciones retomadas:", resumed)
+    # Workers de notificaciones; retoman lo que quedó pendiente en la cola
+    requeued = get_notification_queue().start()
+    if requeued:
+        print("Notificaciones retomadas:", requeued)
+    # Tareas de arranque en segundo plano: el event loop solo guarda referencias débiles, así
+    # que se conservan aquí y se cancelan al apagar
+    app.state.startup_tasks = {
+        # Metadatos de la authority de MSAL antes del primer /mail/* (sin retrasar el arranque)
+        asyncio.create_task(_warm_msal()),
+        # Precalcula los tramos fijos del video final sin retrasar el arranque
+        asyncio.create_task(_precompute_static_segments()),
+    }
 
-app = FastAPI(title="Video Generation API")
+    yield
+
+    for task in app.state.startup_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.startup_tasks, return_exceptions=True)
+    await get_render_queue().shutdown()
+    await get_notification_queue().shutdown()
+    await get_cartel_batch_renderer().shutdown()
+    await get_generation_pipeline().shutdown()
+    await get_runway_client().close()
+    await close_blob_storage()
+    await close_http_client()
+    get_msal_registry().close()
+
+app = FastAPI(title="Video Generation API", lifespan=lifespan)
 
 app.add_middleware(
     SessionMiddleware, 
@@ -23,16 +98,13 @@ app.add_middleware(
 
 init_temp_dir(settings.TEMP_DIR)
 
-@app.on_event("startup")
-async def _startup():
-    cleanup_temp_files()
-
 app.include_router(media.router)
 app.include_router(ai_generation.router)
 app.include_router(final_video.router)
 app.include_router(mail.router)
 app.include_router(whatsapp.router)
 app.include_router(image_generation.router)
+app.include_router(notifications.router)
 
 @app.get("/")
 def root():
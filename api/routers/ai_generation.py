@@ -1,13 +1,17 @@
 import os, base64, uuid
-import aiohttp
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Body
-from core.deps import get_runway_service
-from services.runway_service import RunwayService
+from core.deps import get_runway_service, get_generation_pipeline, get_generation_cache
+from services.runway_service import RunwayService, RunwayTaskError, RunwayTimeoutError, CARTEL_PROMPT, PAREJA_PROMPT
 from utils.files import save_uploaded_file, get_media_url, get_placeholder
 from utils.images import compress_image
-from schemas.generation import CartelRequest, ParejaVidRequest
-from utils.blob_storage import upload_bytes_to_blob_storage
+from schemas.generation import CartelRequest, ParejaVidRequest, GenerationRequest
+from services.generation_pipeline import Generation, GenerationPipeline, DEMO_VIDEOS
+from services.generation_cache import GenerationCache, generation_key, generated_video_location, load_image_bytes
+from typing import Awaitable, Callable, Optional
+from utils.sse import sse_response, state_stream
+from utils.blob_storage import upload_bytes_to_blob_storage, stream_url_to_blob_storage
 from azure.storage.blob import ContentSettings  # Add this import at the top
+from core.http_client import get_http_client
 
 router = APIRouter(prefix="/api")
 
@@ -44,44 +48,69 @@ async def create_polaroid(fecha: str = Form(...), imagen: UploadFile = File(...)
         return {"status": "error", "message": "Error generando polaroid. Using placeholder.",
                 "image_path": None, "video_path": ph, "video_url": get_media_url(ph)}
 '''
-# Cache simple en memoria para URLs generadas
-cartel_image_cache = {}
+async def _run_generation(generation) -> str:
+    """Espera la generación de Runway traduciendo sus fallos a errores HTTP."""
+    try:
+        return await generation
+    except RunwayTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RunwayTaskError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+async def _store_runway_video(vid_url: str, folder: str, filename: str) -> str:
+    """Pasa el clip de Runway al blob en streaming (sin cargarlo entero en memoria). Devuelve la URL pública."""
+    file_id, public_url = await stream_url_to_blob_storage(
+        vid_url,
+        folder=folder,
+        filename=filename,
+        content_settings=ContentSettings(
+            content_type='video/mp4'
+        ),
+        client=get_http_client(),
+    )
+    return public_url
+
+
+async def _cached_generation(cache: Optional[GenerationCache], image_url: str, prompt: str,
+                             generate: Callable[[], Awaitable[str]], folder: str, filename: str) -> str:
+    """
+    Genera el clip (`generate` devuelve la URL de Runway) y lo guarda en el blob. Con caché,
+    reutiliza el video si ya se generó con la misma imagen y prompt (y comparte las peticiones
+    en curso); el video cacheado se guarda en generated/{clave}, no en la carpeta de la pareja,
+    para que otra pareja o una regeneración nunca cambien lo que sirve una clave.
+    """
+    if cache is None:
+        return await _store_runway_video(await generate(), folder, filename)
+    key = generation_key(await load_image_bytes(image_url, get_http_client()), prompt)
+
+    async def produce() -> str:
+        return await _store_runway_video(await generate(), *generated_video_location(key))
+
+    return await cache.get_or_create(key, produce)
 
 
 @router.post("/create_cartel_video")
 async def create_cartel_video(
     data: CartelRequest,
     runway: RunwayService = Depends(get_runway_service),
+    cache: Optional[GenerationCache] = Depends(get_generation_cache),
 ):
     print("isDemo:", data.demo)
+    print("Generating cartel video for:", data.nombre1, data.nombre2, "Demo:", data.demo)
+    filename = f'vid_cartel_{data.id}'
 
     if data.demo:
-        vid_url = "https://showroomblob.blob.core.windows.net/demo-data/cartel_vid_demo.mp4"
+        public_url = await _store_runway_video(DEMO_VIDEOS["cartel"], data.id, filename)
     else:
         image_url = data.image_url
         print("Image URL for cartel video generation:", image_url)
-        vid_url = runway.create_cartel_video(image_url)
-
-    print("Generating cartel video for:", data.nombre1, data.nombre2, "Demo:", data.demo)
-
-    # Download video from Runway
-    async with aiohttp.ClientSession() as session:
-        async with session.get(vid_url) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=400, detail="Error downloading video from Runway")
-            video_content = await response.read()
 
-    filename = f'vid_cartel_{data.id}'
-
-    # Upload to blob storage
-    file_id, public_url = upload_bytes_to_blob_storage(
-        folder=data.id,
-        filename=filename,
-        video_content=video_content,
-        content_settings=ContentSettings(
-            content_type='video/mp4'
+        public_url = await _cached_generation(
+            cache, image_url, CARTEL_PROMPT,
+            lambda: _run_generation(runway.create_cartel_video(image_url)),
+            data.id, filename,
         )
-    )
 
     return {
         "status": "success",
@@ -180,36 +209,23 @@ async def create_cartel_video(
 async def create_video_pareja(
     data: ParejaVidRequest,
     runway: RunwayService = Depends(get_runway_service),
+    cache: Optional[GenerationCache] = Depends(get_generation_cache),
 ):
     print("isDemo:", data.demo)
+    print("Generating pareja video for:", data.id, data.demo)
+    filename = f'vid_pareja_{data.id}'
 
     if data.demo:
-        vid_url = "https://showroomblob.blob.core.windows.net/demo-data/pareja_vid_demo.mp4"
+        public_url = await _store_runway_video(DEMO_VIDEOS["pareja"], data.id, filename)
     else:
         image_url = data.image_url
         print("Image URL for cartel video generation:", image_url)
-        vid_url = runway.create_video_pareja(image_url)
-
-    print("Generating pareja video for:", data.id, data.demo)
-
-    # Download video from Runway
-    async with aiohttp.ClientSession() as session:
-        async with session.get(vid_url) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=400, detail="Error downloading video from Runway")
-            video_content = await response.read()
 
-    filename = f'vid_pareja_{data.id}'
-
-    # Upload to blob storage
-    file_id, public_url = upload_bytes_to_blob_storage(
-        video_content=video_content,
-        folder=data.id,
-        filename=filename,
-        content_settings=ContentSettings(
-            content_type='video/mp4'
+        public_url = await _cached_generation(
+            cache, image_url, PAREJA_PROMPT,
+            lambda: _run_generation(runway.create_video_pareja(image_url)),
+            data.id, filename,
         )
-    )
 
     return {
         "status": "success",
@@ -228,4 +244,39 @@ async def create_video_pareja_v0(imagen: UploadFile = File(...), runway: RunwayS
         ph = get_placeholder("video")
         return {"status": "error", "message": "Error generando video. Using placeholder.",
                 "video_path": ph, "video_url": get_media_url(ph)}
-'''
\ No newline at end of file
+'''
+
+
+@router.post("/generations", status_code=202)
+async def create_generation(
+    data: GenerationRequest,
+    pipeline: GenerationPipeline = Depends(get_generation_pipeline),
+):
+    """
+    Registra la generación del video (cartel o pareja) y devuelve su id de inmediato.
+    El progreso se consulta en /generations/{generation_id} o por SSE en /events.
+    """
+    print("Encolando generación", data.kind, "para:", data.id, "Demo:", data.demo)
+    gen = pipeline.submit(data.kind, data.id, data.image_url, data.demo)
+    return {"status": "queued", "generation_id": gen.id}
+
+
+def _get_generation_or_404(pipeline: GenerationPipeline, generation_id: str) -> Generation:
+    gen = pipeline.get(generation_id)
+    if gen is None:
+        raise HTTPException(status_code=404, detail="Generación no encontrada")
+    return gen
+
+
+@router.get("/generations/{generation_id}")
+async def get_generation(generation_id: str, pipeline: GenerationPipeline = Depends(get_generation_pipeline)):
+    """Estado actual de la generación (para polling)."""
+    return _get_generation_or_404(pipeline, generation_id).to_dict()
+
+
+@router.get("/generations/{generation_id}/events")
+async def generation_events(generation_id: str, pipeline: GenerationPipeline = Depends(get_generation_pipeline)):
+    """Server-sent events con cada cambio de etapa hasta que la generación termina."""
+    _get_generation_or_404(pipeline, generation_id)
+    snapshot, wait_change = pipeline.watch(generation_id)
+    return sse_response(state_stream(snapshot, wait_change, lambda st: st["status"] in ("done", "error")))
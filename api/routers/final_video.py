@@ -1,100 +1,112 @@
-from fastapi import APIRouter, Depends
-from core.deps import get_video_service
+from fastapi import APIRouter, Depends, HTTPException
+from core.deps import get_video_service, get_render_queue, get_notification_queue
 from services.video_service import VideoService
+from services.render_jobs import RenderJob, RenderJobQueue, compose_final_in_worker
 from schemas.generation import VideoFinalRequest
+from utils.sse import sse_response, state_stream
+from utils.downloads import download_all, local_media_path
+from utils.blob_storage import cached_blob_path, cache_downloaded_blob
+from core.http_client import get_http_client
+from core.config import settings
+from services.notifications import NotificationQueue
 
 import os
-import uuid
-import requests
-from urllib.parse import urlparse
 
 router = APIRouter(prefix="/api")
 
-def _download_to_dir(url: str, dest_dir: str) -> str:
-    """
-    Descarga la URL al directorio dest_dir y devuelve la ruta absoluta del fichero.
-    Usa streaming y genera un nombre con uuid. Intenta inferir extensión desde la URL o el header.
-    """
-    parsed = urlparse(url)
-    # intenta sacar extensión de la ruta
-    ext = os.path.splitext(parsed.path)[1]
-    tmp_name = f"input_{uuid.uuid4()}{ext or ''}"
-    out_path = os.path.join(dest_dir, tmp_name)
-
-    with requests.get(url, stream=True, timeout=30) as r:
-        r.raise_for_status()
-        # si no hay ext, intenta del content-type
-        if not ext:
-            ct = r.headers.get("content-type", "")
-            if "mp4" in ct: out_path += ".mp4"
-            elif "mpeg" in ct: out_path += ".mp4"
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                if chunk:
-                    f.write(chunk)
-    return out_path
-
-
-def send_power_automate(nombre1: str, nombre2: str, email1: str, email2: str, video_uri: str, timeout: int = 30):
-    """
-    Llama a la API externa de Power Automate enviando los parámetros en el body JSON.
-    Devuelve el JSON de respuesta si existe, o el texto de la respuesta.
-    Lanza RuntimeError si falla la llamada.
-    """
-    url = ("https://default63722aa14f5d494d89d25ae5974aab.fc.environment.api.powerplatform.com:443/"
-            "powerautomate/automations/direct/workflows/d69522d29974438b8ffbfa614f2d904f/"
-            "triggers/manual/paths/invoke?api-version=1&sp=%2Ftriggers%2Fmanual%2Frun&sv=1.0&sig=Lx2g4vD_XPZey5kGryFjJmgHBnp9yIGTfF58CGD05rg")
-
-    payload = {
-        "nombre1": nombre1,
-        "nombre2": nombre2,
-        "email1": email1,
-        "email2": email2,
-        "videoURI": video_uri
-    }
-    headers = {"Content-Type": "application/json"}
-    try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=timeout)
-        resp.raise_for_status()
-        try:
-            return resp.json()
-        except ValueError:
-            return resp.text
-    except requests.RequestException as e:
-        raise RuntimeError(f"Error calling external API: {e}") from e
-
-
-@router.post("/generate_final_video")
-async def generate_final_video(req: VideoFinalRequest, vs: VideoService = Depends(get_video_service)):
+# Únicos directorios desde los que se sirven entradas locales (ficheros generados y placeholders)
+MEDIA_ROOTS = (settings.TEMP_DIR, "placeholder_assets")
+
+
+def _local_input(url: str):
+    """Entrada ya disponible en disco: media servida por la API."""
+    return local_media_path(url, MEDIA_ROOTS)
+
+
+async def _render_final_video(job: RenderJob, req: VideoFinalRequest, temp_dir: str, queue: RenderJobQueue,
+                              notifications: NotificationQueue) -> dict:
     """
-    Recibe en req URLs públicas (blob). Descarga localmente y llama a VideoService.compose_final.
-    Devuelve path absoluto y URL pública usando get_media_url.
+    Trabajo de render: descarga las entradas, compone en el pool de workers y encola el aviso
+    a Power Automate (se entrega en segundo plano, sin retrasar el fin del trabajo).
     """
     downloaded = []
-    print("Generando video final con entradas:", req.cartel_video, req.pareja_video)
     try:
-        # Asegurar que el directorio temporal exista (VideoService ya crea temp_dir)
-        temp_dir = vs.temp_dir
+        job.update(stage="downloading")
+        # Cartel y pareja a la vez, por el cliente HTTP compartido
+        downloaded = await download_all(
+            [req.cartel_video, req.pareja_video], temp_dir, get_http_client(),
+            local_lookup=_local_input, on_downloaded=cache_downloaded_blob, cache_lookup=cached_blob_path,
+        )
+        cartel_local, pareja_local = downloaded
 
-        # Cartel_video
-        cartel_local = _download_to_dir(req.cartel_video, temp_dir)
-        downloaded.append(cartel_local)
+        # Render en un proceso del pool (pasa rutas locales)
+        job.update(stage="rendering")
+        rendered = await queue.run_in_worker(job, compose_final_in_worker, req.id, cartel_local, pareja_local)
+        out = rendered["video_path"]
 
-        # Pareja_video
-        pareja_local = _download_to_dir(req.pareja_video, temp_dir)
-        downloaded.append(pareja_local)
+        notification = notifications.enqueue(
+            "power_automate",
+            {"nombre1": req.nombre1, "nombre2": req.nombre2, "email1": req.email1, "email2": req.email2,
+             "videoURI": out},
+            idempotency_key=f"final_video:{job.id}",
+        )
+        rendered["notification_id"] = notification.id
 
-        # Llamada al servicio (pasa rutas locales)
-        out = vs.compose_final(req.id, cartel_local, pareja_local)
-
-        send_power_automate(nombre1=req.nombre1, nombre2=req.nombre2, email1=req.email1, email2=req.email2, video_uri=out)
-
-        # Devolver ruta y URL pública (get_media_url debe aceptar path absoluto o convertir)
-        return {"status": "success", "video_path": out}
+        return rendered
     finally:
         # limpiar ficheros de entrada descargados
         for p in downloaded:
             try:
                 if os.path.exists(p): os.remove(p)
             except:
-                pass
\ No newline at end of file
+                pass
+
+
+@router.post("/generate_final_video", status_code=202)
+async def generate_final_video(
+    req: VideoFinalRequest,
+    vs: VideoService = Depends(get_video_service),
+    queue: RenderJobQueue = Depends(get_render_queue),
+    notifications: NotificationQueue = Depends(get_notification_queue),
+):
+    """
+    Recibe en req URLs públicas (blob) y encola el render del video final.
+    Devuelve el id del trabajo; el resultado se consulta en /render_jobs/{job_id}.
+    """
+    print("Encolando video final con entradas:", req.cartel_video, req.pareja_video)
+    job = queue.submit(
+        lambda job: _render_final_video(job, req, vs.temp_dir, queue, notifications),
+        meta={"id": req.id},
+    )
+    return {"status": "queued", "job_id": job.id}
+
+
+def _get_job_or_404(queue: RenderJobQueue, job_id: str) -> RenderJob:
+    job = queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de render no encontrado")
+    return job
+
+
+@router.get("/render_jobs/{job_id}")
+async def get_render_job(job_id: str, queue: RenderJobQueue = Depends(get_render_queue)):
+    """Estado actual del trabajo (para polling)."""
+    return _get_job_or_404(queue, job_id).to_dict()
+
+
+@router.get("/render_jobs/{job_id}/result")
+async def get_render_job_result(job_id: str, queue: RenderJobQueue = Depends(get_render_queue)):
+    """Resultado del trabajo. 409 si aún no ha terminado."""
+    job = _get_job_or_404(queue, job_id)
+    if job.status == "error":
+        raise HTTPException(status_code=500, detail=job.error)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"El trabajo sigue en estado '{job.status}'")
+    return {"status": "success", **job.result}
+
+
+@router.get("/render_jobs/{job_id}/events")
+async def render_job_events(job_id: str, queue: RenderJobQueue = Depends(get_render_queue)):
+    """Server-sent events con cada cambio de estado hasta que el trabajo termina."""
+    job = _get_job_or_404(queue, job_id)
+    return sse_response(state_stream(job.to_dict, job.wait_change, lambda st: st["status"] in ("done", "error")))
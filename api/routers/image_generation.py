@@ -1,53 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import Response, StreamingResponse
 
 import uuid
-import tempfile
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageFilter
+from fastapi.concurrency import run_in_threadpool
 import os, sys
-from schemas.generation import EditCartelRequest
+import base64
+import json
+from typing import List
+from schemas.generation import CartelPreviewRequest, EditCartelRequest
 from azure.storage.blob import BlobServiceClient, ContentSettings, generate_blob_sas, BlobSasPermissions
 from datetime import datetime, timedelta
-from utils.blob_storage import upload_to_blob_storage
+from utils.blob_storage import aupload_bytes_to_blob_storage
+from services.cartel_renderer import (
+    IMAGE_FORMATS, CartelLayout, encode_image, get_cartel_renderer, layout_for, save_image,
+)
+from services.cartel_batch import CartelBatchRenderer
+from core.config import settings
+from core.deps import get_cartel_batch_renderer
 
 router = APIRouter(prefix="/api")
 
-W, H = 1920, 1080
-
-CRIMSON_FONT = "./static/fonts/Crimson-Bouquet.otf"
-PLAYFAIR_FONT = "./static/fonts/PlayfairDisplay-Regular.ttf"
-
-def load_font(path, size):
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"No se encontró la fuente: {path}")
-    return ImageFont.truetype(path, size=size)
-
-def visible_height(font, text):
-    dummy = Image.new("L", (10, 10), 0)
-    d = ImageDraw.Draw(dummy)
-    bbox = d.textbbox((0, 0), text if text else " ", font=font)
-    return bbox[3] - bbox[1]
-
-def text_width(draw, text, font):
-    return int(draw.textlength(text, font=font))
-
-def draw_text_with_shadow(base_img, text, font, x, y,
-                          text_color="#FFFFFF",
-                          shadow_color="#35302C37",
-                          shadow_offset=(1, 2),
-                          shadow_blur=5):
-    """Dibuja texto con sombra difusa."""
-    shadow_layer = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
-    sd = ImageDraw.Draw(shadow_layer)
-    sx, sy = shadow_offset
-    sd.text((x + sx, y + sy), text, font=font, fill=shadow_color)
-    if shadow_blur > 0:
-        shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
-    base_img = Image.alpha_composite(base_img, shadow_layer)
-
-    d = ImageDraw.Draw(base_img)
-    d.text((x, y), text, font=font, fill=text_color)
-    return base_img
-
 def render_save_the_date(
     input_image: str,
     output_image: str,
@@ -61,95 +33,118 @@ def render_save_the_date(
     shadow_blur: int = 5,
     l2_size: int = 76,
 ):
-    img = Image.open(input_image).convert("RGBA")
-    img = ImageOps.exif_transpose(img)
-
-    if img.size != (W, H):
-        raise ValueError(f"La imagen debe ser {W}x{H}. Actual: {img.size}")
-
-    draw = ImageDraw.Draw(img)
-
-    # Textos y tamaños fijos
-    l1_text, l1_size, l1_font = "Save the Date", 120, CRIMSON_FONT
-    l2_text, l2_font = names, PLAYFAIR_FONT
-    l3_text, l3_size, l3_font = date_str, 66, PLAYFAIR_FONT
-
-    # Cargar fuentes
-    f1 = load_font(l1_font, l1_size)
-    f2 = load_font(l2_font, l2_size)
-    f3 = load_font(l3_font, l3_size)
-
-    # Calcular alturas visibles
-    h1 = visible_height(f1, l1_text)
-    h2 = visible_height(f2, l2_text)
-    h3 = visible_height(f3, l3_text)
-
-    total_h = h1 + line_spacing_top + h2 + line_spacing_main + h3
-    cur_y = (H - total_h) // 2 + vertical_shift
-
-    def draw_centered_line(text, font, y):
-        w = text_width(draw, text, font)
-        x = (W - w) // 2
-        nonlocal img
-        img = draw_text_with_shadow(
-            img,
-            text,
-            font,
-            x,
-            y,
-            text_color="#FFFFFF",
-            shadow_color=shadow_color,
-            shadow_offset=shadow_offset,
-            shadow_blur=shadow_blur,
-        )
-
-    draw_centered_line(l1_text, f1, cur_y)
-    cur_y += h1 + line_spacing_top
-    draw_centered_line(l2_text, f2, cur_y)
-    cur_y += h2 + line_spacing_main
-    draw_centered_line(l3_text, f3, cur_y)
-
-    ext = os.path.splitext(output_image)[1].lower()
-    if ext == ".png":
-        img.save(output_image)
-    else:
-        img.convert("RGB").save(output_image, quality=100, subsampling=0)
+    """Renderiza el cartel con el motor cacheado (plantilla y fuentes) y lo guarda en output_image."""
+    layout = CartelLayout(
+        line_spacing_main=line_spacing_main,
+        line_spacing_top=line_spacing_top,
+        vertical_shift=vertical_shift,
+        shadow_color=shadow_color,
+        shadow_offset=shadow_offset,
+        shadow_blur=shadow_blur,
+        l2_size=l2_size,
+    )
+    img = get_cartel_renderer(input_image).render(names, date_str, layout)
+    save_image(img, output_image)
 
 
 
-@router.post("/edit_cartel_image")
-async def edit_cartel_image(data: EditCartelRequest):
-
+def _input_image() -> str:
     # input fijo
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     input_img = os.path.join(base_dir, "static", "img", "WoodenSign.jpg")
     if not os.path.exists(input_img):
         raise HTTPException(status_code=500, detail=f"Imagen de entrada no encontrada: {input_img}")
+    return input_img
 
-    # output temporal
-    out_name = f"img_cartel_{data.id}.jpg"
-    out_path = os.path.join(tempfile.gettempdir(), out_name)
 
-    # Llamada a la función de render
-    names = f"{data.nombre1} y {data.nombre2}"
-    fecha = f"{data.fecha}"
+@router.post("/edit_cartel_image")
+async def edit_cartel_image(data: EditCartelRequest):
 
-    sum_chars = len(data.nombre1) + len(data.nombre2)
+    input_img = _input_image()
 
-    if sum_chars > 10:
-        render_save_the_date(input_image=input_img, output_image=out_path, names=names, date_str=fecha)
-    else:
-        render_save_the_date(input_image=input_img, output_image=out_path, names=names, date_str=fecha, vertical_shift=-74, line_spacing_top=1, line_spacing_main=38, l2_size=102)
+    names = f"{data.nombre1} y {data.nombre2}"
+    fecha = f"{data.fecha}"
 
-    # Upload to Blob
-    file_id, public_url = upload_to_blob_storage(
-        file_path=out_path,
-        filename=f'img_cartel_{data.id}',
-        content_type="image/jpeg",
-        folder=data.id  # Optional: organize files in folders
+    layout = layout_for(data.nombre1, data.nombre2)
+    renderer = get_cartel_renderer(input_img)
+    img = await run_in_threadpool(renderer.render, names, fecha, layout)
+    # Encode en memoria y subida directa: sin fichero temporal intermedio
+    try:
+        content = await run_in_threadpool(encode_image, img, data.format, data.quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    file_id, public_url = await _upload_cartel(
+        content, f'img_cartel_{data.id}', data.id, IMAGE_FORMATS[data.format].content_type
     )
 
     return {
         "image_id": file_id,
         "image_url": public_url
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/edit_cartel_image/preview")
+async def preview_cartel_image(data: CartelPreviewRequest):
+    """
+    Previsualización rápida del cartel mientras se escriben los nombres.
+
+    Se renderiza a escala reducida y se devuelve en la propia respuesta, sin subir nada a
+    Blob Storage. El cartel a resolución completa se genera al confirmar (/edit_cartel_image).
+    """
+    renderer = get_cartel_renderer(_input_image())
+    names = f"{data.nombre1} y {data.nombre2}"
+    layout = layout_for(data.nombre1, data.nombre2)
+
+    def render() -> bytes:
+        img = renderer.render(names, f"{data.fecha}", layout, scale=data.scale)
+        return encode_image(img, data.format, data.quality)
+
+    try:
+        content = await run_in_threadpool(render)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    content_type = IMAGE_FORMATS[data.format].content_type
+    if data.inline == "base64":
+        encoded = base64.b64encode(content).decode("ascii")
+        return {"image": f"data:{content_type};base64,{encoded}", "scale": data.scale}
+    # Cada previsualización es distinta: que el navegador no la guarde
+    return Response(content=content, media_type=content_type, headers={"Cache-Control": "no-store"})
+
+
+async def _upload_cartel(content: bytes, filename: str, folder: str, content_type: str):
+    return await aupload_bytes_to_blob_storage(
+        content,
+        ContentSettings(content_type=content_type),
+        filename=filename,
+        folder=folder,
+    )
+
+
+@router.post("/edit_cartel_image/batch")
+async def edit_cartel_images_batch(
+    items: List[EditCartelRequest],
+    renderer: CartelBatchRenderer = Depends(get_cartel_batch_renderer),
+):
+    """
+    Genera varios carteles de una vez (p. ej. ferias con cientos de parejas).
+
+    Los carteles se renderizan en el pool de procesos y se suben mientras se renderizan
+    los siguientes. La respuesta es NDJSON: una línea por cartel en cuanto termina, con
+    `index` (posición en la petición), `id`, `status` ("done" | "error") e `image_url`.
+    """
+    if not items:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(items) > settings.CARTEL_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"Máximo {settings.CARTEL_BATCH_MAX_ITEMS} carteles por lote"
+        )
+    if not os.path.exists(renderer.base_image):
+        raise HTTPException(status_code=500, detail=f"Imagen de entrada no encontrada: {renderer.base_image}")
+
+    async def lines():
+        async for result in renderer.run(items, _upload_cartel):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
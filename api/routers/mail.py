@@ -19,7 +19,7 @@ async def send_email(
     
     try:
         # Send the email using delegated permissions
-        success = graph.send_email(
+        success = await graph.send_email(
             to_email=data.to_email,
             subject=data.subject or "Sin asunto",
             message=data.message or "",
@@ -64,7 +64,7 @@ async def get_user_info(
     #This can be used to verify authentication and get user details.
     
     try:
-        user_info = graph.get_user_info()
+        user_info = await graph.get_user_info()
         return {
             "status": "success",
             "user": {
@@ -82,15 +82,18 @@ async def get_user_info(
 
 
 # routers/mail.py
-from fastapi import APIRouter, Request, HTTPException, Query
+import asyncio
+from fastapi import APIRouter, Depends, Header, Request, HTTPException, Query
 from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
-import httpx
 from core.config import settings
-from core.msal_client import build_cca, get_scopes
-from schemas.mail import SendEmailIn
+from core.deps import get_notification_queue
+from core.msal_client import session_cca, asession_cca, get_scopes, get_session_id
+from schemas.mail import SendEmailIn, SendBulkEmailIn, BulkMailResultOut
+from services.graph_batch import GraphBatchMailer, BulkMessage
+from services.notifications import NotificationQueue, scoped_idempotency_key
 
 router = APIRouter(prefix="/mail", tags=["mail"])
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+GRAPH_BASE = settings.GRAPH_BASE
 
 
 def _build_graph_message(p: SendEmailIn) -> dict:
@@ -132,15 +135,15 @@ def login(request: Request,
     """
     if popup:
         request.session["pm_origin"] = origin or str(settings.FRONTEND_URL)
-    cca = build_cca(request)
     state = "mail"
     request.session["state"] = state
-    auth_url = cca.get_authorization_request_url(
-        scopes=get_scopes(),
-        redirect_uri=settings.REDIRECT_URI,
-        state=state,
-        prompt="select_account",
-    )
+    with session_cca(request) as cca:
+        auth_url = cca.get_authorization_request_url(
+            scopes=get_scopes(),
+            redirect_uri=settings.REDIRECT_URI,
+            state=state,
+            prompt="select_account",
+        )
     return RedirectResponse(url=auth_url)
 
 
@@ -158,12 +161,13 @@ def callback(
     if not code or state != request.session.get("state"):
         raise HTTPException(status_code=400, detail="Estado inválido o falta 'code'.")
 
-    cca = build_cca(request)
-    result = cca.acquire_token_by_authorization_code(
-        code=code,
-        scopes=get_scopes(),
-        redirect_uri=settings.REDIRECT_URI,
-    )
+    # Al salir del bloque la caché de la sesión (ya con la cuenta) se guarda en el store
+    with session_cca(request) as cca:
+        result = cca.acquire_token_by_authorization_code(
+            code=code,
+            scopes=get_scopes(),
+            redirect_uri=settings.REDIRECT_URI,
+        )
     if "access_token" not in result:
         raise HTTPException(status_code=401, detail=result.get("error_description", "No se pudo canjear el código."))
 
@@ -195,40 +199,78 @@ def callback(
 
 @router.get("/me")
 def me(request: Request):
-    cca = build_cca(request)
-    accounts = cca.get_accounts()
-    if not accounts:
-        return {"authenticated": False}
-    result = cca.acquire_token_silent(get_scopes(), account=accounts[0])
+    with session_cca(request) as cca:
+        accounts = cca.get_accounts()
+        if not accounts:
+            return {"authenticated": False}
+        result = cca.acquire_token_silent(get_scopes(), account=accounts[0])
     return {"authenticated": bool(result and "access_token" in result)}
 
-@router.post("/send")
-async def send(request: Request, payload: SendEmailIn):
-    cca = build_cca(request)
-    accounts = cca.get_accounts()
-    if not accounts:
-        return RedirectResponse(url="/mail/login", status_code=307)
-
-    result = cca.acquire_token_silent(get_scopes(), account=accounts[0])
+@router.post("/send", status_code=202)
+async def send(
+    request: Request,
+    payload: SendEmailIn,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    queue: NotificationQueue = Depends(get_notification_queue),
+):
+    """
+    Encola el correo y responde en el acto. Un worker lo envía con el token de esta
+    sesión; el estado se consulta en /api/notifications/{notification_id}. Con la cabecera
+    Idempotency-Key un reintento de la misma sesión no duplica el correo.
+    """
+    async with asession_cca(request) as cca:
+        accounts = await asyncio.to_thread(cca.get_accounts)
+        if not accounts:
+            return RedirectResponse(url="/mail/login", status_code=307)
+        # Puede renovar el token con el refresh token (red): fuera del event loop
+        result = await asyncio.to_thread(cca.acquire_token_silent, get_scopes(), account=accounts[0])
     if not result or "access_token" not in result:
         return RedirectResponse(url="/mail/login", status_code=307)
 
-    graph_payload = _build_graph_message(payload)
+    sid = get_session_id(request)
+    n = queue.enqueue(
+        "email",
+        {"sid": sid, "message": _build_graph_message(payload)},
+        # La clave solo vale dentro de la sesión: otra sesión con la misma clave envía su correo
+        idempotency_key=scoped_idempotency_key(f"sid:{sid}", idempotency_key),
+    )
+    return {"status": n.status, "notification_id": n.id}
+
+
+@router.post("/send_bulk", response_model=list[BulkMailResultOut])
+async def send_bulk(request: Request, payload: SendBulkEmailIn):
+    """
+    Envía varios correos desde la cuenta de la sesión agrupándolos en peticiones $batch
+    de Graph (hasta 20 por lote). Devuelve el estado de cada mensaje, en el orden recibido.
+    """
+    if not payload.messages:
+        raise HTTPException(status_code=400, detail="No hay mensajes que enviar.")
+    if len(payload.messages) > settings.MAIL_BULK_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.MAIL_BULK_MAX_MESSAGES} mensajes por envío.")
+
+    async with asession_cca(request) as cca:
+        accounts = await asyncio.to_thread(cca.get_accounts)
+        if not accounts:
+            return RedirectResponse(url="/mail/login", status_code=307)
+
+        async def token() -> str:
+            # MSAL devuelve el token cacheado o lo renueva con el refresh token (síncrono: fuera del loop)
+            result = await asyncio.to_thread(cca.acquire_token_silent, get_scopes(), account=accounts[0])
+            if not result or "access_token" not in result:
+                raise HTTPException(status_code=401, detail="Sesión caducada: vuelve a iniciar sesión.")
+            return result["access_token"]
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(
-            f"{GRAPH_BASE}/me/sendMail",
-            headers={
-                "Authorization": f"Bearer {result['access_token']}",
-                "Content-Type": "application/json",
-            },
-            json=graph_payload,
+        await token()  # sin sesión válida no se envía nada
+        mailer = GraphBatchMailer(
+            GRAPH_BASE,
+            token,
+            max_concurrency=settings.GRAPH_BATCH_CONCURRENCY,
+            max_attempts=settings.GRAPH_BATCH_MAX_ATTEMPTS,
         )
-    if resp.status_code not in (200, 202):
-        try:
-            err = resp.json()
-        except Exception:
-            err = resp.text
-        raise HTTPException(status_code=resp.status_code, detail={"graph_error": err})
-
-    return {"status": "sent"}
+        messages = [BulkMessage(id=str(i), payload=_build_graph_message(p)) for i, p in enumerate(payload.messages)]
+        results = await mailer.send(messages)
+    return [
+        BulkMailResultOut(index=int(r.id), status=r.status, status_code=r.status_code,
+                          attempts=r.attempts, error=r.error)
+        for r in results
+    ]
@@ -1,10 +1,24 @@
 import os
 import uuid
-from fastapi import APIRouter, HTTPException, UploadFile, File
+import asyncio
+import tempfile
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse
 from typing import Tuple
-import requests
-from utils.blob_storage import upload_bytes_to_blob_storage
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, UnidentifiedImageError
+from utils.blob_storage import aupload_bytes_to_blob_storage
+from utils.images import normalize_photo
+from utils.uploads import stream_upload_to_file
+from services.runway_service import RATIO
+from core.config import settings
+from core.http_client import request as http_request
+
+# Tamaño con el que se llama a Runway ("1280:720")
+RUNWAY_SIZE = tuple(int(v) for v in RATIO.split(":"))
+
+_normalize_slots = asyncio.Semaphore(settings.UPLOAD_MAX_CONCURRENCY)
 
 router = APIRouter(prefix="/api")
 
@@ -24,30 +38,40 @@ def serve_media(file_path: str):
 
 
 @router.post("/saveImage")
-async def save_image(file: UploadFile = File(...)):
+async def save_image(request: Request):
     """
-    Recibe una imagen desde el front, la sube a Azure Blob Storage usando
-    upload_bytes_to_blob_storage y devuelve la URL pública.
+    Recibe una imagen desde el front (campo `file` de un multipart), la normaliza para Runway
+    (orientación EXIF, recorte y escalado a la proporción del video, sin metadatos), la sube
+    a Azure Blob Storage usando aupload_bytes_to_blob_storage y devuelve la URL pública.
+
+    La subida se lee en streaming: el tamaño máximo se aplica según llegan los bytes y el
+    tipo se valida por su firma, sin tener el fichero completo en memoria.
     """
     unique_id = str(uuid.uuid4().hex) #id único para el archivo y nombre de la carpeta
     filename = f'img_pareja_{unique_id}'
 
-    # Validar tipo de archivo
-    allowed_types = {"image/png", "image/jpeg", "image/jpg", "image/webp"}
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Unsupported image type")
-
-    # Leer contenido
+    fd, upload_path = tempfile.mkstemp(prefix="upload_", dir=settings.TEMP_DIR)
+    os.close(fd)
     try:
-        content = await file.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading uploaded file: {e}")
+        size, detected_type = await stream_upload_to_file(request, "file", upload_path, settings.UPLOAD_MAX_BYTES)
+        print(f"Imagen recibida: {size} bytes ({detected_type})")
+
+        # Decodificar + normalizar es CPU: fuera del event loop, y acotado para que varias
+        # subidas a la vez no disparen la memoria. Se guarda solo el derivado (JPEG 1280x720),
+        # que es lo que viaja después a Runway y a la caché de generaciones.
+        async with _normalize_slots:
+            try:
+                content = await run_in_threadpool(normalize_photo, upload_path, RUNWAY_SIZE)
+            except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
 
-    # Preparar content settings como dict (upload_bytes_to_blob_storage acepta dict)
-    content_settings = {"content_type": file.content_type}
+    content_settings = {"content_type": "image/jpeg"}
 
     try:
-        file_id, public_url = upload_bytes_to_blob_storage(
+        file_id, public_url = await aupload_bytes_to_blob_storage(
             video_content=content,
             content_settings=content_settings,
             filename=filename,
@@ -64,7 +88,7 @@ async def save_image(file: UploadFile = File(...)):
     return {"id": unique_id, "file_id": file_id, "image_url": public_url}
 
 
-def send_power_automate(nombre1: str, nombre2: str, email1: str, email2: str, video_uri: str, timeout: int = 30):
+async def send_power_automate(nombre1: str, nombre2: str, email1: str, email2: str, video_uri: str, timeout: int = 30):
     """
     Llama a la API externa de Power Automate enviando los parámetros en el body JSON.
     Devuelve el JSON de respuesta si existe, o el texto de la respuesta.
@@ -83,11 +107,11 @@ def send_power_automate(nombre1: str, nombre2: str, email1: str, email2: str, vi
     }
     headers = {"Content-Type": "application/json"}
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=timeout)
+        resp = await http_request("POST", url, json=payload, headers=headers, timeout=timeout)
         resp.raise_for_status()
         try:
             return resp.json()
         except ValueError:
             return resp.text
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise RuntimeError(f"Error calling external API: {e}") from e
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Depends, HTTPException
+from core.deps import get_notification_queue
+from services.notifications import NotificationQueue
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/notifications/{notification_id}")
+async def get_notification(notification_id: str, queue: NotificationQueue = Depends(get_notification_queue)):
+    """Estado de entrega de una notificación encolada (queued, sending, sent, failed)."""
+    n = queue.get(notification_id)
+    if n is None:
+        raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    return n.to_dict()
@@ -1,14 +1,9 @@
 import os
 from typing import Optional
-from fastapi import HTTPException, APIRouter
+from fastapi import APIRouter, Depends, Header
 from pydantic import BaseModel, constr
-import httpx
-from core.config import settings
-
-WHATSAPP_TOKEN = settings.WHATSAPP_TOKEN
-PHONE_NUMBER_ID = settings.WHATSAPP_PHONE_NUMBER_ID
-GRAPH_API_VERSION = settings.GRAPH_API_VERSION
-API_URL = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{PHONE_NUMBER_ID}/messages"
+from core.deps import get_notification_queue
+from services.notifications import NotificationQueue, scoped_idempotency_key
 
 class SendMessageReq(BaseModel):
     to: constr(strip_whitespace=True)
@@ -27,12 +22,20 @@ def ensure_e164(msisdn: str) -> str:
 
 router = APIRouter(prefix="/api")
 
-@router.post("/whatsapp/send")
-async def send_whatsapp(req: SendMessageReq):
+@router.post("/whatsapp/send", status_code=202)
+async def send_whatsapp(
+    req: SendMessageReq,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    queue: NotificationQueue = Depends(get_notification_queue),
+):
+    """
+    Encola el mensaje y responde en el acto; el estado de entrega se consulta en
+    /api/notifications/{notification_id}. Con la cabecera Idempotency-Key un reintento
+    del cliente no duplica el mensaje. La clave se acota al destinatario: la misma clave
+    hacia otro número es otro mensaje.
+    """
+    print("Encolando WhatsApp a", req.to)
 
-    print("Enviando WhatsApp a", req.to)
-    
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     to = ensure_e164(req.to)
 
     payload = {
@@ -68,9 +71,5 @@ async def send_whatsapp(req: SendMessageReq):
             }
         }"""
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(API_URL, headers=headers, json=payload)
-        if r.status_code >= 400:
-            # WhatsApp devuelve errores útiles en JSON
-            raise HTTPException(status_code=r.status_code, detail=r.text)
-        return r.json()
\ No newline at end of file
+    n = queue.enqueue("whatsapp", payload, idempotency_key=scoped_idempotency_key(f"to:{to}", idempotency_key))
+    return {"status": n.status, "notification_id": n.id}
\ No newline at end of file
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
 from datetime import date
 
 class EditCartelRequest(BaseModel):
@@ -12,6 +12,20 @@ class EditCartelRequest(BaseModel):
     telef2: str
     fecha: str
     image_url: str
+    # Formato de salida del cartel; quality None = la del formato (JPEG 100, WebP 90, AVIF 75)
+    format: Literal["jpeg", "webp", "avif", "png"] = "jpeg"
+    quality: Optional[int] = Field(default=None, ge=1, le=100)
+
+class CartelPreviewRequest(BaseModel):
+    nombre1: str
+    nombre2: str
+    fecha: str
+    # Previsualización: tamaño reducido y calidad baja; el cartel definitivo va por /edit_cartel_image
+    scale: float = Field(default=0.5, gt=0, le=1)
+    format: Literal["jpeg", "webp", "avif", "png"] = "jpeg"
+    quality: Optional[int] = Field(default=80, ge=1, le=100)
+    # "bytes": la imagen tal cual en la respuesta; "base64": JSON con un data URI
+    inline: Literal["bytes", "base64"] = "bytes"
 
 class Persona(BaseModel):
     nombre: str
@@ -41,6 +55,12 @@ class ParejaVidRequest(BaseModel):
     image_url: str
     demo: bool
 
+class GenerationRequest(BaseModel):
+    kind: Literal["cartel", "pareja"]
+    id: str
+    image_url: str
+    demo: bool = False
+
 class VideoFinalRequest(BaseModel):
     id: str
     nombre1: str
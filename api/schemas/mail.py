@@ -16,3 +16,13 @@ class SendEmailIn(BaseModel):
     bcc: Optional[List[EmailStr]] = None
     save_to_sent_items: bool = True
     attachments: Optional[List[AttachmentIn]] = None
+
+class SendBulkEmailIn(BaseModel):
+    messages: List[SendEmailIn]
+
+class BulkMailResultOut(BaseModel):
+    index: int
+    status: str  # "sent" | "failed"
+    status_code: int
+    attempts: int
+    error: Optional[str] = None
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from schemas.generation import EditCartelRequest
+from services.cartel_renderer import (
+    BASE_IMAGE, IMAGE_FORMATS, CartelLayout, encode_image, get_cartel_renderer, layout_for,
+)
+
+# Subida de un cartel ya codificado: (bytes, filename, folder, content_type) -> (image_id, image_url)
+Uploader = Callable[[bytes, str, str, str], Awaitable[Tuple[str, str]]]
+
+
+def render_cartel_in_worker(base_image: str, names: str, date_str: str, layout: CartelLayout,
+                            fmt: str = "jpeg", quality: Optional[int] = None) -> bytes:
+    """
+    Punto de entrada del worker: renderiza y codifica el cartel en el proceso hijo.
+    Devuelve la imagen codificada (no la RGBA, que pesaría ~8 MB al volver por el pipe).
+    El renderer queda cacheado en cada worker, así que la plantilla se decodifica una vez por proceso.
+    """
+    img = get_cartel_renderer(base_image).render(names, date_str, layout)
+    return encode_image(img, fmt, quality)
+
+
+class CartelBatchRenderer:
+    """
+    Render de carteles por lotes.
+
+    Cada cartel pasa por dos etapas encadenadas: render + encode en un pool de procesos
+    y subida a Blob Storage en el event loop. Las etapas se solapan (mientras un cartel
+    se sube, los workers ya están con los siguientes) y cada una tiene su propio límite:
+    `max_workers` renders y `upload_concurrency` subidas a la vez. Los resultados se
+    entregan en orden de finalización.
+
+    Backends:
+        - "process": ProcessPoolExecutor (producción, usa varios núcleos).
+        - "local":   ThreadPoolExecutor en el mismo proceso (tests / desarrollo).
+    """
+
+    def __init__(self, backend: str = "process", max_workers: int = 2, upload_concurrency: int = 4,
+                 base_image: str = BASE_IMAGE):
+        if backend not in ("process", "local"):
+            raise ValueError(f"Backend de render desconocido: {backend}")
+        self.backend = backend
+        self.max_workers = max(1, max_workers)
+        self.upload_concurrency = max(1, upload_concurrency)
+        self.base_image = base_image
+        self._executor: Optional[Executor] = None
+
+    def _ensure_started(self) -> Executor:
+        if self._executor is None:
+            if self.backend == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cartel")
+        return self._executor
+
+    async def render(self, item: EditCartelRequest) -> bytes:
+        executor = self._ensure_started()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, render_cartel_in_worker, self.base_image,
+            f"{item.nombre1} y {item.nombre2}", f"{item.fecha}", layout_for(item.nombre1, item.nombre2),
+            item.format, item.quality,
+        )
+
+    async def run(self, items: List[EditCartelRequest], upload: Uploader) -> AsyncIterator[dict]:
+        """
+        Procesa el lote y va devolviendo un resultado por cartel según terminan.
+        Un fallo en un cartel no detiene el resto: se devuelve como status "error".
+        """
+        # Se mantiene algo más de trabajo en vuelo que workers para que el pool no quede ocioso
+        render_slots = asyncio.Semaphore(self.max_workers * 2)
+        upload_slots = asyncio.Semaphore(self.upload_concurrency)
+        # Cada cartel ocupa un hueco desde que empieza a renderizarse hasta que termina de subirse:
+        # en memoria hay como mucho esos carteles codificados, aunque las subidas vayan más lentas
+        in_flight = asyncio.Semaphore(self.max_workers * 2 + self.upload_concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def process(index: int, item: EditCartelRequest):
+            start = time.perf_counter()
+            try:
+                async with in_flight:
+                    async with render_slots:
+                        content = await self.render(item)
+                    async with upload_slots:
+                        image_id, image_url = await upload(
+                            content, f"img_cartel_{item.id}", item.id, IMAGE_FORMATS[item.format].content_type
+                        )
+                result = {"status": "done", "image_id": image_id, "image_url": image_url}
+            except Exception as e:
+                print(f"Error en el cartel {item.id}:", repr(e))
+                result = {"status": "error", "error": getattr(e, "detail", None) or str(e)}
+            result.update(index=index, id=item.id, elapsed=round(time.perf_counter() - start, 3))
+            results.put_nowait(result)
+
+        tasks = [asyncio.create_task(process(i, item)) for i, item in enumerate(items)]
+        try:
+            for _ in tasks:
+                yield await results.get()
+        finally:
+            # Cliente desconectado (o fin del lote): no se siguen subiendo carteles que nadie leerá
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,305 @@
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Optional
+
+from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont, ImageOps
+
+W, H = 1920, 1080
+
+CRIMSON_FONT = "./static/fonts/Crimson-Bouquet.otf"
+PLAYFAIR_FONT = "./static/fonts/PlayfairDisplay-Regular.ttf"
+BASE_IMAGE = "./static/img/WoodenSign.jpg"
+
+# Plantillas reducidas que se guardan (LRU); la escala se redondea a centésimas
+MAX_SCALED_TEMPLATES = 4
+
+
+@dataclass(frozen=True)
+class CartelLayout:
+    """Parámetros de maquetación del bloque de texto del cartel."""
+    line_spacing_main: int = 32      # Espacio entre líneas 2 y 3
+    line_spacing_top: int = 2        # Espacio entre línea 1 y 2 (más pequeño)
+    vertical_shift: int = -78        # Desplaza todo el bloque (negativo = hacia arriba)
+    shadow_color: str = "#35302C37"
+    shadow_offset: tuple = (1, 2)
+    shadow_blur: int = 5
+    l1_size: int = 120
+    l2_size: int = 76
+    l3_size: int = 66
+
+    def scaled(self, scale: float) -> "CartelLayout":
+        """Misma maquetación para un cartel de `scale` veces el tamaño (previsualización)."""
+        if scale == 1:
+            return self
+        px = lambda v: int(round(v * scale))
+        sx, sy = self.shadow_offset
+        return replace(
+            self,
+            line_spacing_main=px(self.line_spacing_main),
+            line_spacing_top=px(self.line_spacing_top),
+            vertical_shift=px(self.vertical_shift),
+            shadow_offset=(px(sx), px(sy)),
+            shadow_blur=self.shadow_blur * scale,
+            l1_size=max(1, px(self.l1_size)),
+            l2_size=max(1, px(self.l2_size)),
+            l3_size=max(1, px(self.l3_size)),
+        )
+
+
+# Nombres cortos: la línea de nombres va más grande y el bloque se reajusta
+SHORT_NAMES_LAYOUT = CartelLayout(vertical_shift=-74, line_spacing_top=1, line_spacing_main=38, l2_size=102)
+DEFAULT_LAYOUT = CartelLayout()
+
+
+def layout_for(nombre1: str, nombre2: str) -> CartelLayout:
+    return DEFAULT_LAYOUT if len(nombre1) + len(nombre2) > 10 else SHORT_NAMES_LAYOUT
+
+
+@lru_cache(maxsize=32)
+def load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Fuente cacheada por (ruta, tamaño): truetype solo se carga la primera vez."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No se encontró la fuente: {path}")
+    return ImageFont.truetype(path, size=size)
+
+
+@lru_cache(maxsize=1024)
+def text_metrics(path: str, size: int, text: str) -> tuple:
+    """
+    (bbox, alto visible, ancho) de `text` con la fuente (ruta, tamaño). Cacheado: mientras
+    se escriben los nombres, "Save the Date" y la fecha no se vuelven a medir.
+    """
+    font = load_font(path, size)
+    return font.getbbox(text), visible_height(font, text), text_width(font, text)
+
+
+def visible_height(font: ImageFont.FreeTypeFont, text: str) -> int:
+    # Mismo resultado que ImageDraw.textbbox((0, 0), ...) sin crear una imagen auxiliar
+    bbox = font.getbbox(text if text else " ")
+    return bbox[3] - bbox[1]
+
+
+def text_width(font: ImageFont.FreeTypeFont, text: str) -> int:
+    return int(font.getlength(text))
+
+
+def _paste_clipped(img: Image.Image, layer: Image.Image, x: int, y: int):
+    # alpha_composite no admite destinos negativos ni capas que se salgan del cartel
+    cx0, cy0 = max(0, -x), max(0, -y)
+    cx1, cy1 = min(layer.width, img.width - x), min(layer.height, img.height - y)
+    if cx1 > cx0 and cy1 > cy0:
+        img.alpha_composite(layer, dest=(x + cx0, y + cy0), source=(cx0, cy0, cx1, cy1))
+
+
+def _blur_margin(radius: float) -> int:
+    # Alcance del GaussianBlur de Pillow (3 pasadas de box blur): con este margen el
+    # recorte difuminado es idéntico a difuminar la capa completa
+    return int(math.ceil(radius * 3)) + 2
+
+
+@lru_cache(maxsize=256)
+def _line_overlay(text: str, path: str, size: int, shadow_color: str, shadow_offset: tuple,
+                  shadow_blur: float) -> tuple:
+    """
+    Línea de texto ya rasterizada (sombra difuminada + texto) en una capa RGBA transparente,
+    con su desplazamiento respecto al origen del texto. Solo para previsualizar: al componer
+    la capa de una vez el redondeo puede variar unos pocos LSB respecto al dibujo directo.
+    """
+    font = load_font(path, size)
+    sx, sy = shadow_offset
+    left, top, right, bottom = text_metrics(path, size, text)[0]
+    margin = _blur_margin(shadow_blur) if shadow_blur > 0 else 0
+    x0 = min(0, sx) + left - margin
+    y0 = min(0, sy) + top - margin
+    x1 = max(0, sx) + right + margin
+    y1 = max(0, sy) + bottom + margin
+    layer_size = (x1 - x0, y1 - y0)
+
+    # El texto se rasteriza una sola vez: la misma máscara sirve para la sombra y para el texto
+    mask = Image.new("L", layer_size, 0)
+    ImageDraw.Draw(mask).text((-x0, -y0), text, font=font, fill=255)
+
+    shadow_rgba = ImageColor.getrgb(shadow_color)
+    shadow_alpha = shadow_rgba[3] if len(shadow_rgba) == 4 else 255
+    layer = Image.new("RGBA", layer_size, shadow_rgba[:3] + (0,))
+    shadow_mask = Image.new("L", layer_size, 0)
+    shadow_mask.paste(mask.point(lambda v: v * shadow_alpha // 255), (sx, sy))
+    layer.putalpha(shadow_mask)
+    if shadow_blur > 0:
+        layer = layer.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
+    text_layer = Image.new("RGBA", layer_size, (255, 255, 255, 0))
+    text_layer.putalpha(mask)
+    layer.alpha_composite(text_layer)
+    return layer, x0, y0
+
+
+class CartelRenderer:
+    """
+    Motor de render del cartel "Save the Date".
+
+    La imagen base se decodifica (y se endereza por EXIF) una sola vez; cada render parte
+    de una copia. Las fuentes se cachean por (ruta, tamaño) y la sombra de cada línea se
+    difumina solo dentro de la caja del texto (más el margen del blur), no en una capa
+    RGBA del tamaño del cartel.
+    """
+
+    def __init__(self, base_image: str = BASE_IMAGE, size: tuple = (W, H)):
+        img = Image.open(base_image)
+        img = ImageOps.exif_transpose(img.convert("RGBA"))
+        if img.size != size:
+            raise ValueError(f"La imagen debe ser {size[0]}x{size[1]}. Actual: {img.size}")
+        img.load()
+        self.base = img
+        self.size = size
+        # Plantillas reducidas para previsualizar, por escala (la de tamaño completo es self.base)
+        self._scaled: "OrderedDict[float, Image.Image]" = OrderedDict()
+        self._scaled_lock = threading.Lock()
+
+    @staticmethod
+    def quantize_scale(scale: float) -> float:
+        """Escala redondeada a centésimas: 0.5 y 0.5000001 comparten plantilla."""
+        return min(1.0, max(0.01, round(float(scale), 2)))
+
+    def base_for(self, scale: float) -> Image.Image:
+        scale = self.quantize_scale(scale)
+        if scale == 1.0:
+            return self.base
+        with self._scaled_lock:
+            base = self._scaled.get(scale)
+            if base is not None:
+                self._scaled.move_to_end(scale)
+                return base
+        size = (max(1, int(round(self.size[0] * scale))), max(1, int(round(self.size[1] * scale))))
+        base = self.base.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        with self._scaled_lock:
+            base = self._scaled.setdefault(scale, base)
+            self._scaled.move_to_end(scale)
+            while len(self._scaled) > MAX_SCALED_TEMPLATES:
+                self._scaled.popitem(last=False)
+        return base
+
+    def _draw_text_with_shadow(self, img: Image.Image, text: str, font, bbox: tuple, x: int, y: int,
+                               text_color: str, layout: CartelLayout):
+        sx, sy = layout.shadow_offset
+        left, top, right, bottom = bbox
+        margin = _blur_margin(layout.shadow_blur) if layout.shadow_blur > 0 else 0
+        # Caja de la sombra (recortada a la imagen) en coordenadas del cartel
+        x0 = max(0, x + sx + left - margin)
+        y0 = max(0, y + sy + top - margin)
+        x1 = min(img.width, x + sx + right + margin)
+        y1 = min(img.height, y + sy + bottom + margin)
+        if x1 > x0 and y1 > y0:
+            patch = Image.new("RGBA", (x1 - x0, y1 - y0), (0, 0, 0, 0))
+            ImageDraw.Draw(patch).text((x + sx - x0, y + sy - y0), text, font=font, fill=layout.shadow_color)
+            if layout.shadow_blur > 0:
+                patch = patch.filter(ImageFilter.GaussianBlur(radius=layout.shadow_blur))
+            img.alpha_composite(patch, dest=(x0, y0))
+
+        ImageDraw.Draw(img).text((x, y), text, font=font, fill=text_color)
+
+    def render(self, names: str, date_str: str, layout: CartelLayout = DEFAULT_LAYOUT,
+               scale: float = 1.0) -> Image.Image:
+        """
+        Devuelve el cartel en RGBA. Con `scale` < 1 se renderiza directamente a tamaño
+        reducido (plantilla, fuentes y maquetación escaladas) para previsualizar.
+        """
+        scale = self.quantize_scale(scale)
+        img = self.base_for(scale).copy()
+        width, height = img.size
+        layout = layout.scaled(scale)
+
+        lines = [
+            ("Save the Date", CRIMSON_FONT, layout.l1_size),
+            (names, PLAYFAIR_FONT, layout.l2_size),
+            (date_str, PLAYFAIR_FONT, layout.l3_size),
+        ]
+        metrics = [text_metrics(path, size, text) for text, path, size in lines]
+        spacings = [layout.line_spacing_top, layout.line_spacing_main, 0]
+
+        total_h = sum(h for _, h, _ in metrics) + layout.line_spacing_top + layout.line_spacing_main
+        cur_y = (height - total_h) // 2 + layout.vertical_shift
+        for (text, path, size), (bbox, h, w), spacing in zip(lines, metrics, spacings):
+            x = (width - w) // 2
+            if scale == 1:
+                self._draw_text_with_shadow(img, text, load_font(path, size), bbox, x, cur_y, "#FFFFFF", layout)
+            else:
+                # Previsualización: las líneas que no cambian ("Save the Date", la fecha) no se rasterizan otra vez
+                layer, dx, dy = _line_overlay(
+                    text, path, size, layout.shadow_color, layout.shadow_offset, layout.shadow_blur
+                )
+                _paste_clipped(img, layer, x + dx, cur_y + dy)
+            cur_y += h + spacing
+        return img
+
+
+@lru_cache(maxsize=4)
+def get_cartel_renderer(base_image: str = BASE_IMAGE) -> CartelRenderer:
+    """Renderer compartido por proceso (la plantilla se decodifica una vez)."""
+    return CartelRenderer(base_image)
+
+
+def save_image(img: Image.Image, output_image: str):
+    ext = os.path.splitext(output_image)[1].lower()
+    if ext == ".png":
+        img.save(output_image)
+    else:
+        img.convert("RGB").save(output_image, quality=100, subsampling=0)
+
+
+
+@dataclass(frozen=True)
+class ImageFormat:
+    pil_format: str
+    content_type: str
+    default_quality: Optional[int]
+    options: tuple = ()
+
+
+# Formatos de salida del cartel. JPEG mantiene el encode original (calidad 100 sin
+# submuestreo de croma); WebP/AVIF dan ficheros mucho más ligeros para previsualizar.
+IMAGE_FORMATS = {
+    "jpeg": ImageFormat("JPEG", "image/jpeg", 100, (("subsampling", 0),)),
+    "webp": ImageFormat("WEBP", "image/webp", 90, (("method", 4),)),
+    "avif": ImageFormat("AVIF", "image/avif", 75, (("speed", 8),)),
+    "png": ImageFormat("PNG", "image/png", None),
+}
+
+# Un buffer por hilo: se reutiliza entre encodes en vez de crecer uno nuevo cada vez
+_buffers = threading.local()
+
+
+def _encode_buffer() -> io.BytesIO:
+    buf = getattr(_buffers, "buf", None)
+    if buf is None:
+        buf = _buffers.buf = io.BytesIO()
+    buf.seek(0)
+    buf.truncate()
+    return buf
+
+
+def encode_image(img: Image.Image, fmt: str = "jpeg", quality: Optional[int] = None) -> bytes:
+    """
+    Codifica el cartel en memoria (sin pasar por disco) y devuelve los bytes listos para subir.
+    `quality` sustituye a la calidad por defecto del formato (no aplica a PNG).
+    """
+    spec = IMAGE_FORMATS.get(fmt)
+    if spec is None:
+        raise ValueError(f"Formato de imagen no soportado: {fmt}")
+    Image.init()
+    if spec.pil_format not in Image.SAVE:
+        raise ValueError(f"Pillow no tiene soporte para {fmt} en este entorno")
+
+    params = dict(spec.options)
+    if spec.default_quality is not None:
+        params["quality"] = quality or spec.default_quality
+    if spec.pil_format in ("JPEG", "WEBP", "AVIF"):
+        img = img.convert("RGB")
+
+    buf = _encode_buffer()
+    img.save(buf, format=spec.pil_format, **params)
+    return buf.getvalue()
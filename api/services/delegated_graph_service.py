@@ -1,9 +1,11 @@
 import os
 import json
+import time
+import asyncio
 import msal
-import requests
 from typing import Optional, Dict, Any
 from pathlib import Path
+from core.http_client import request as http_request
 
 class DelegatedGraphService:
     def __init__(
@@ -13,6 +15,7 @@ class DelegatedGraphService:
         scopes: list[str],
         token_cache_path: Optional[str] = None,
         client_secret: Optional[str] = None,
+        refresh_margin: float = 300,
     ):
         """
         Initialize the DelegatedGraphService with OAuth2 client configuration.
@@ -23,6 +26,7 @@ class DelegatedGraphService:
             scopes: List of Microsoft Graph API scopes (e.g., ['Mail.Send', 'User.Read'])
             token_cache_path: Optional path to store the token cache
             client_secret: Optional client secret for confidential client flow
+            refresh_margin: Seconds before expiry at which the access token is renewed in the background
         """
         self.client_id = client_id
         self.authority = authority
@@ -31,6 +35,12 @@ class DelegatedGraphService:
             else [s for s in str(scopes or "").replace(",", " ").split() if s]
         )
         self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        # Token de acceso en memoria: las peticiones no pasan por MSAL ni por disco mientras sea válido
+        self._access_token: Optional[str] = None
+        self._expires_at = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._refresh_task: Optional[asyncio.Task] = None
         self.token_cache = msal.SerializableTokenCache()
         self.token_cache_path = token_cache_path or "./.msal_token_cache.json"
         
@@ -66,25 +76,35 @@ class DelegatedGraphService:
             )
     
     def _save_token_cache(self):
-        """Save the token cache to a file with proper error handling."""
-        if not self.token_cache_path:
+        """Persist the token cache to disk, only if MSAL reports it changed since the last write."""
+        if not self.token_cache_path or not self.token_cache.has_state_changed:
             return
-            
+
         try:
             # Create parent directories if they don't exist
             cache_dir = os.path.dirname(self.token_cache_path)
             if cache_dir:  # Only create directory if path is not in current directory
                 os.makedirs(cache_dir, exist_ok=True)
-            
-            # Write with 'w' mode to create or truncate the file
-            with open(self.token_cache_path, "w") as f:
+
+            # Escritura atómica: otro proceso nunca lee un fichero a medias
+            tmp_path = f"{self.token_cache_path}.tmp"
+            with open(tmp_path, "w") as f:
                 f.write(self.token_cache.serialize())
-                
+            os.replace(tmp_path, self.token_cache_path)
+            self.token_cache.has_state_changed = False
+
         except Exception as e:
             print(f"Warning: Could not save token cache: {e}")
             # Print the full path for debugging
             print(f"Attempted to save to: {os.path.abspath(self.token_cache_path)}")
-    
+
+    def _remember(self, result: Dict[str, Any]) -> str:
+        """Guarda en memoria el token recién obtenido y persiste la caché si cambió."""
+        self._access_token = result["access_token"]
+        self._expires_at = time.time() + float(result.get("expires_in") or 0)
+        self._save_token_cache()
+        return self._access_token
+
     def _get_token(self) -> Optional[str]:
         """
         Get an access token for the Graph API using delegated permissions.
@@ -114,7 +134,7 @@ class DelegatedGraphService:
                 
                 if result and "access_token" in result:
                     print("¡Token obtenido del caché exitosamente!")
-                    return result["access_token"]
+                    return self._remember(result)
                 else:
                     print("No se pudo obtener un token del caché. Iniciando flujo de autenticación interactiva...")
             else:
@@ -154,8 +174,7 @@ class DelegatedGraphService:
                 print("\n¡Autenticación exitosa!")
                 print(f"Token expira en: {result.get('expires_in', 'desconocido')} segundos")
                 print("Guardando token en caché...")
-                self._save_token_cache()
-                return result["access_token"]
+                return self._remember(result)
             else:
                 error = result.get("error", "Error desconocido")
                 error_desc = result.get("error_description", "Sin descripción")
@@ -203,7 +222,53 @@ PASOS PARA SOLUCIONAR EL PROBLEMA:
             
             raise
     
-    def send_email(
+    def _refresh_silent(self):
+        # Renovación en segundo plano: solo por la vía silenciosa (refresh token / client credentials),
+        # nunca inicia un device flow
+        if self.client_secret:
+            result = self.app.acquire_token_for_client(scopes=self.scopes)
+        else:
+            accounts = self.app.get_accounts()
+            result = accounts and self.app.acquire_token_silent(
+                scopes=self.scopes, account=accounts[0], force_refresh=True
+            )
+        if result and "access_token" in result:
+            self._remember(result)
+        else:
+            print("No se pudo renovar el token en segundo plano:", (result or {}).get("error"))
+
+    async def _background_refresh(self):
+        try:
+            async with self._token_lock:
+                if time.time() >= self._expires_at - self.refresh_margin:
+                    await asyncio.to_thread(self._refresh_silent)
+        except Exception as e:
+            print("Error renovando el token en segundo plano:", repr(e))
+
+    async def get_access_token(self) -> str:
+        """
+        Token de acceso para Graph sin bloquear el event loop.
+
+        Mientras el token en memoria sea válido se devuelve directamente. Dentro del margen
+        de renovación se sigue usando el actual y se lanza una única renovación en segundo
+        plano; si ya caducó, las peticiones concurrentes esperan a una sola adquisición.
+        """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        now = time.time()
+        if self._access_token and now < self._expires_at:
+            if now >= self._expires_at - self.refresh_margin and (
+                self._refresh_task is None or self._refresh_task.done()
+            ):
+                self._refresh_task = asyncio.create_task(self._background_refresh())
+            return self._access_token
+        async with self._token_lock:
+            if self._access_token and time.time() < self._expires_at:
+                return self._access_token
+            # MSAL es síncrono (y puede ir a la red): fuera del event loop
+            return await asyncio.to_thread(self._get_token)
+
+    async def send_email(
         self,
         to_email: str,
         subject: str,
@@ -228,8 +293,7 @@ PASOS PARA SOLUCIONAR EL PROBLEMA:
             Exception: If there's an error sending the email
         """
         try:
-            # Get access token
-            access_token = self._get_token()
+            access_token = await self.get_access_token()
             if not access_token:
                 raise Exception("No se pudo obtener un token de acceso válido")
 
@@ -279,7 +343,8 @@ PASOS PARA SOLUCIONAR EL PROBLEMA:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(
+            response = await http_request(
+                "POST",
                 endpoint,
                 headers=headers,
                 json=email_msg,
@@ -298,11 +363,11 @@ PASOS PARA SOLUCIONAR EL PROBLEMA:
             print(f"Error al enviar el correo: {str(e)}")
             raise
     
-    def get_user_info(self) -> Dict[str, Any]:
+    async def get_user_info(self) -> Dict[str, Any]:
         """
         Devuelve información del usuario. En app-only consulta /users/{UPN}; en delegado, /me.
         """
-        token = self._get_token()
+        token = await self.get_access_token()
         if not token:
             raise Exception("Failed to get access token")
 
@@ -320,7 +385,7 @@ PASOS PARA SOLUCIONAR EL PROBLEMA:
             # Delegado: hay usuario -> /me
             url = "https://graph.microsoft.com/v1.0/me"
 
-        resp = requests.get(url, headers=headers, timeout=30)
+        resp = await http_request("GET", url, headers=headers, timeout=30)
         if resp.status_code != 200:
             raise Exception(f"Failed to get user info: {resp.status_code} - {resp.text}")
         return resp.json()
@@ -0,0 +1,355 @@
+import os
+import re
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import List, Optional
+
+# Parámetros de codificación comunes a todos los backends (los mismos que usa MoviePy)
+OUTPUT_FPS = 24
+VIDEO_CODEC_ARGS = ["-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p"]
+AUDIO_CODEC_ARGS = ["-c:a", "aac"]
+# Timescale fija para que los tramos codificados por separado se puedan unir con -c copy
+SEGMENT_MUX_ARGS = ["-video_track_timescale", str(OUTPUT_FPS * 512)]
+
+
+def ffmpeg_exe() -> str:
+    """Binario de ffmpeg: FFMPEG_BINARY si está definido, si no el de imageio-ffmpeg."""
+    exe = os.getenv("FFMPEG_BINARY")
+    if exe:
+        return exe
+    from imageio_ffmpeg import get_ffmpeg_exe
+    return get_ffmpeg_exe()
+
+
+def run_ffmpeg(args: List[str]) -> None:
+    cmd = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", *args]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg falló ({proc.returncode}): {proc.stderr.strip()[-2000:]}")
+
+
+@dataclass
+class VideoInfo:
+    width: int
+    height: int
+    fps: float
+    duration: float
+
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_SIZE_RE = re.compile(r"Video:.*?(\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"(\d+(?:\.\d+)?)\s*fps")
+
+
+def probe_video(path: str) -> VideoInfo:
+    """Lee tamaño, fps y duración de la cabecera que imprime `ffmpeg -i` (sin ffprobe)."""
+    proc = subprocess.run([ffmpeg_exe(), "-hide_banner", "-i", path],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    out = proc.stderr
+    video_line = next((l for l in out.splitlines() if "Video:" in l), None)
+    dur = _DURATION_RE.search(out)
+    size = _SIZE_RE.search(video_line or "")
+    if not (video_line and dur and size):
+        raise RuntimeError(f"No se pudo leer la información de vídeo de {path}")
+    fps = _FPS_RE.search(video_line)
+    h, m, s = dur.groups()
+    return VideoInfo(
+        width=int(size.group(1)),
+        height=int(size.group(2)),
+        fps=float(fps.group(1)) if fps else float(OUTPUT_FPS),
+        duration=int(h) * 3600 + int(m) * 60 + float(s),
+    )
+
+
+@dataclass
+class Segment:
+    """Tramo del timeline: fichero fuente y recorte opcional [start, end) en segundos."""
+    path: str
+    start: Optional[float] = None
+    end: Optional[float] = None
+    # Tramo fijo (igual para todas las parejas): se puede servir desde la caché de tramos
+    cacheable: bool = False
+
+    def duration(self, info: VideoInfo) -> float:
+        if self.start is None:
+            return info.duration
+        return min(self.end, info.duration) - self.start
+
+
+def _even(x: float) -> int:
+    # libx264 + yuv420p necesita dimensiones pares
+    return max(2, int(round(x / 2.0)) * 2)
+
+
+@dataclass
+class Layout:
+    """
+    Geometría común del timeline: todos los tramos a la altura mínima, centrados en el
+    ancho máximo, y cada tramo con un número entero de frames a OUTPUT_FPS para que el
+    render en un solo filtergraph y el render por tramos den exactamente los mismos frames.
+    """
+    width: int
+    height: int
+    widths: List[int]
+    frames: List[int]
+
+    @property
+    def durations(self) -> List[float]:
+        return [f / OUTPUT_FPS for f in self.frames]
+
+    @property
+    def total_duration(self) -> float:
+        return sum(self.frames) / OUTPUT_FPS
+
+    @property
+    def offsets(self) -> List[float]:
+        acc, out = 0, []
+        for f in self.frames:
+            out.append(acc / OUTPUT_FPS)
+            acc += f
+        return out
+
+
+def plan_layout(segments: List[Segment], infos: Optional[List[VideoInfo]] = None) -> Layout:
+    if infos is None:
+        infos = [probe_video(s.path) for s in segments]
+    min_h = _even(min(i.height for i in infos))
+    widths = [_even(i.width * min_h / i.height) for i in infos]
+    return Layout(
+        width=max(widths),
+        height=min_h,
+        widths=widths,
+        frames=[max(1, int(round(s.duration(i) * OUTPUT_FPS))) for s, i in zip(segments, infos)],
+    )
+
+
+def segment_filter(index: int, seg: Segment, width: int, frames: int, layout: Layout, label: str) -> str:
+    """Recorte + escalado a la altura mínima + pad centrado + fps de salida + nº fijo de frames."""
+    chain = f"[{index}:v]"
+    if seg.start is not None:
+        chain += f"trim=start={seg.start}:end={seg.end},setpts=PTS-STARTPTS,"
+    chain += f"scale={width}:{layout.height},setsar=1,"
+    if width != layout.width:
+        chain += f"pad={layout.width}:{layout.height}:(ow-iw)/2:0:black,"
+    # tpad por si el fuente se queda corto por redondeo; trim fija el número exacto de frames
+    chain += f"fps={OUTPUT_FPS},tpad=stop_mode=clone:stop=-1,trim=end_frame={frames},setpts=PTS-STARTPTS[{label}]"
+    return chain
+
+
+def overlay_filters(base: str, overlay_index: int, layout: Layout, start: float, frames: int, out: str) -> List[str]:
+    """
+    Screen blend del overlay (con su canal alpha) sobre `base`.
+    Equivale a VideoService._compose_screen: out = bg + (screen(bg, fg) - bg) * alpha.
+    El overlay se muestrea desde `start` durante `frames` frames; si es más corto que
+    el vídeo se congela su último frame, como hace MoviePy con with_duration.
+    """
+    return [
+        f"[{overlay_index}:v]scale={layout.width}:{layout.height},fps={OUTPUT_FPS},format=gbrap,"
+        f"tpad=stop_mode=clone:stop=-1,trim=start={start},setpts=PTS-STARTPTS,"
+        f"trim=end_frame={frames},split[{out}_ovc][{out}_ova]",
+        f"[{out}_ova]alphaextract[{out}_alpha]",
+        f"[{out}_ovc]format=gbrp[{out}_ovrgb]",
+        f"[{base}]format=gbrp,split[{out}_b1][{out}_b2]",
+        f"[{out}_b1][{out}_ovrgb]blend=all_mode=screen[{out}_scr]",
+        f"[{out}_scr][{out}_alpha]alphamerge[{out}_scra]",
+        f"[{out}_b2][{out}_scra]overlay=format=gbrp,format=yuv420p[{out}]",
+    ]
+
+
+@lru_cache(maxsize=16)
+def _probe_cached(path: str, mtime: float) -> VideoInfo:
+    return probe_video(path)
+
+
+def overlay_input(overlay_path: str, offset: float):
+    """
+    Argumentos de entrada del overlay empezando lo más cerca posible de `offset` (sin
+    decodificar lo anterior) y el desfase que queda por recortar en el filtergraph.
+    Si el overlay acaba antes de `offset` se busca su último frame para congelarlo.
+    """
+    if offset <= 0:
+        return ["-i", overlay_path], 0.0
+    info = _probe_cached(overlay_path, os.path.getmtime(overlay_path))
+    seek = max(0.0, min(offset, info.duration - 1.0 / OUTPUT_FPS))
+    return ["-ss", f"{seek:.6f}", "-i", overlay_path], offset - seek
+
+
+def render_segment(seg: Segment, width: int, frames: int, layout: Layout, offset: float,
+                   overlay_path: Optional[str], out_path: str, threads: int = 0) -> str:
+    """
+    Codifica un único tramo ya normalizado (tamaño, fps, pix_fmt) y con el overlay
+    aplicado en su posición del timeline global, sin audio. Todos los tramos salen con
+    los mismos parámetros de codec para poder concatenarlos sin recodificar.
+    `threads` limita los hilos del encoder cuando se codifican varios tramos a la vez (0 = auto).
+    """
+    inputs = ["-i", seg.path]
+    filters = [segment_filter(0, seg, width, frames, layout, "seg")]
+    if overlay_path and os.path.exists(overlay_path):
+        ov_args, ov_start = overlay_input(overlay_path, offset)
+        inputs += ov_args
+        filters += overlay_filters("seg", 1, layout, ov_start, frames, "vout")
+    else:
+        filters.append("[seg]format=yuv420p[vout]")
+
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.part.mp4"
+    run_ffmpeg([
+        *inputs,
+        "-filter_complex", ";".join(filters),
+        "-map", "[vout]",
+        *VIDEO_CODEC_ARGS, "-threads", str(threads), "-r", str(OUTPUT_FPS),
+        *SEGMENT_MUX_ARGS,
+        "-an",
+        tmp_path,
+    ])
+    # Renombrado atómico: otro worker puede estar leyendo o generando el mismo tramo
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def concat_segments(paths: List[str], frames: List[int], audio_path: Optional[str], out_path: str) -> str:
+    """Une tramos con los mismos parámetros de codec por stream copy y añade el audio."""
+    total = sum(frames) / OUTPUT_FPS
+    list_path = f"{out_path}.{uuid.uuid4().hex}.txt"
+    with open(list_path, "w") as f:
+        for p, n in zip(paths, frames):
+            # La duración explícita evita que el demuxer solape el último frame de cada tramo
+            f.write(f"file '{os.path.abspath(p)}'\nduration {n / OUTPUT_FPS:.6f}\n")
+    try:
+        args = ["-f", "concat", "-safe", "0", "-i", list_path]
+        maps = ["-map", "0:v"]
+        audio_args: List[str] = []
+        if audio_path and os.path.exists(audio_path):
+            args += ["-i", audio_path]
+            maps += ["-map", "1:a"]
+            audio_args = AUDIO_CODEC_ARGS
+        run_ffmpeg([
+            *args, *maps,
+            "-c:v", "copy",
+            *audio_args,
+            "-t", f"{total:.3f}",
+            "-movflags", "+faststart",
+            out_path,
+        ])
+    finally:
+        try:
+            os.remove(list_path)
+        except OSError:
+            pass
+    return out_path
+
+
+class FfmpegRenderer:
+    """
+    Render del video final con un único filtergraph de ffmpeg: recortes, escalado,
+    concat, screen blend del overlay y audio, sin pasar frames por Python.
+    """
+
+    def __init__(self, overlay_path: Optional[str], audio_path: Optional[str], segment_cache=None,
+                 parallelism: int = 1):
+        self.overlay_path = overlay_path
+        self.audio_path = audio_path
+        self.segment_cache = segment_cache
+        self.parallelism = max(1, parallelism)
+        self.last_timings: List[dict] = []
+
+    def render_segmented(self, segments: List[Segment], out_path: str) -> str:
+        """
+        Igual que `render`, pero codificando tramo a tramo: los fijos salen de la caché
+        (ya normalizados y con overlay) y sólo se procesan los clips de la pareja.
+        Con `parallelism` > 1 los tramos se codifican a la vez, repartiendo los núcleos
+        entre los encoders. Al final se unen por stream copy y se añade el audio.
+        Los tiempos de cada tramo quedan en `last_timings`.
+        """
+        layout = plan_layout(segments)
+        work_dir = os.path.dirname(os.path.abspath(out_path))
+        workers = min(self.parallelism, len(segments))
+        threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
+        parts: List[str] = []
+
+        def encode(i: int):
+            seg = segments[i]
+            width, frames, offset = layout.widths[i], layout.frames[i], layout.offsets[i]
+            start = time.perf_counter()
+            if seg.cacheable and self.segment_cache is not None:
+                cached = os.path.exists(self.segment_cache.path_for(seg, width, frames, layout, offset))
+                path = self.segment_cache.get_or_build(seg, width, frames, layout, offset, threads=threads)
+            else:
+                cached = False
+                path = os.path.join(work_dir, f"seg{i}_{uuid.uuid4().hex}.mp4")
+                parts.append(path)
+                render_segment(seg, width, frames, layout, offset, self.overlay_path, path, threads=threads)
+            timing = {
+                "segment": i,
+                "source": os.path.basename(seg.path),
+                "frames": frames,
+                "cached": cached,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+            return path, timing
+
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as pool:
+                    results = list(pool.map(encode, range(len(segments))))
+            else:
+                results = [encode(i) for i in range(len(segments))]
+            paths = [path for path, _ in results]
+            timings = [timing for _, timing in results]
+
+            start = time.perf_counter()
+            concat_segments(paths, layout.frames, self.audio_path, out_path)
+            timings.append({"segment": "concat", "seconds": round(time.perf_counter() - start, 3)})
+            self.last_timings = timings
+            for t in timings:
+                print("Tiempo de render por tramo:", t)
+            return out_path
+        finally:
+            for p in parts:
+                try:
+                    if os.path.exists(p): os.remove(p)
+                except OSError:
+                    pass
+
+    def render(self, segments: List[Segment], out_path: str) -> str:
+        layout = plan_layout(segments)
+        total = layout.total_duration
+
+        inputs: List[str] = []
+        for seg in segments:
+            inputs += ["-i", seg.path]
+        filters = [
+            segment_filter(i, seg, layout.widths[i], layout.frames[i], layout, f"v{i}")
+            for i, seg in enumerate(segments)
+        ]
+        filters.append("".join(f"[v{i}]" for i in range(len(segments))) + f"concat=n={len(segments)}:v=1:a=0[base]")
+
+        next_input = len(segments)
+        video_out = "base"
+        if self.overlay_path and os.path.exists(self.overlay_path):
+            inputs += ["-i", self.overlay_path]
+            filters += overlay_filters("base", next_input, layout, 0.0, sum(layout.frames), "vout")
+            video_out = "vout"
+            next_input += 1
+
+        maps = ["-map", f"[{video_out}]"]
+        audio_args: List[str] = []
+        if self.audio_path and os.path.exists(self.audio_path):
+            inputs += ["-i", self.audio_path]
+            filters.append(f"[{next_input}:a]atrim=0:{total},asetpts=PTS-STARTPTS[aout]")
+            maps += ["-map", "[aout]"]
+            audio_args = AUDIO_CODEC_ARGS
+
+        run_ffmpeg([
+            *inputs,
+            "-filter_complex", ";".join(filters),
+            *maps,
+            *VIDEO_CODEC_ARGS, "-r", str(OUTPUT_FPS),
+            *audio_args,
+            "-movflags", "+faststart",
+            out_path,
+        ])
+        return out_path
@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from services.runway_service import MODEL, RATIO, DURATION
+
+
+async def load_image_bytes(image_url: str, client: httpx.AsyncClient) -> bytes:
+    """Bytes de la imagen de entrada, ya venga como data URI o como URL (blob)."""
+    if image_url.startswith("data:"):
+        return base64.b64decode(image_url.split(",", 1)[1])
+    response = await client.get(image_url)
+    if response.status_code != 200:
+        raise RuntimeError(f"Error descargando la imagen de entrada (HTTP {response.status_code})")
+    return response.content
+
+
+# Versión del esquema de claves. v2: los videos cacheados viven en su propio blob
+# (generated/{clave}.mp4); las entradas v1 apuntaban al blob de una pareja, que se sobrescribe.
+KEY_VERSION = b"v2"
+# Carpeta del contenedor con los videos cacheados: inmutables, compartidos entre parejas
+GENERATED_FOLDER = "generated"
+
+
+def generation_key(image_bytes: bytes, prompt: str, model: str = MODEL, ratio: str = RATIO,
+                   duration: int = DURATION) -> str:
+    """Clave por contenido: misma imagen + mismos parámetros de Runway => mismo video."""
+    h = hashlib.sha256(KEY_VERSION)
+    h.update(hashlib.sha256(image_bytes).digest())
+    for part in (prompt, model, ratio, str(duration)):
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+def generated_video_location(key: str) -> tuple[str, str]:
+    """(carpeta, nombre) del blob de un video cacheado. Depende solo de la clave: nunca se sobrescribe con otro contenido."""
+    return GENERATED_FOLDER, key
+
+
+class GenerationCache:
+    """
+    Caché persistente (SQLite) de videos generados: clave por contenido -> URL del blob.
+
+    Las entradas caducan a los `ttl_seconds` y, por encima de `max_entries`, se descartan
+    las menos usadas. `get_or_create` garantiza single-flight dentro del proceso: peticiones
+    idénticas simultáneas esperan a la misma generación en vez de lanzar otra en Runway.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = 7 * 24 * 3600, max_entries: int = 1000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS generation_cache ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_used ON generation_cache(last_used)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT url, created_at FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE generation_cache SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, url: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, url, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, url, now, now),
+            )
+            self._conn.execute("DELETE FROM generation_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM generation_cache WHERE key IN ("
+                "SELECT key FROM generation_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        """Devuelve la URL cacheada o ejecuta `factory()` una sola vez por clave."""
+        while True:
+            url = self.get(key)
+            if url is not None:
+                print("Video generado servido desde caché:", key[:12])
+                return url
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            print("Esperando a una generación idéntica en curso:", key[:12])
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Si se canceló la generación que esperábamos (no nosotros), la intentamos de nuevo
+                if pending.cancelled():
+                    continue
+                raise
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            url = await factory()
+            self.put(key, url)
+            fut.set_result(url)
+            return url
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            # Quien espera recibe el mismo error; la siguiente petición vuelve a intentarlo
+            fut.set_exception(e)
+            fut.exception()  # marcado como leído: evita el aviso si nadie más esperaba
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,346 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from azure.storage.blob import ContentSettings
+
+from services.render_jobs import RenderJob, RUNNING, DONE, ERROR, FINAL_STATUSES
+from services.runway_service import RunwayService, PROMPTS
+from services.generation_cache import GenerationCache, generation_key, generated_video_location, load_image_bytes
+from utils.blob_storage import stream_url_to_blob_storage
+from core.http_client import get_http_client
+
+# Videos ya generados que se usan en modo demo (no se llama a Runway)
+DEMO_VIDEOS = {
+    "cartel": "https://showroomblob.blob.core.windows.net/demo-data/cartel_vid_demo.mp4",
+    "pareja": "https://showroomblob.blob.core.windows.net/demo-data/pareja_vid_demo.mp4",
+}
+
+# Etapas, en orden. Cada una deja su resultado persistido antes de pasar a la siguiente.
+CHECKING_CACHE = "checking_cache"
+SUBMITTING = "submitting"
+GENERATING = "generating"
+TRANSFERRING = "transferring"
+
+_COLUMNS = ("id", "kind", "folder", "image_url", "demo", "status", "stage", "task_id",
+            "runway_url", "video_url", "error", "created_at", "updated_at")
+
+
+class LeaseLost(Exception):
+    """Otro proceso ha reclamado la generación (nuestro lease caducó): hay que dejar de conducirla."""
+
+
+class Generation(RenderJob):
+    """Generación imagen -> clip de Runway -> blob. Reutiliza el estado/notificación de RenderJob."""
+
+    def __init__(self, gen_id: str, kind: str, folder: str, image_url: str, demo: bool = False):
+        super().__init__(gen_id)
+        self.kind = kind
+        self.folder = folder
+        self.image_url = image_url
+        self.demo = demo
+        self.task_id: Optional[str] = None
+        self.runway_url: Optional[str] = None
+        self.video_url: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "generation_id": self.id,
+            "kind": self.kind,
+            "id": self.folder,
+            "status": self.status,
+            "stage": self.stage,
+            "video_url": self.video_url,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_row(self) -> tuple:
+        return (self.id, self.kind, self.folder, self.image_url, int(self.demo), self.status, self.stage,
+                self.task_id, self.runway_url, self.video_url, self.error, self.created_at, self.updated_at)
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Generation":
+        gen = cls(row["id"], row["kind"], row["folder"], row["image_url"], bool(row["demo"]))
+        for col in ("status", "stage", "task_id", "runway_url", "video_url", "error", "created_at", "updated_at"):
+            setattr(gen, col, row[col])
+        return gen
+
+
+class GenerationStore:
+    """
+    Persistencia de las generaciones en SQLite (una fila por generación).
+
+    Cada fila sin terminar pertenece a un proceso (`owner`) hasta `lease_until`. Varios workers
+    comparten el fichero: solo el dueño puede guardar cambios, y una generación se reclama con
+    un UPDATE condicionado a que no tenga dueño o su lease haya caducado (el dueño murió).
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, folder TEXT NOT NULL, image_url TEXT NOT NULL,"
+                "demo INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, stage TEXT, task_id TEXT,"
+                "runway_url TEXT, video_url TEXT, error TEXT, created_at REAL, updated_at REAL,"
+                "owner TEXT, lease_until REAL)"
+            )
+            # Bases creadas antes de que existieran los leases
+            existing = {r["name"] for r in self._conn.execute("PRAGMA table_info(generations)")}
+            for col, decl in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if col not in existing:
+                    self._conn.execute(f"ALTER TABLE generations ADD COLUMN {col} {decl}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_status ON generations(status)")
+
+    def save(self, gen: Generation, owner: str, lease_seconds: float) -> bool:
+        """
+        Guarda la generación y renueva el lease de `owner`. Devuelve False (sin escribir nada)
+        si la fila ya es de otro proceso.
+        """
+        cols = _COLUMNS + ("owner", "lease_until")
+        updates = ",".join(f"{c} = excluded.{c}" for c in cols[1:])
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                f"INSERT INTO generations ({','.join(cols)}) VALUES ({','.join('?' * len(cols))}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates} WHERE generations.owner IS excluded.owner",
+                gen.to_row() + (owner, time.time() + lease_seconds),
+            )
+        return cur.rowcount > 0
+
+    def claim(self, gen_id: str, owner: str, lease_seconds: float) -> bool:
+        """Reclama una generación sin terminar si no tiene dueño vivo. True si ahora es de `owner`."""
+        now = time.time()
+        marks = ",".join("?" * len(FINAL_STATUSES))
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                f"UPDATE generations SET owner = ?, lease_until = ? "
+                f"WHERE id = ? AND status NOT IN ({marks}) "
+                f"AND (owner IS NULL OR owner = ? OR lease_until IS NULL OR lease_until < ?)",
+                (owner, now + lease_seconds, gen_id, *FINAL_STATUSES, owner, now),
+            )
+        return cur.rowcount > 0
+
+    def renew(self, owner: str, lease_seconds: float) -> int:
+        """Extiende el lease de todas las generaciones en curso de `owner`."""
+        marks = ",".join("?" * len(FINAL_STATUSES))
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"UPDATE generations SET lease_until = ? WHERE owner = ? AND status NOT IN ({marks})",
+                (time.time() + lease_seconds, owner, *FINAL_STATUSES),
+            ).rowcount
+
+    def load(self, gen_id: str) -> Optional[Generation]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM generations WHERE id = ?", (gen_id,)).fetchone()
+        return Generation.from_row(row) if row else None
+
+    def load_unfinished(self, orphaned_only: bool = False) -> list[Generation]:
+        """Generaciones sin terminar; con `orphaned_only`, solo las que no tienen dueño vivo."""
+        marks = ",".join("?" * len(FINAL_STATUSES))
+        where = f"status NOT IN ({marks})"
+        params: tuple = tuple(FINAL_STATUSES)
+        if orphaned_only:
+            where += " AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?)"
+            params += (time.time(),)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM generations WHERE {where} ORDER BY created_at", params
+            ).fetchall()
+        return [Generation.from_row(r) for r in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class GenerationPipeline:
+    """
+    Coordinador de generaciones en segundo plano.
+
+    El endpoint solo registra la generación y devuelve su id; una tarea asyncio recorre
+    las etapas checking_cache -> submitting -> generating -> transferring (Runway -> blob
+    en streaming) (si hay `cache` y el video ya existe, se devuelve directamente). Cada transición se
+    guarda en SQLite junto con lo que ya se obtuvo (id de tarea de Runway, URL del clip),
+    de modo que tras un reinicio `resume()` retoma cada generación desde su última etapa
+    sin volver a pagar una tarea de Runway ya enviada.
+
+    Con varios workers sobre la misma base, cada generación la conduce un único proceso:
+    el que la creó o el que la reclamó (`GenerationStore.claim`) cuando el lease de su dueño
+    caducó. `start()` retoma las huérfanas al arrancar y lanza una tarea que renueva los
+    leases propios cada `lease_seconds / 3` y adopta las de procesos que hayan muerto.
+    """
+
+    def __init__(self, store: GenerationStore, runway: RunwayService, cache: Optional[GenerationCache] = None,
+                 max_concurrency: int = 4, retention_seconds: int = 3600, lease_seconds: float = 60.0,
+                 poll_interval: float = 2.0):
+        self.store = store
+        self.runway = runway
+        self.cache = cache
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.generations: Dict[str, Generation] = {}
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self._tasks: set[asyncio.Task] = set()
+        self._maintainer: Optional[asyncio.Task] = None
+
+    def submit(self, kind: str, folder: str, image_url: str, demo: bool = False) -> Generation:
+        if kind not in PROMPTS:
+            raise ValueError(f"Tipo de generación desconocido: {kind}")
+        self._prune()
+        gen = Generation(uuid.uuid4().hex, kind, folder, image_url, demo)
+        self.store.save(gen, self.owner, self.lease_seconds)
+        self._start(gen)
+        return gen
+
+    def start(self) -> int:
+        """Retoma las generaciones huérfanas y lanza el mantenimiento de leases. Devuelve cuántas se retomaron."""
+        resumed = self.resume()
+        if self._maintainer is None:
+            self._maintainer = asyncio.create_task(self._maintain())
+        return resumed
+
+    def resume(self) -> int:
+        """Reclama y relanza las generaciones a medias sin dueño vivo. Devuelve cuántas se retomaron."""
+        resumed = 0
+        for gen in self.store.load_unfinished(orphaned_only=True):
+            if gen.id in self.generations or not self.store.claim(gen.id, self.owner, self.lease_seconds):
+                continue
+            print(f"Retomando generación {gen.id} ({gen.kind}) en etapa {gen.stage}")
+            self._start(gen)
+            resumed += 1
+        return resumed
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self.store.renew(self.owner, self.lease_seconds)
+                resumed = self.resume()
+                if resumed:
+                    print("Generaciones retomadas de otro proceso:", resumed)
+            except Exception as e:
+                print("Error manteniendo los leases de generaciones:", repr(e))
+
+    def get(self, gen_id: str) -> Optional[Generation]:
+        return self.generations.get(gen_id) or self.store.load(gen_id)
+
+    def watch(self, gen_id: str):
+        """
+        (snapshot, wait_change) para `state_stream`. Mientras la generación la conduce este
+        proceso se espera a su aviso de cambio; si la conduce otro worker (o deja de ser nuestra)
+        se vuelve a leer de la base cada `poll_interval`.
+        """
+        def snapshot() -> dict:
+            return self.get(gen_id).to_dict()
+
+        async def wait_change(timeout: float) -> bool:
+            local = self.generations.get(gen_id)
+            if local is not None and not local.finished:
+                return await local.wait_change(timeout)
+            await asyncio.sleep(min(timeout, self.poll_interval))
+            return False
+
+        return snapshot, wait_change
+
+    def _start(self, gen: Generation):
+        self.generations[gen.id] = gen
+        task = asyncio.create_task(self._run(gen))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _set(self, gen: Generation, **fields):
+        gen.update(**fields)
+        if not self.store.save(gen, self.owner, self.lease_seconds):
+            raise LeaseLost(gen.id)
+
+    async def _run(self, gen: Generation):
+        try:
+            async with self._slots:
+                self._set(gen, status=RUNNING)
+                await self._drive(gen)
+            self._set(gen, status=DONE, stage=None)
+        except asyncio.CancelledError:
+            # Apagado del proceso: se deja el estado persistido tal cual para retomarlo
+            raise
+        except LeaseLost:
+            # La conduce ya otro worker; el estado en memoria deja de ser el bueno
+            self._abandon(gen)
+        except Exception as e:
+            print(f"Error en la generación {gen.id}:", repr(e))
+            try:
+                self._set(gen, status=ERROR, error=str(e))
+            except LeaseLost:
+                self._abandon(gen)
+
+    def _abandon(self, gen: Generation):
+        # La conduce ya otro worker: se olvida la copia en memoria y se despierta a quien
+        # la esté siguiendo por SSE para que pase a leerla de la base
+        print(f"Generación {gen.id} reclamada por otro proceso, se abandona")
+        if self.generations.get(gen.id) is gen:
+            del self.generations[gen.id]
+        gen.update()
+
+    async def _drive(self, gen: Generation):
+        if self.cache is None or gen.demo:
+            await self._generate(gen)
+            return
+        self._set(gen, stage=CHECKING_CACHE)
+        key = generation_key(await load_image_bytes(gen.image_url, get_http_client()), PROMPTS[gen.kind])
+        # El video cacheado va a su propio blob (generated/{clave}): compartido e inmutable
+        video_url = await self.cache.get_or_create(key, lambda: self._generate(gen, *generated_video_location(key)))
+        if gen.video_url is None:
+            self._set(gen, video_url=video_url)
+
+    async def _generate(self, gen: Generation, folder: Optional[str] = None, filename: Optional[str] = None) -> str:
+        if gen.runway_url is None:
+            if gen.demo:
+                self._set(gen, runway_url=DEMO_VIDEOS[gen.kind])
+            else:
+                if gen.task_id is None:
+                    self._set(gen, stage=SUBMITTING)
+                    task_id = await self.runway.submit(gen.image_url, PROMPTS[gen.kind])
+                    self._set(gen, task_id=task_id)
+                self._set(gen, stage=GENERATING)
+                runway_url = await self.runway.wait_for_output(gen.task_id, cancel_on_abort=False)
+                self._set(gen, runway_url=runway_url)
+
+        self._set(gen, stage=TRANSFERRING)
+        _, public_url = await stream_url_to_blob_storage(
+            gen.runway_url,
+            folder=folder or gen.folder,
+            filename=filename or f"vid_{gen.kind}_{gen.folder}",
+            content_settings=ContentSettings(content_type="video/mp4"),
+            client=get_http_client(),
+        )
+        self._set(gen, video_url=public_url)
+        return public_url
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for gen_id in [g.id for g in self.generations.values() if g.finished and g.updated_at < cutoff]:
+            self.generations.pop(gen_id, None)
+
+    async def shutdown(self):
+        tasks = list(self._tasks)
+        if self._maintainer is not None:
+            tasks.append(self._maintainer)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
+        if self.cache is not None:
+            self.cache.close()
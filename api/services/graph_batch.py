@@ -0,0 +1,148 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.http_client import request as http_request
+
+# Límite de peticiones por $batch que impone Graph
+GRAPH_BATCH_LIMIT = 20
+# Estados de un elemento del lote que se reintentan: throttling y errores transitorios
+RETRY_ITEM_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 60.0
+
+# Proveedor del token de acceso (se pide en cada lote: puede renovarse entre medias)
+TokenProvider = Callable[[], Awaitable[str]]
+
+
+@dataclass
+class BulkMessage:
+    """Un correo del envío masivo: `sender` es "/me" (delegado) o "/users/{upn}" (app-only)."""
+    id: str
+    payload: dict
+    sender: str = "/me"
+
+
+@dataclass
+class BulkMailResult:
+    id: str
+    status: str  # "sent" | "failed"
+    status_code: int
+    attempts: int
+    error: Optional[str] = None
+
+
+def _retry_after(headers: Optional[dict], attempt: int, backoff: float) -> float:
+    # Las cabeceras de cada respuesta del lote vienen en un dict (sin normalizar mayúsculas)
+    for key, value in (headers or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return min(max(float(value), 0.0), MAX_RETRY_AFTER)
+            except (TypeError, ValueError):
+                break
+    base = backoff * 2 ** attempt
+    return base / 2 + random.uniform(0, base / 2)
+
+
+def _error_text(body) -> str:
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        err = body["error"]
+        return f"{err.get('code')}: {err.get('message')}"
+    return str(body)
+
+
+class GraphBatchMailer:
+    """
+    Envío masivo de correo por Microsoft Graph JSON $batch.
+
+    Agrupa los mensajes en lotes de hasta 20 sendMail y envía varios lotes a la vez
+    (`max_concurrency`, por debajo del límite de concurrencia por buzón de Outlook).
+    Los elementos que Graph rechaza por throttling (429, con su Retry-After) o por errores
+    transitorios se reintentan en el siguiente lote, hasta `max_attempts`. Un 429/503 del
+    lote completo lo reintenta el cliente HTTP compartido.
+
+    Devuelve el resultado de cada mensaje, en el mismo orden de entrada.
+    """
+
+    def __init__(self, graph_base: str, token_provider: TokenProvider, max_concurrency: int = 4,
+                 max_attempts: int = 4, backoff: float = 1.0, timeout: float = 60):
+        self.graph_base = graph_base.rstrip("/")
+        self.token_provider = token_provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.timeout = timeout
+
+    async def _post_batch(self, batch: List[BulkMessage]) -> Dict[str, dict]:
+        token = await self.token_provider()
+        body = {
+            "requests": [
+                {
+                    "id": str(i),
+                    "method": "POST",
+                    "url": f"{m.sender}/sendMail",
+                    "headers": {"Content-Type": "application/json"},
+                    "body": m.payload,
+                }
+                for i, m in enumerate(batch)
+            ]
+        }
+        resp = await http_request(
+            "POST",
+            f"{self.graph_base}/$batch",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json=body,
+            timeout=self.timeout,
+        )
+        if resp.status_code != 200:
+            # Fallo del lote completo: se reporta en cada uno de sus mensajes
+            try:
+                error = _error_text(resp.json())
+            except ValueError:
+                error = resp.text
+            return {m.id: {"status": resp.status_code, "body": error} for m in batch}
+        by_index = {r.get("id"): r for r in resp.json().get("responses", [])}
+        return {
+            m.id: by_index.get(str(i), {"status": 502, "body": "Respuesta ausente en el $batch"})
+            for i, m in enumerate(batch)
+        }
+
+    async def _send_batch(self, batch: List[BulkMessage], slots: asyncio.Semaphore,
+                          results: Dict[str, BulkMailResult]):
+        pending = batch
+        for attempt in range(self.max_attempts):
+            async with slots:
+                responses = await self._post_batch(pending)
+            retry, wait = [], 0.0
+            for m in pending:
+                r = responses[m.id]
+                status = int(r.get("status", 0))
+                if status in (200, 202):
+                    results[m.id] = BulkMailResult(m.id, "sent", status, attempt + 1)
+                    continue
+                results[m.id] = BulkMailResult(m.id, "failed", status, attempt + 1, _error_text(r.get("body")))
+                if status in RETRY_ITEM_STATUSES:
+                    retry.append(m)
+                    wait = max(wait, _retry_after(r.get("headers"), attempt, self.backoff))
+            if not retry or attempt + 1 == self.max_attempts:
+                return
+            print(f"$batch: {len(retry)} mensajes con throttling, reintento en {wait:.1f}s")
+            # Se espera fuera del semáforo: los demás lotes siguen avanzando
+            await asyncio.sleep(wait)
+            pending = retry
+
+    async def send(self, messages: List[BulkMessage]) -> List[BulkMailResult]:
+        if len({m.id for m in messages}) != len(messages):
+            raise ValueError("Los ids de los mensajes deben ser únicos")
+        slots = asyncio.Semaphore(self.max_concurrency)
+        results: Dict[str, BulkMailResult] = {}
+        batches = [messages[i:i + GRAPH_BATCH_LIMIT] for i in range(0, len(messages), GRAPH_BATCH_LIMIT)]
+        outcomes = await asyncio.gather(
+            *(self._send_batch(b, slots, results) for b in batches), return_exceptions=True
+        )
+        # Un lote que falla por red no tumba el resto: sus mensajes quedan como fallidos
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, BaseException):
+                for m in batch:
+                    results.setdefault(m.id, BulkMailResult(m.id, "failed", 0, 1, repr(outcome)))
+        return [results[m.id] for m in messages]
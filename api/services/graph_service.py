@@ -1,13 +1,18 @@
-import requests
+import asyncio
+from typing import List, Optional, Tuple
 from msal import ConfidentialClientApplication
+from core.http_client import request as http_request
+from services.graph_batch import GraphBatchMailer, BulkMessage, BulkMailResult
 
 class GraphService:
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str, user_email: str, graph_base: str):
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, user_email: str, graph_base: str,
+                 app: Optional[ConfidentialClientApplication] = None):
         self.user_email = user_email
         self.graph_base = graph_base
-        self.app = ConfidentialClientApplication(client_id=client_id,
-                                                 authority=f"https://login.microsoftonline.com/{tenant_id}",
-                                                 client_credential=client_secret)
+        # `app` permite reutilizar una aplicación MSAL ya construida (ver core/msal_registry.py)
+        self.app = app or ConfidentialClientApplication(client_id=client_id,
+                                                        authority=f"https://login.microsoftonline.com/{tenant_id}",
+                                                        client_credential=client_secret)
         self.scope = ["https://graph.microsoft.com/.default"]
 
     def _token(self) -> str:
@@ -16,8 +21,9 @@ class GraphService:
             raise RuntimeError(f"Token error: {result.get('error')} - {result.get('error_description')}")
         return result["access_token"]
 
-    def send_email(self, to_email: str, subject: str, message: str):
-        payload = {
+    @staticmethod
+    def _message(to_email: str, subject: str, message: str) -> dict:
+        return {
             "message": {
                 "subject": subject or "Mensaje",
                 "body": {"contentType": "Text", "content": message or ""},
@@ -25,8 +31,27 @@ class GraphService:
             },
             "saveToSentItems": True,
         }
-        resp = requests.post(f"{self.graph_base}/users/{self.user_email}/sendMail",
-                             headers={"Authorization": f"Bearer {self._token()}", "Content-Type": "application/json"},
-                             json=payload, timeout=30)
+
+    async def send_email(self, to_email: str, subject: str, message: str):
+        payload = self._message(to_email, subject, message)
+        # MSAL es síncrono (y puede ir a la red): fuera del event loop
+        token = await asyncio.to_thread(self._token)
+        resp = await http_request("POST", f"{self.graph_base}/users/{self.user_email}/sendMail",
+                                  headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                                  json=payload, timeout=30)
         if resp.status_code not in (200, 202):
             raise RuntimeError(f"Graph sendMail falló: {resp.status_code} {resp.text}")
+
+    async def send_emails(self, emails: List[Tuple[str, str, str]], max_concurrency: int = 4,
+                          max_attempts: int = 4) -> List[BulkMailResult]:
+        """
+        Envía varios correos (to_email, subject, message) en lotes $batch de hasta 20.
+        Devuelve el resultado de cada uno en el mismo orden; los fallos no lanzan excepción.
+        """
+        mailer = GraphBatchMailer(self.graph_base, lambda: asyncio.to_thread(self._token),
+                                  max_concurrency=max_concurrency, max_attempts=max_attempts)
+        sender = f"/users/{self.user_email}"
+        return await mailer.send([
+            BulkMessage(id=str(i), payload=self._message(*email), sender=sender)
+            for i, email in enumerate(emails)
+        ])
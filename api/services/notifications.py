@@ -0,0 +1,409 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+FINAL_STATUSES = {SENT, FAILED}
+
+# Pausa de un worker tras un error inesperado (p. ej. "database is locked") antes de seguir
+WORKER_ERROR_BACKOFF = 1.0
+
+_COLUMNS = ("id", "channel", "payload", "idempotency_key", "status", "attempts", "next_attempt_at",
+            "error", "result", "created_at", "updated_at")
+
+
+class DeliveryError(Exception):
+    """
+    Fallo al entregar una notificación. `retryable` indica si tiene sentido reintentar
+    (throttling, 5xx, red) y `retry_after` el tiempo que pidió el servicio, si lo hizo.
+    """
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# Entrega de una notificación de un canal: recibe el payload y devuelve un resultado serializable
+Sender = Callable[[dict], Awaitable[Any]]
+
+
+def scoped_idempotency_key(scope: str, key: Optional[str]) -> Optional[str]:
+    """
+    Clave de idempotencia enviada por un cliente, acotada a `scope` (sesión, destinatario...).
+    La unicidad en la base es por canal, así que sin esto la misma clave de dos clientes
+    distintos devolvería la notificación del otro y la segunda se perdería. El ámbito va
+    resumido (la clave se devuelve en /api/notifications y no debe exponer el id de sesión).
+    """
+    if not key:
+        return None
+    return f"{hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]}:{key}"
+
+
+class Notification:
+    """Una notificación saliente (correo, WhatsApp, Power Automate) y su estado de entrega."""
+
+    def __init__(self, notification_id: str, channel: str, payload: dict, idempotency_key: Optional[str] = None):
+        self.id = notification_id
+        self.channel = channel
+        self.payload = payload
+        self.idempotency_key = idempotency_key
+        self.status = QUEUED
+        self.attempts = 0
+        self.next_attempt_at = time.time()
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = self.next_attempt_at
+        self.updated_at = self.created_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "notification_id": self.id,
+            "channel": self.channel,
+            "idempotency_key": self.idempotency_key,
+            "status": self.status,
+            "attempts": self.attempts,
+            "next_attempt_at": self.next_attempt_at if self.status == QUEUED else None,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_row(self) -> tuple:
+        return (self.id, self.channel, json.dumps(self.payload), self.idempotency_key, self.status,
+                self.attempts, self.next_attempt_at, self.error, json.dumps(self.result),
+                self.created_at, self.updated_at)
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Notification":
+        n = cls(row["id"], row["channel"], json.loads(row["payload"]), row["idempotency_key"])
+        for col in ("status", "attempts", "next_attempt_at", "error", "created_at", "updated_at"):
+            setattr(n, col, row[col])
+        n.result = json.loads(row["result"]) if row["result"] else None
+        return n
+
+
+class NotificationStore:
+    """
+    Cola persistente en SQLite (una fila por notificación).
+
+    Las filas se reclaman con un UPDATE condicionado al estado, así que varios procesos
+    de la API pueden compartir el mismo fichero sin entregar dos veces la misma. Quien la
+    reclama queda como `owner` hasta `lease_until`; solo él puede guardar el resultado, y
+    solo se devuelve a la cola una entrega a medias cuyo lease ha caducado (su proceso murió).
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS notifications ("
+                "id TEXT PRIMARY KEY, channel TEXT NOT NULL, payload TEXT NOT NULL, idempotency_key TEXT,"
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL,"
+                "error TEXT, result TEXT, created_at REAL, updated_at REAL, owner TEXT, lease_until REAL)"
+            )
+            # Bases creadas antes de que existieran los leases
+            existing = {r["name"] for r in self._conn.execute("PRAGMA table_info(notifications)")}
+            for col, decl in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if col not in existing:
+                    self._conn.execute(f"ALTER TABLE notifications ADD COLUMN {col} {decl}")
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_key ON notifications(channel, idempotency_key)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(channel, status, next_attempt_at)"
+            )
+
+    def add(self, n: Notification) -> Notification:
+        """Inserta la notificación; si ya hay una con la misma clave de idempotencia, devuelve esa."""
+        placeholders = ",".join("?" * len(_COLUMNS))
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                f"INSERT OR IGNORE INTO notifications ({','.join(_COLUMNS)}) VALUES ({placeholders})",
+                n.to_row(),
+            )
+            if cur.rowcount == 0:
+                row = self._conn.execute(
+                    "SELECT * FROM notifications WHERE channel = ? AND idempotency_key = ?",
+                    (n.channel, n.idempotency_key),
+                ).fetchone()
+                return Notification.from_row(row)
+        return n
+
+    def save(self, n: Notification, owner: str) -> bool:
+        """
+        Guarda el resultado de una entrega reclamada por `owner` y la libera. Devuelve False
+        (sin escribir nada) si su lease caducó y la fila ya no es suya.
+        """
+        updates = ",".join(f"{c} = ?" for c in _COLUMNS[1:])
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                f"UPDATE notifications SET {updates}, owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+                n.to_row()[1:] + (n.id, owner),
+            )
+        return cur.rowcount > 0
+
+    def load(self, notification_id: str) -> Optional[Notification]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM notifications WHERE id = ?", (notification_id,)).fetchone()
+        return Notification.from_row(row) if row else None
+
+    def claim_due(self, channel: str, now: float, owner: str, lease_seconds: float) -> Optional[Notification]:
+        """Marca como `sending` (de `owner`) la siguiente notificación pendiente del canal y la devuelve."""
+        with self._lock, self._conn:
+            while True:
+                row = self._conn.execute(
+                    "SELECT * FROM notifications WHERE channel = ? AND status = ? AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (channel, QUEUED, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                cur = self._conn.execute(
+                    "UPDATE notifications SET status = ?, updated_at = ?, owner = ?, lease_until = ? "
+                    "WHERE id = ? AND status = ?",
+                    (SENDING, now, owner, now + lease_seconds, row["id"], QUEUED),
+                )
+                if cur.rowcount:
+                    n = Notification.from_row(row)
+                    n.status, n.updated_at = SENDING, now
+                    return n
+
+    def next_due_at(self, channel: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM notifications WHERE channel = ? AND status = ?",
+                (channel, QUEUED),
+            ).fetchone()
+        return row[0]
+
+    def renew(self, owner: str, ids: Iterable[str], lease_seconds: float) -> int:
+        """Extiende el lease de las entregas `ids` que `owner` tiene en curso."""
+        ids = list(ids)
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"UPDATE notifications SET lease_until = ? WHERE owner = ? AND status = ? AND id IN ({marks})",
+                (time.time() + lease_seconds, owner, SENDING, *ids),
+            ).rowcount
+
+    def requeue_interrupted(self, now: float) -> int:
+        """
+        Devuelve a la cola las que quedaron a medio enviar con el lease caducado (entrega al
+        menos una vez). Las que otro proceso vivo está enviando no se tocan.
+        """
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE notifications SET status = ?, owner = NULL, lease_until = NULL "
+                "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (QUEUED, SENDING, now),
+            ).rowcount
+
+    def purge(self, older_than: float) -> int:
+        marks = ",".join("?" * len(FINAL_STATUSES))
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"DELETE FROM notifications WHERE status IN ({marks}) AND updated_at < ?",
+                (*FINAL_STATUSES, older_than),
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RateLimiter:
+    """Token bucket: como mucho `rate` entregas por segundo, con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class Channel:
+    sender: Sender
+    workers: int = 1
+    rate: float = 0.0  # entregas/segundo; 0 = sin límite
+    burst: int = 1
+    max_attempts: int = 6
+
+
+class NotificationQueue:
+    """
+    Subsistema de notificaciones salientes.
+
+    Los endpoints solo encolan (`enqueue`) y responden; cada canal tiene sus propios workers
+    asyncio que reclaman las notificaciones pendientes de SQLite y las entregan respetando
+    su límite de ritmo. Los fallos transitorios se reintentan con backoff exponencial y
+    jitter (o el Retry-After del servicio) hasta `max_attempts`; los definitivos (4xx)
+    quedan como `failed` al momento. Con `idempotency_key` un mismo aviso encolado dos
+    veces (reintento del cliente, render repetido) se entrega una sola vez.
+
+    Las entregas en curso se renuevan cada `lease_seconds / 3`; si un proceso muere, otro
+    devuelve a la cola sus entregas a medias cuando caduca el lease.
+    """
+
+    def __init__(self, store: NotificationStore, retry_base: float = 2.0, retry_max: float = 300.0,
+                 retention_seconds: int = 7 * 24 * 3600, poll_interval: float = 5.0, lease_seconds: float = 120.0):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.channels: Dict[str, Channel] = {}
+        self._wakeup: Dict[str, asyncio.Event] = {}
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._tasks: List[asyncio.Task] = []
+        # Entregas reclamadas por este proceso que siguen en curso (las únicas cuyo lease se renueva)
+        self._inflight: Set[str] = set()
+
+    def register(self, name: str, sender: Sender, workers: int = 1, rate: float = 0.0, burst: int = 1,
+                 max_attempts: int = 6):
+        self.channels[name] = Channel(sender, max(1, workers), rate, burst, max(1, max_attempts))
+
+    def start(self) -> int:
+        """Arranca los workers de cada canal. Devuelve cuántas notificaciones se retomaron."""
+        resumed = self.store.requeue_interrupted(time.time())
+        self.store.purge(time.time() - self.retention_seconds)
+        for name, channel in self.channels.items():
+            self._wakeup[name] = asyncio.Event()
+            self._limiters[name] = RateLimiter(channel.rate, channel.burst)
+            for _ in range(channel.workers):
+                self._tasks.append(asyncio.create_task(self._worker(name, channel)))
+        self._tasks.append(asyncio.create_task(self._maintain()))
+        return resumed
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self.store.renew(self.owner, self._inflight, self.lease_seconds)
+                requeued = self.store.requeue_interrupted(time.time())
+                if requeued:
+                    print("Notificaciones con el lease caducado, de vuelta a la cola:", requeued)
+                    for event in self._wakeup.values():
+                        event.set()
+            except Exception as e:
+                print("Error manteniendo los leases de notificaciones:", repr(e))
+
+    def enqueue(self, channel: str, payload: dict, idempotency_key: Optional[str] = None) -> Notification:
+        if channel not in self.channels:
+            raise ValueError(f"Canal de notificación desconocido: {channel}")
+        n = self.store.add(Notification(uuid.uuid4().hex, channel, payload, idempotency_key))
+        if channel in self._wakeup:
+            self._wakeup[channel].set()
+        return n
+
+    def get(self, notification_id: str) -> Optional[Notification]:
+        return self.store.load(notification_id)
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.retry_max)
+        # Backoff exponencial con "full jitter": los reintentos de muchos avisos no coinciden
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    async def _wait_for_work(self, name: str):
+        next_due = self.store.next_due_at(name)
+        timeout = self.poll_interval if next_due is None else min(self.poll_interval, max(0.0, next_due - time.time()))
+        event = self._wakeup[name]
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _worker(self, name: str, channel: Channel):
+        while True:
+            n = None
+            try:
+                n = self.store.claim_due(name, time.time(), self.owner, self.lease_seconds)
+                if n is None:
+                    await self._wait_for_work(name)
+                    continue
+                self._inflight.add(n.id)
+                await self._limiters[name].acquire()
+                await self._deliver(n, channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Un fallo de la base (bloqueo con otro proceso, disco...) no puede dejar el canal sin
+                # worker. Si la notificación ya estaba reclamada, su lease deja de renovarse y vuelve
+                # a la cola cuando caduque
+                print(f"Error en el worker de notificaciones ({name}):", repr(e))
+                await asyncio.sleep(WORKER_ERROR_BACKOFF)
+            finally:
+                if n is not None:
+                    self._inflight.discard(n.id)
+
+    async def _deliver(self, n: Notification, channel: Channel):
+        n.attempts += 1
+        try:
+            result = await channel.sender(n.payload)
+            n.status, n.result, n.error = SENT, result, None
+        except asyncio.CancelledError:
+            # Apagado: se queda en `sending` y se devuelve a la cola cuando caduque su lease
+            raise
+        except Exception as e:
+            retryable = e.retryable if isinstance(e, DeliveryError) else True
+            n.error = str(e) or repr(e)
+            if retryable and n.attempts < channel.max_attempts:
+                delay = self._retry_delay(n.attempts - 1, getattr(e, "retry_after", None))
+                n.status, n.next_attempt_at = QUEUED, time.time() + delay
+                print(f"Notificación {n.id} ({n.channel}) falló, reintento {n.attempts} en {delay:.1f}s: {n.error}")
+            else:
+                n.status = FAILED
+                print(f"Notificación {n.id} ({n.channel}) descartada tras {n.attempts} intentos: {n.error}")
+        n.updated_at = time.time()
+        if not self.store.save(n, self.owner):
+            print(f"Notificación {n.id} ({n.channel}): el lease caducó durante la entrega, otro proceso la retomó")
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self.store.close()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any
+
+import httpx
+
+from core.config import settings
+from core.http_client import request as http_request
+from core.msal_client import asession_cca_for, get_scopes
+from services.notifications import DeliveryError
+
+WHATSAPP_API_URL = (
+    f"https://graph.facebook.com/{settings.GRAPH_API_VERSION}/{settings.WHATSAPP_PHONE_NUMBER_ID}/messages"
+)
+POWER_AUTOMATE_URL = (
+    "https://default63722aa14f5d494d89d25ae5974aab.fc.environment.api.powerplatform.com:443/"
+    "powerautomate/automations/direct/workflows/d69522d29974438b8ffbfa614f2d904f/"
+    "triggers/manual/paths/invoke?api-version=1&sp=%2Ftriggers%2Fmanual%2Frun&sv=1.0&sig=Lx2g4vD_XPZey5kGryFjJmgHBnp9yIGTfF58CGD05rg"
+)
+
+
+def _retry_after(resp: httpx.Response):
+    try:
+        return float(resp.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _post(url: str, timeout: float, **kwargs) -> Any:
+    """
+    POST por el cliente compartido, sin sus reintentos: de eso se encarga la cola, que los
+    espacia más y sobrevive a un reinicio. 429/5xx y errores de red se reintentan; el resto
+    de 4xx no (la petición está mal y volver a enviarla no cambia nada).
+    """
+    try:
+        resp = await http_request("POST", url, retries=0, timeout=timeout, **kwargs)
+    except httpx.HTTPError as e:
+        raise DeliveryError(f"Error de red: {e!r}") from e
+    if resp.status_code >= 400:
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        raise DeliveryError(f"HTTP {resp.status_code}: {resp.text[:500]}", retryable, _retry_after(resp))
+    try:
+        return resp.json()
+    except ValueError:
+        return resp.text or None
+
+
+async def send_whatsapp(payload: dict) -> Any:
+    """payload: cuerpo de la API de mensajes de WhatsApp Cloud."""
+    return await _post(
+        WHATSAPP_API_URL, 15,
+        headers={"Authorization": f"Bearer {settings.WHATSAPP_TOKEN}"}, json=payload,
+    )
+
+
+async def send_power_automate(payload: dict) -> Any:
+    """payload: {nombre1, nombre2, email1, email2, videoURI} para el flujo de Power Automate."""
+    return await _post(POWER_AUTOMATE_URL, 30, headers={"Content-Type": "application/json"}, json=payload)
+
+
+async def send_mail(payload: dict) -> Any:
+    """
+    payload: {"sid": sesión que encoló el correo, "message": cuerpo de sendMail}.
+    El token se obtiene en el momento de la entrega de la caché MSAL de esa sesión.
+    """
+    async with asession_cca_for(payload["sid"]) as cca:
+        accounts = await asyncio.to_thread(cca.get_accounts)
+        result = accounts and await asyncio.to_thread(cca.acquire_token_silent, get_scopes(), account=accounts[0])
+    if not result or "access_token" not in result:
+        raise DeliveryError("Sesión caducada: no hay token para enviar el correo", retryable=False)
+    await _post(
+        f"{settings.GRAPH_BASE}/me/sendMail", 30,
+        headers={"Authorization": f"Bearer {result['access_token']}", "Content-Type": "application/json"},
+        json=payload["message"],
+    )
+    return {"status": "sent"}
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+FINAL_STATUSES = {DONE, ERROR}
+
+
+class RenderJob:
+    """Estado de un trabajo de render. Se notifica a los suscriptores en cada cambio."""
+
+    def __init__(self, job_id: str, meta: Optional[dict] = None):
+        self.id = job_id
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.meta = meta or {}
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._changed = asyncio.Event()
+
+    def update(self, **fields):
+        for k, v in fields.items():
+            setattr(self, k, v)
+        self.updated_at = time.time()
+        # Despierta a todos los que esperan y prepara un evento nuevo para el siguiente cambio
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            **self.meta,
+        }
+
+
+class RenderJobQueue:
+    """
+    Cola de trabajos de render.
+
+    Cada trabajo es una corrutina que corre en el event loop (descargas, notificaciones)
+    y delega la parte pesada en CPU a `run_in_worker`, que usa un pool de procesos.
+    El número de renders simultáneos queda acotado por `max_workers`; el resto espera en cola.
+
+    Backends:
+        - "process": ProcessPoolExecutor (producción).
+        - "local":   ThreadPoolExecutor en el mismo proceso (tests / desarrollo).
+    """
+
+    def __init__(self, backend: str = "process", max_workers: int = 2, retention_seconds: int = 3600):
+        if backend not in ("process", "local"):
+            raise ValueError(f"Backend de render desconocido: {backend}")
+        self.backend = backend
+        self.max_workers = max(1, max_workers)
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, RenderJob] = {}
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def _ensure_started(self):
+        if self._executor is None:
+            if self.backend == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+    def submit(self, runner: Callable[[RenderJob], Awaitable[Any]], meta: Optional[dict] = None) -> RenderJob:
+        """Encola `runner(job)` y devuelve el trabajo inmediatamente."""
+        self._ensure_started()
+        self._prune()
+        job = RenderJob(uuid.uuid4().hex, meta)
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, runner))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: RenderJob, runner: Callable[[RenderJob], Awaitable[Any]]):
+        try:
+            result = await runner(job)
+            job.update(status=DONE, stage=None, result=result)
+        except Exception as e:
+            print(f"Error en el trabajo de render {job.id}:", repr(e))
+            job.update(status=ERROR, error=str(e))
+
+    async def run_in_worker(self, job: RenderJob, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta `fn` en el pool esperando turno si todos los workers están ocupados."""
+        self._ensure_started()
+        async with self._slots:
+            job.update(status=RUNNING)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.updated_at < cutoff]:
+            self.jobs.pop(job_id, None)
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def compose_final_in_worker(file_id: str, cartel: str, pareja: str) -> dict:
+    """
+    Punto de entrada del worker: construye el VideoService en el proceso hijo y renderiza.
+    Devuelve la URL del video y los tiempos por tramo (si el backend los reporta).
+    """
+    from core.deps import get_video_service
+    vs = get_video_service()
+    video_path = vs.compose_final(file_id, cartel, pareja)
+    return {"video_path": video_path, "timings": vs.last_render_timings}
@@ -1,36 +1,124 @@
-import base64, requests
-from runwayml import RunwayML
+import asyncio
+import time
+from typing import Optional
+
+from runwayml import AsyncRunwayML
+
+MODEL = "gen4_turbo"
+RATIO = "1280:720"
+DURATION = 5
+
+PAREJA_PROMPT = ("a romantic couple walking hand in hand through a beautiful garden at sunset, soft lighting, cinematic style, 24fps, smooth camera movement")
+CARTEL_PROMPT = ('At the venue entrance, a wedding welcome sign stands adorned with flowers and satin ribbons that gently sway in the breeze; petals and confetti quiver faintly. The camera performs a subtle, steady push-in with a soft zoom, introducing mild parallax and natural micro-movement. Ambient elements flutter: fairy lights flicker, dust motes drift in warm daylight. Cinematic live-action, elegant and romantic, golden hour glow, shallow depth of field with creamy bokeh, crisp yet delicate textures, tasteful filmic contrast, 24fps.')
+# Prompt fijo de cada tipo de video generado
+PROMPTS = {"cartel": CARTEL_PROMPT, "pareja": PAREJA_PROMPT}
+
+# Estados de tarea de Runway
+SUCCEEDED = "SUCCEEDED"
+FAILED_STATUSES = {"FAILED", "CANCELLED"}
+
+
+class RunwayTaskError(Exception):
+    """La tarea de Runway terminó en FAILED/CANCELLED."""
+
+    def __init__(self, task_id: str, status: str, failure: Optional[str] = None):
+        self.task_id = task_id
+        self.status = status
+        self.failure = failure
+        super().__init__(f"Tarea de Runway {task_id} terminó en {status}: {failure or 'sin detalle'}")
+
+
+class RunwayTimeoutError(Exception):
+    """La tarea de Runway no terminó dentro del tiempo máximo."""
+
+    def __init__(self, task_id: str, timeout: float):
+        self.task_id = task_id
+        self.timeout = timeout
+        super().__init__(f"Tarea de Runway {task_id} sin resultado tras {timeout:g}s")
+
 
 class RunwayService:
-    def __init__(self, client: RunwayML):
+    """
+    Cliente asíncrono de Runway.
+
+    El envío y el sondeo de la tarea no bloquean el event loop: el sondeo espera con
+    backoff exponencial (`poll_initial` -> `poll_max`) y se abandona tras `timeout`
+    segundos. Si se agota el tiempo o se cancela la corrutina, la tarea se cancela
+    también en Runway para no seguir consumiendo créditos.
+    """
+
+    def __init__(self, client: AsyncRunwayML, poll_initial: float = 2.0, poll_max: float = 10.0,
+                 timeout: float = 600.0):
         self.client = client
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.timeout = timeout
+
+    async def submit(self, data_uri: str, prompt: str, ratio: str = RATIO, **opts) -> str:
+        """Crea la tarea de image_to_video y devuelve su id sin esperar al resultado."""
+        print("Enviando imagen y prompt a Runway:", prompt)
+        task = await self.client.image_to_video.create(
+            model=MODEL, prompt_image=data_uri, prompt_text=prompt, ratio=ratio, duration=DURATION, **opts
+        )
+        print("Tarea de video creada:", task.id)
+        return task.id
 
+    async def wait_for_output(self, task_id: str, timeout: Optional[float] = None,
+                              cancel_on_abort: bool = True) -> str:
+        """
+        Sondea la tarea hasta que termine y devuelve la URL del video generado.
+        Con `cancel_on_abort=False` la tarea sigue viva en Runway si se cancela la espera
+        (p. ej. al apagar el proceso), para poder retomarla después.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        delay = self.poll_initial
+        try:
+            while True:
+                task = await self.client.tasks.retrieve(task_id)
+                if task.status == SUCCEEDED:
+                    print("Resultado recibido de Runway:", task_id)
+                    return task.output[0]
+                if task.status in FAILED_STATUSES:
+                    raise RunwayTaskError(task_id, task.status, getattr(task, "failure", None))
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RunwayTimeoutError(task_id, timeout)
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, self.poll_max)
+        except RunwayTimeoutError:
+            await self.cancel(task_id)
+            raise
+        except asyncio.CancelledError:
+            if cancel_on_abort:
+                await self.cancel(task_id)
+            raise
+
+    async def cancel(self, task_id: str):
+        """Cancela (o borra, si ya terminó) la tarea en Runway. Los errores se ignoran."""
+        try:
+            # shield: la cancelación debe llegar a Runway aunque nos estén cancelando a nosotros
+            await asyncio.shield(self.client.tasks.delete(task_id))
+            print("Tarea de Runway cancelada:", task_id)
+        except Exception as e:
+            print("No se pudo cancelar la tarea de Runway", task_id, repr(e))
 
     # Image_to_video (using data URI)
-    def image_to_video(self, data_uri: str, prompt: str, ratio: str = "1280:720", **opts) -> bytes:
-        print("Enviando imagen y prompt a Runway:", prompt)
+    async def image_to_video(self, data_uri: str, prompt: str, ratio: str = RATIO, **opts) -> str:
         try:
-            print("Antes de crear tarea de video")
-            task = self.client.image_to_video.create(model="gen4_turbo", prompt_image=data_uri, prompt_text=prompt, ratio=ratio, duration=5, **opts)
-            print("Tarea de video creada, esperando resultado")
-            result = task.wait_for_task_output()
-            print("Resultado recibido de Runway:", result)
-            video_url = result.output[0]
-            return video_url
+            task_id = await self.submit(data_uri, prompt, ratio=ratio, **opts)
+            return await self.wait_for_output(task_id)
         except Exception as e:
             print("Error en image_to_video:", repr(e))
             raise
 
 
-    def create_video_pareja(self, image_url: bytes) -> bytes:
+    async def create_video_pareja(self, image_url: str) -> str:
         print("URL recibida con imagen:", image_url )
-        prompt_vid = ("a romantic couple walking hand in hand through a beautiful garden at sunset, soft lighting, cinematic style, 24fps, smooth camera movement")
-        return self.image_to_video(image_url, prompt_vid, ratio="1280:720")
+        return await self.image_to_video(image_url, PAREJA_PROMPT, ratio=RATIO)
 
 
-    def create_cartel_video(self, image_url: str) -> bytes:
+    async def create_cartel_video(self, image_url: str) -> str:
         print("URL recibida en service:", image_url )
-        #data_uri = self.bytes_to_data_uri(image_url, "image/png")
-        prompt_vid = ('At the venue entrance, a wedding welcome sign stands adorned with flowers and satin ribbons that gently sway in the breeze; petals and confetti quiver faintly. The camera performs a subtle, steady push-in with a soft zoom, introducing mild parallax and natural micro-movement. Ambient elements flutter: fairy lights flicker, dust motes drift in warm daylight. Cinematic live-action, elegant and romantic, golden hour glow, shallow depth of field with creamy bokeh, crisp yet delicate textures, tasteful filmic contrast, 24fps.')
-        vid_url = self.image_to_video(image_url, prompt_vid, ratio="1280:720")
-        return vid_url
+        return await self.image_to_video(image_url, CARTEL_PROMPT, ratio=RATIO)
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+from services.ffmpeg_render import (
+    Layout, Segment, OUTPUT_FPS, VIDEO_CODEC_ARGS, SEGMENT_MUX_ARGS, render_segment,
+)
+
+
+def _file_identity(path: Optional[str]) -> Optional[list]:
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, int(st.st_mtime)]
+
+
+class StaticSegmentCache:
+    """
+    Caché en disco de los tramos fijos (nupzial1/3/4) ya normalizados y con el overlay aplicado.
+
+    Cada tramo se identifica por el fichero fuente, el overlay, la geometría del timeline,
+    su posición (el overlay depende del instante global) y los parámetros de codec, de modo
+    que cualquier cambio en esos datos genera un tramo nuevo en lugar de reutilizar uno viejo.
+    Los ficheros se escriben con renombrado atómico y se pueden compartir entre workers.
+    """
+
+    def __init__(self, cache_dir: str, overlay_path: Optional[str]):
+        self.cache_dir = cache_dir
+        self.overlay_path = overlay_path
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _key(self, seg: Segment, width: int, frames: int, layout: Layout, offset: float) -> str:
+        ident = {
+            "source": _file_identity(seg.path),
+            "trim": [seg.start, seg.end],
+            "overlay": _file_identity(self.overlay_path),
+            "size": [width, layout.width, layout.height],
+            "offset": round(offset, 3),
+            "frames": frames,
+            "fps": OUTPUT_FPS,
+            "codec": VIDEO_CODEC_ARGS + SEGMENT_MUX_ARGS,
+        }
+        return hashlib.sha1(json.dumps(ident, sort_keys=True).encode()).hexdigest()[:20]
+
+    def path_for(self, seg: Segment, width: int, frames: int, layout: Layout, offset: float) -> str:
+        return os.path.join(self.cache_dir, f"seg_{self._key(seg, width, frames, layout, offset)}.mp4")
+
+    def get_or_build(self, seg: Segment, width: int, frames: int, layout: Layout, offset: float,
+                     threads: int = 0) -> str:
+        path = self.path_for(seg, width, frames, layout, offset)
+        if os.path.exists(path):
+            return path
+        print("Generando tramo fijo en caché:", seg.path, "->", path)
+        return render_segment(seg, width, frames, layout, offset, self.overlay_path, path, threads=threads)
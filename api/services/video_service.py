@@ -1,16 +1,39 @@
 import os, uuid
 import numpy as np
 from moviepy import VideoFileClip, concatenate_videoclips, AudioFileClip
-from utils.blob_storage import upload_bytes_to_blob_storage
-from azure.storage.blob import ContentSettings
+from utils.blob_storage import upload_to_blob_storage
 from io import BytesIO
+from utils.blend import ScreenBlender
+from services.ffmpeg_render import FfmpegRenderer, Segment, VideoInfo, OUTPUT_FPS, plan_layout, probe_video
+from services.segment_cache import StaticSegmentCache
+
+# Recortes de los clips de Runway dentro del video final (segundos)
+CARTEL_START, CARTEL_DURATION = 0.5, 1.32
+PAREJA_START, PAREJA_DURATION = 0.5, 2.32
+# Tamaño y duración de los clips de Runway (ratio "1280:720", duration=5 en RunwayService)
+RUNWAY_CLIP_INFO = VideoInfo(width=1280, height=720, fps=OUTPUT_FPS, duration=5.0)
+
+RENDER_BACKENDS = ("moviepy", "ffmpeg")
 
 class VideoService:
-    def __init__(self, static_videos_dir: str, overlay_path: str, audio_path: str, temp_dir: str):
+    def __init__(self, static_videos_dir: str, overlay_path: str, audio_path: str, temp_dir: str,
+                 render_backend: str = "moviepy", segment_cache_dir: str | None = None,
+                 segment_parallelism: int = 1):
+        if render_backend not in RENDER_BACKENDS:
+            raise ValueError(f"Backend de render desconocido: {render_backend}")
         self.static_videos_dir = static_videos_dir
         self.overlay_path = overlay_path
         self.audio_path = audio_path
         self.temp_dir = temp_dir
+        self.render_backend = render_backend
+        self.segment_parallelism = max(1, segment_parallelism)
+        # Tiempos por tramo del último render segmentado (vacío con otros modos)
+        self.last_render_timings: list[dict] = []
+        # La caché de tramos fijos sólo aplica al backend ffmpeg
+        self.segment_cache = (
+            StaticSegmentCache(segment_cache_dir, overlay_path)
+            if segment_cache_dir and render_backend == "ffmpeg" else None
+        )
         os.makedirs(self.temp_dir, exist_ok=True)
 
     def _subclip(self, clip: VideoFileClip, seconds: float) -> VideoFileClip:
@@ -19,6 +42,7 @@ class VideoService:
     # --- blend helpers ---
     @staticmethod
     def _screen_blend(bg, fg):
+        # Referencia en float32; el render usa ScreenBlender (punto fijo)
         bg = bg.astype(np.float32) / 255.0
         fg = fg.astype(np.float32) / 255.0
         scr = 1.0 - (1.0 - bg) * (1.0 - fg)
@@ -29,26 +53,23 @@ class VideoService:
         """
         Aplica screen entre bg y fg respetando la máscara del fg.
         Ambos deben tener mismo tamaño/duración.
+        Si el fg no tiene máscara se omite la multiplicación por alpha.
         """
+        blender = ScreenBlender()
+        mask_clip = fg_clip_same_size.mask
+
         def make_frame(get_frame, t):
             bg = bg_clip.get_frame(t)
             fg = fg_clip_same_size.get_frame(t)
-            if fg_clip_same_size.mask is not None:
-                m = fg_clip_same_size.mask.get_frame(t).astype(np.float32)  # [H,W]
-            else:
-                m = np.ones(bg.shape[:2], dtype=np.float32)
-
-            scr = VideoService._screen_blend(bg, fg)
-            m3 = m[..., None]
-            out = bg * (1.0 - m3) + scr * m3
-            return np.clip(out, 0, 255).astype(np.uint8)
+            m = mask_clip.get_frame(t) if mask_clip is not None else None
+            return blender.blend(bg, fg, m)
 
         # transform aplica la función sobre cada frame
         return bg_clip.transform(make_frame)
 
     # -----------------------
 
-    def compose_final(self, file_id:str, cartel: str, pareja: str) -> str:
+    def _static_paths(self):
         v1 = os.path.join(self.static_videos_dir, "nupzial1.mp4")
         v2 = os.path.join(self.static_videos_dir, "nupzial3.mp4")
         v3 = os.path.join(self.static_videos_dir, "nupzial4.mp4")
@@ -61,14 +82,59 @@ class VideoService:
 
         if not (os.path.exists(v1) and os.path.exists(v2)):
             raise FileNotFoundError("Uno o más videos fijos no se encontraron")
+        return v1, v2, v3
+
+    def _timeline(self, cartel: str, pareja: str) -> list[Segment]:
+        """Los cinco tramos del video final, en orden, con los recortes de los clips de Runway."""
+        v1, v2, v3 = self._static_paths()
+        return [
+            Segment(v1, cacheable=True),
+            Segment(self._local(cartel), CARTEL_START, CARTEL_START + CARTEL_DURATION),
+            Segment(v2, cacheable=True),
+            Segment(self._local(pareja), PAREJA_START, PAREJA_START + PAREJA_DURATION),
+            Segment(v3, cacheable=True),
+        ]
+
+    def precompute_static_segments(self) -> list[str]:
+        """
+        Genera en la caché los tramos fijos asumiendo clips de Runway de tamaño estándar.
+        Se llama al arrancar; si un render real tiene otra geometría, sus tramos se generan
+        (y quedan cacheados) en ese momento.
+        """
+        if self.segment_cache is None:
+            return []
+        timeline = self._timeline("cartel", "pareja")
+        infos = [probe_video(s.path) if s.cacheable else RUNWAY_CLIP_INFO for s in timeline]
+        layout = plan_layout(timeline, infos)
+        return [
+            self.segment_cache.get_or_build(seg, layout.widths[i], layout.frames[i], layout, layout.offsets[i])
+            for i, seg in enumerate(timeline) if seg.cacheable
+        ]
+
+    def render_to_file(self, cartel: str, pareja: str, out_path: str) -> str:
+        """Renderiza el video final en out_path con el backend configurado."""
+        self.last_render_timings = []
+        if self.render_backend == "ffmpeg":
+            renderer = FfmpegRenderer(self.overlay_path, self.audio_path, self.segment_cache,
+                                      parallelism=self.segment_parallelism)
+            timeline = self._timeline(cartel, pareja)
+            if self.segment_cache is None and self.segment_parallelism == 1:
+                return renderer.render(timeline, out_path)
+            out = renderer.render_segmented(timeline, out_path)
+            self.last_render_timings = renderer.last_timings
+            return out
+        return self._render_moviepy(cartel, pareja, out_path)
+
+    def _render_moviepy(self, cartel: str, pareja: str, out_path: str) -> str:
+        v1, v2, v3 = self._static_paths()
 
         clips = []
         try:
             clip1 = VideoFileClip(v1);      
             clips.append(clip1)
 
-            start_time_cartel = 0.5
-            duration_cartel = 1.32 
+            start_time_cartel = CARTEL_START
+            duration_cartel = CARTEL_DURATION
             end_time_cartel = start_time_cartel + duration_cartel
             clip_cartel = VideoFileClip(self._local(cartel));
             subclip_cartel = clip_cartel.subclipped(start_time_cartel, end_time_cartel)   
@@ -78,8 +144,8 @@ class VideoService:
             clips.append(clip2)
 
             #Clip pareja
-            start_time_pareja = 0.5
-            duration_pareja = 2.32 
+            start_time_pareja = PAREJA_START
+            duration_pareja = PAREJA_DURATION
             end_time_pareja = start_time_pareja + duration_pareja
             clip_pareja = VideoFileClip(self._local(pareja));
             subclip_pareja = clip_pareja.subclipped(start_time_pareja, end_time_pareja)   
@@ -88,18 +154,6 @@ class VideoService:
             clip3 = VideoFileClip(v3); 
             clips.append(clip3)
 
-            '''clip_polaroid = self._subclip(VideoFileClip(self._local(polaroid)), 2); 
-            clips.append(clip_polaroid)
-            
-            clip2 = VideoFileClip(v2);                
-            clips.append(clip2)
-
-            clip_pareja = self._subclip(VideoFileClip(self._local(pareja)), 3);     
-            clips.append(clip_pareja)
-
-            clip3 = VideoFileClip(v3); 
-            clips.append(clip3)'''
-
             min_h = min(int(c.h) for c in clips)
             resized = [c.resized(height=min_h) for c in clips]
             final_clip = concatenate_videoclips(resized, method="compose")
@@ -118,37 +172,16 @@ class VideoService:
                 final_clip = final_clip.with_audio(audio)
             
 
-            # Escribir a archivo temporal, leer bytes y subir a Blob Storage
-            tmp_out = os.path.join(self.temp_dir, f"{uuid.uuid4().hex}.mp4")
             audio_tmp = os.path.join(self.temp_dir, f"temp-audio-{uuid.uuid4()}.m4a")
             final_clip.write_videofile(
-                tmp_out,
+                out_path,
                 codec="libx264",
                 audio_codec="aac",
                 temp_audiofile=audio_tmp,
                 remove_temp=True,
-                fps=24
-            )
-
-            # Leer bytes del archivo generado
-            with open(tmp_out, "rb") as f:
-                video_bytes = f.read()
-
-            # Subir a blob storage usando la función de bytes
-            filename = f'vid_final_{file_id}'
-
-            content_settings = ContentSettings(content_type="video/mp4")
-            _, public_url = upload_bytes_to_blob_storage(
-                video_content= video_bytes,
-                content_settings=content_settings,
-                filename=filename,
-                folder=file_id,
-                generate_sas=True
+                fps=OUTPUT_FPS
             )
-
-            print("Video final subido a blob storage:", public_url)
-            
-            return public_url
+            return out_path
         finally:
             # Cerrar clips individuales
             for c in clips:
@@ -162,13 +195,33 @@ class VideoService:
                     if hasattr(final_clip, "close"): final_clip.close()
                 except:
                     pass
+
+    def compose_final(self, file_id:str, cartel: str, pareja: str) -> str:
+        # Escribir a archivo temporal y subirlo a Blob Storage
+        tmp_out = os.path.join(self.temp_dir, f"{uuid.uuid4().hex}.mp4")
+        try:
+            self.render_to_file(cartel, pareja, tmp_out)
+
+            # Subir el fichero directamente (en bloques paralelos) sin cargarlo en memoria
+            filename = f'vid_final_{file_id}'
+            _, public_url = upload_to_blob_storage(
+                file_path=tmp_out,
+                content_type="video/mp4",
+                filename=filename,
+                folder=file_id,
+                generate_sas=True
+            )
+
+            print("Video final subido a blob storage:", public_url)
+            
+            return public_url
+        finally:
             # Eliminar archivo temporal si quedó
-            if 'tmp_out' in locals():
-                try:
-                    if os.path.exists(tmp_out):
-                        os.remove(tmp_out)
-                except:
-                    pass
+            try:
+                if os.path.exists(tmp_out):
+                    os.remove(tmp_out)
+            except:
+                pass
 
     def _local(self, url_path: str) -> str:
         return url_path.replace("/api/media/", "") if url_path.startswith("/api/media/") else url_path
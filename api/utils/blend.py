@@ -0,0 +1,78 @@
+import numpy as np
+from typing import Optional
+
+
+def _div255(x: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    """
+    División entera por 255 con redondeo exacto, in place (x <= 255*255).
+    (x + 128 + ((x + 128) >> 8)) >> 8
+    """
+    x += 128
+    np.right_shift(x, 8, out=tmp)
+    x += tmp
+    x >>= 8
+    return x
+
+
+class ScreenBlender:
+    """
+    Screen blend en punto fijo uint8/uint16 con buffers reutilizados entre frames.
+
+        scr = bg + fg - bg*fg/255
+        out = bg + (scr - bg) * alpha/255
+
+    Los buffers se reservan la primera vez (o si cambia el tamaño del frame) y se
+    reutilizan en cada llamada, así que el array devuelto se sobrescribe en el
+    siguiente `blend`: el consumidor debe usarlo (o copiarlo) antes de pedir otro frame.
+    """
+
+    def __init__(self):
+        self._shape = None
+
+    def _ensure_buffers(self, shape):
+        if self._shape == shape:
+            return
+        h, w = shape[:2]
+        self._acc = np.empty(shape, dtype=np.uint16)
+        self._prod = np.empty(shape, dtype=np.uint16)
+        self._tmp = np.empty(shape, dtype=np.uint16)
+        self._out = np.empty(shape, dtype=np.uint8)
+        self._mask_f = np.empty((h, w, 1), dtype=np.float32)
+        self._alpha = np.empty((h, w, 1), dtype=np.uint16)
+        self._shape = shape
+
+    def _alpha_from_mask(self, mask: np.ndarray) -> np.ndarray:
+        # Máscaras de MoviePy: float en [0, 1]. Las pasamos a 0..255 redondeando.
+        if mask.dtype == np.uint8:
+            np.copyto(self._alpha[..., 0], mask)
+            return self._alpha
+        np.multiply(mask[..., None], 255.0, out=self._mask_f, casting="same_kind")
+        self._mask_f += 0.5
+        np.copyto(self._alpha, self._mask_f, casting="unsafe")
+        return self._alpha
+
+    def blend(self, bg: np.ndarray, fg: np.ndarray, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        if bg.dtype != np.uint8:
+            bg = np.clip(bg, 0, 255).astype(np.uint8)
+        if fg.dtype != np.uint8:
+            fg = np.clip(fg, 0, 255).astype(np.uint8)
+        self._ensure_buffers(bg.shape)
+        acc, prod, tmp = self._acc, self._prod, self._tmp
+
+        # bg*fg/255
+        np.multiply(bg, fg, out=prod, dtype=np.uint16)
+        _div255(prod, tmp)
+
+        # scr = bg + fg - bg*fg/255  (siempre >= bg)
+        np.add(bg, fg, out=acc, dtype=np.uint16)
+        acc -= prod
+
+        if mask is not None:
+            alpha = self._alpha_from_mask(mask)
+            acc -= bg
+            acc *= alpha
+            _div255(acc, tmp)
+            acc += bg
+
+        np.copyto(self._out, acc, casting="unsafe")
+        return self._out
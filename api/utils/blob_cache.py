@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+_ETAG_SAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class BlobCache:
+    """
+    Caché local en disco de blobs de nuestro propio contenedor.
+
+    Cada blob tiene un directorio (hash de su ruta) con una única copia, nombrada por su
+    ETag: al subir una versión nueva se sustituye la anterior. Las subidas y descargas
+    que pasan por la app la rellenan, y una entrada solo se sirve para el ETag que tiene
+    ahora el blob (quien consulta lo revalida antes con un HEAD), así que una versión
+    subida por otro proceso o desde fuera nunca se confunde con la cacheada.
+
+    El uso (mtime) sirve de LRU. El proceso lleva en memoria el tamaño total y el orden de
+    uso de las entradas, así que `put_file` solo descarta las menos usadas cuando se supera
+    `max_bytes`, sin recorrer el disco; el barrido completo (`evict`: caducadas por
+    `max_age_seconds`, .part huérfanos, entradas de otros workers) se hace como mucho una
+    vez cada `SWEEP_INTERVAL`.
+    """
+
+    SWEEP_INTERVAL = 3600
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3, max_age_seconds: int = 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        # ruta -> bytes, de la menos a la más usada
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, blob_name: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(blob_name.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _file_name(blob_name: str, etag: str) -> str:
+        ext = os.path.splitext(blob_name)[1]
+        return _ETAG_SAFE.sub("", etag) + ext
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def lookup(self, blob_name: str, etag: Optional[str]) -> Optional[str]:
+        """Copia local de la versión `etag` del blob (sin ETag no se puede validar: None)."""
+        if not etag:
+            return None
+        path = os.path.join(self._dir(blob_name), self._file_name(blob_name, etag))
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > self.max_age_seconds:
+            return None
+        self._touch(path)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return path
+
+    def put_file(self, blob_name: str, etag: str, src_path: str, move: bool = False) -> str:
+        """Guarda `src_path` como versión `etag` del blob (enlace duro si se puede, si no copia)."""
+        d = self._dir(blob_name)
+        os.makedirs(d, exist_ok=True)
+        final = os.path.join(d, self._file_name(blob_name, etag))
+        part = os.path.join(d, f"{uuid.uuid4().hex}.part")
+        if move:
+            shutil.move(src_path, part)
+        else:
+            try:
+                os.link(src_path, part)
+            except OSError:
+                shutil.copyfile(src_path, part)
+        os.replace(part, final)
+        self._touch(final)
+        self._drop_other_versions(d, final)
+        size = os.path.getsize(final)
+        with self._lock:
+            self._track(final, size)
+            self._shrink()
+        if time.time() - self._last_sweep > self.SWEEP_INTERVAL:
+            self.evict()
+        return final
+
+    def put_bytes(self, blob_name: str, etag: str, data: bytes) -> str:
+        d = self._dir(blob_name)
+        os.makedirs(d, exist_ok=True)
+        part = os.path.join(d, f"{uuid.uuid4().hex}.part")
+        with open(part, "wb") as f:
+            f.write(data)
+        return self.put_file(blob_name, etag, part, move=True)
+
+    def new_part_path(self) -> str:
+        """Fichero temporal dentro de la caché (mismo disco: se puede mover sin copiar)."""
+        return os.path.join(self.root, f"{uuid.uuid4().hex}.part")
+
+    def _drop_other_versions(self, d: str, keep: str):
+        for name in os.listdir(d):
+            path = os.path.join(d, name)
+            if path != keep and not name.endswith(".part"):
+                self._remove(path)
+                with self._lock:
+                    self._untrack(path)
+
+    def _track(self, path: str, size: int):
+        self._untrack(path)
+        self._entries[path] = size
+        self._bytes += size
+
+    def _untrack(self, path: str):
+        size = self._entries.pop(path, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _shrink(self):
+        # Descarta las menos usadas hasta volver a max_bytes (se llama con el lock tomado)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._remove(path)
+
+    def evict(self):
+        """
+        Barrido completo: descarta entradas caducadas y, por encima del tamaño máximo, las
+        menos usadas. Reconstruye el índice en memoria a partir de lo que hay en disco.
+        """
+        with self._lock:
+            now = time.time()
+            self._last_sweep = now
+            entries = []
+            for root, _, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    # .part huérfanos (escrituras interrumpidas) se limpian pasada una hora
+                    limit = 3600 if name.endswith(".part") else self.max_age_seconds
+                    if now - st.st_mtime > limit:
+                        self._remove(path)
+                    elif not name.endswith(".part"):
+                        entries.append((st.st_mtime, st.st_size, path))
+            self._entries = OrderedDict((path, size) for _, size, path in sorted(entries))
+            self._bytes = sum(self._entries.values())
+            self._shrink()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_cache: Optional[BlobCache] = None
+
+
+def init_blob_cache(root: str, max_bytes: int, max_age_seconds: int) -> BlobCache:
+    global _cache
+    _cache = BlobCache(root, max_bytes=max_bytes, max_age_seconds=max_age_seconds)
+    _cache.evict()
+    return _cache
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """Caché del proceso, o None si no se activó (p. ej. en los workers de render)."""
+    return _cache
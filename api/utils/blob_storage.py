@@ -1,9 +1,263 @@
-from azure.storage.blob import BlobServiceClient, ContentSettings, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob import BlobServiceClient, BlobBlock, ContentSettings, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob.aio import BlobClient as AsyncBlobClient, BlobServiceClient as AsyncBlobServiceClient
 from datetime import datetime, timedelta
+import asyncio
+import base64
+import copy
+import hashlib
 import os
 import uuid
-from typing import Optional, Tuple, Union
+from typing import AsyncIterator, Optional, Tuple, Union
+from urllib.parse import unquote, urlsplit
+import httpx
 from fastapi import HTTPException
+from utils.blob_cache import get_blob_cache
+
+# Tamaño de bloque y bloques en vuelo por transferencia en streaming (memoria ~ bloque * (concurrencia + 1))
+STREAM_BLOCK_SIZE = 4 * 1024 * 1024
+STREAM_MAX_CONCURRENCY = 4
+
+# Extensión que se añade al nombre del blob según el content type
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+    "video/mp4": ".mp4",
+}
+
+
+class BlobStorage:
+    """
+    Acceso a Azure Blob Storage con clientes de larga duración compartidos por el proceso.
+
+    Se crea una vez (al arrancar la app, o al primer uso en los workers) y reutiliza el pool
+    de conexiones y la sesión TLS entre subidas. El cliente síncrono sirve a los workers de
+    render y a código bloqueante; el de `azure.storage.blob.aio` se crea perezosamente dentro
+    del event loop y da la API awaitable. Ambos se pueden inyectar (Azurite o un fake en memoria).
+    """
+
+    def __init__(
+        self,
+        connection_string: Optional[str] = None,
+        container: str = "public-data",
+        account_key: Optional[str] = None,
+        max_concurrency: int = STREAM_MAX_CONCURRENCY,
+        service_client: Optional[BlobServiceClient] = None,
+        async_service_client: Optional[AsyncBlobServiceClient] = None,
+    ):
+        self.connection_string = connection_string
+        self.container = container
+        self.account_key = account_key
+        self.max_concurrency = max(1, max_concurrency)
+        self._sync = service_client
+        self._aio = async_service_client
+
+    def _require_connection_string(self):
+        if not self.connection_string:
+            raise HTTPException(status_code=500, detail="Missing AZURE_STORAGE_CONNECTION_STRING")
+
+    @property
+    def sync_client(self) -> BlobServiceClient:
+        if self._sync is None:
+            self._require_connection_string()
+            self._sync = BlobServiceClient.from_connection_string(self.connection_string)
+        return self._sync
+
+    @property
+    def async_client(self) -> AsyncBlobServiceClient:
+        if self._aio is None:
+            self._require_connection_string()
+            self._aio = AsyncBlobServiceClient.from_connection_string(self.connection_string)
+        return self._aio
+
+    def _service(self):
+        # Para URL y nombre de cuenta vale cualquiera de los dos clientes
+        return self._sync or self._aio or self.sync_client
+
+    @staticmethod
+    def blob_name(filename: str, folder: str = "", content_type: Optional[str] = None) -> str:
+        blob_name = f"{folder}/{filename}" if folder else filename
+        return blob_name + _EXTENSIONS.get(content_type, "")
+
+    def blob_name_from_url(self, url: str) -> Optional[str]:
+        """Nombre del blob si la URL apunta a nuestro contenedor (con o sin SAS); si no, None."""
+        try:
+            prefix = f"{self._service().url}{self.container}/"
+        except HTTPException:
+            return None
+        base = urlsplit(url)._replace(query="", fragment="").geturl()
+        if not base.startswith(prefix):
+            return None
+        return unquote(base[len(prefix):]) or None
+
+    def public_url(self, blob_name: str, generate_sas: bool = False) -> str:
+        service = self._service()
+        public_url = f"{service.url}{self.container}/{blob_name}"
+        if generate_sas and self.account_key:
+            sas = generate_blob_sas(
+                account_name=service.account_name,
+                container_name=self.container,
+                blob_name=blob_name,
+                account_key=self.account_key,
+                permission=BlobSasPermissions(read=True),
+                expiry=datetime.utcnow() + timedelta(hours=24)
+            )
+            public_url = f"{public_url}?{sas}"
+        return public_url
+
+    # --- API síncrona ---
+
+    def upload(self, data, blob_name: str, content_settings: ContentSettings,
+               max_concurrency: Optional[int] = None) -> Optional[str]:
+        """Sube bytes o un fichero abierto y devuelve el ETag. Los ficheros grandes van en bloques en paralelo."""
+        result = self.sync_client.get_blob_client(container=self.container, blob=blob_name).upload_blob(
+            data,
+            overwrite=True,
+            content_settings=content_settings,
+            max_concurrency=max_concurrency or self.max_concurrency,
+        )
+        return result.get("etag")
+
+    def download_to_file(self, blob_name: str, path: str, max_concurrency: Optional[int] = None):
+        blob_client = self.sync_client.get_blob_client(container=self.container, blob=blob_name)
+        with open(path, "wb") as f:
+            blob_client.download_blob(max_concurrency=max_concurrency or self.max_concurrency).readinto(f)
+
+    # --- API asíncrona ---
+
+    def async_blob_client(self, blob_name: str) -> AsyncBlobClient:
+        return self.async_client.get_blob_client(container=self.container, blob=blob_name)
+
+    async def aupload(self, data, blob_name: str, content_settings: ContentSettings,
+                      max_concurrency: Optional[int] = None) -> Optional[str]:
+        result = await self.async_blob_client(blob_name).upload_blob(
+            data,
+            overwrite=True,
+            content_settings=content_settings,
+            max_concurrency=max_concurrency or self.max_concurrency,
+        )
+        return result.get("etag")
+
+    async def aupload_file(self, path: str, blob_name: str, content_settings: ContentSettings,
+                           max_concurrency: Optional[int] = None) -> Optional[str]:
+        with open(path, "rb") as f:
+            return await self.aupload(f, blob_name, content_settings, max_concurrency=max_concurrency)
+
+    async def adownload_bytes(self, blob_name: str, max_concurrency: Optional[int] = None) -> bytes:
+        stream = await self.async_blob_client(blob_name).download_blob(
+            max_concurrency=max_concurrency or self.max_concurrency
+        )
+        return await stream.readall()
+
+    async def adownload_to_file(self, blob_name: str, path: str, max_concurrency: Optional[int] = None):
+        stream = await self.async_blob_client(blob_name).download_blob(
+            max_concurrency=max_concurrency or self.max_concurrency
+        )
+        with open(path, "wb") as f:
+            await stream.readinto(f)
+
+    def close(self):
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+
+    async def aclose(self):
+        if self._aio is not None:
+            await self._aio.close()
+            self._aio = None
+        self.close()
+
+
+_storage: Optional[BlobStorage] = None
+
+
+def init_blob_storage(
+    connection_string: Optional[str],
+    container: str = "public-data",
+    account_key: Optional[str] = None,
+    max_concurrency: int = STREAM_MAX_CONCURRENCY,
+) -> BlobStorage:
+    """Crea los clientes compartidos del proceso (se llama al arrancar la app)."""
+    return set_blob_storage(BlobStorage(connection_string, container, account_key, max_concurrency))
+
+
+def set_blob_storage(storage: BlobStorage) -> BlobStorage:
+    """Sustituye el almacenamiento del proceso (p. ej. por uno contra Azurite o un fake)."""
+    global _storage
+    _storage = storage
+    return storage
+
+
+def get_blob_storage() -> BlobStorage:
+    """Almacenamiento compartido; si nadie lo inicializó (workers de render) se crea desde el entorno."""
+    if _storage is None:
+        init_blob_storage(
+            os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
+            container=os.getenv("AZURE_BLOB_CONTAINER", "public-data"),
+            account_key=os.getenv("AZURE_STORAGE_ACCOUNT_KEY"),
+            max_concurrency=int(os.getenv("AZURE_BLOB_MAX_CONCURRENCY", STREAM_MAX_CONCURRENCY)),
+        )
+    return _storage
+
+
+async def close_blob_storage():
+    global _storage
+    if _storage is not None:
+        await _storage.aclose()
+        _storage = None
+
+
+def _cache_file(blob_name: str, etag: Optional[str], path: str, move: bool = False):
+    """Deja una copia local de lo que acabamos de subir/descargar (si la caché está activa)."""
+    cache = get_blob_cache()
+    if cache is None or not etag:
+        return
+    try:
+        cache.put_file(blob_name, etag, path, move=move)
+    except OSError as e:
+        print("No se pudo guardar en la caché local de blobs:", blob_name, repr(e))
+
+
+def _cache_bytes(blob_name: str, etag: Optional[str], data: bytes):
+    cache = get_blob_cache()
+    if cache is None or not etag:
+        return
+    try:
+        cache.put_bytes(blob_name, etag, data)
+    except OSError as e:
+        print("No se pudo guardar en la caché local de blobs:", blob_name, repr(e))
+
+
+def cached_blob_path(url: str, etag: Optional[str]) -> Optional[str]:
+    """
+    Copia local de un blob de nuestro contenedor, si la caché tiene su versión `etag`
+    (el ETag actual del blob, obtenido con un HEAD justo antes).
+    """
+    cache = get_blob_cache()
+    if cache is None:
+        return None
+    blob_name = get_blob_storage().blob_name_from_url(url)
+    return cache.lookup(blob_name, etag) if blob_name else None
+
+
+def cache_downloaded_blob(url: str, path: str, etag: Optional[str]):
+    """Guarda en la caché local un fichero descargado si la URL es de nuestro contenedor."""
+    if get_blob_cache() is None:
+        return
+    blob_name = get_blob_storage().blob_name_from_url(url)
+    if blob_name:
+        _cache_file(blob_name, etag, path)
+
+
+def _content_settings(content_settings: Union[ContentSettings, dict]) -> ContentSettings:
+    if isinstance(content_settings, dict):
+        try:
+            return ContentSettings(**content_settings)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid content_settings dict: {e}")
+    return content_settings  # assume ContentSettings
+
 
 def upload_to_blob_storage(
     file_path: str,
@@ -14,72 +268,28 @@ def upload_to_blob_storage(
 ) -> Tuple[str, str]:
     """
     Uploads a file to Azure Blob Storage and returns its ID and public URL.
-    
+
     Args:
         file_path: Path to the file to upload
         content_type: MIME type of the file (e.g. 'image/jpeg', 'video/mp4')
         folder: Optional folder name within the container
         generate_sas: Whether to generate a SAS token for private containers
-    
+
     Returns:
         Tuple containing (file_id, public_url)
     """
 
     print("Uploading file to blob storage:", file_path)
     try:
-        # Get connection string from environment
-        conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-        if not conn_str:
-            raise HTTPException(status_code=500, detail="Missing AZURE_STORAGE_CONNECTION_STRING")
-
-        # Generate unique file ID
-        #file_id = uuid.uuid4().hex
-        
-        # Create blob name with optional folder
-        blob_name = f"{folder}/{filename}" if folder else filename
-        
-        # Add file extension from content type
-        if content_type == "image/jpeg":
-            blob_name += ".jpg"
-        elif content_type == "image/png":
-            blob_name += ".png"
-        elif content_type == "video/mp4":
-            blob_name += ".mp4"
-        
-        # Get container name
-        container = os.getenv("AZURE_BLOB_CONTAINER", "public-data")
-        
-        # Create blob client
-        blob_service = BlobServiceClient.from_connection_string(conn_str)
-        blob_client = blob_service.get_blob_client(container=container, blob=blob_name)
-
-        # Upload file with content settings
+        storage = get_blob_storage()
+        blob_name = storage.blob_name(filename, folder, content_type)
         with open(file_path, "rb") as data:
-            blob_client.upload_blob(
-                data,
-                overwrite=True,
-                content_settings=ContentSettings(content_type=content_type)
-            )
-
-        # Generate base URL
-        public_url = f"{blob_service.url}{container}/{blob_name}"
-
-        # Add SAS token if requested
-        if generate_sas:
-            account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-            if account_key:
-                sas = generate_blob_sas(
-                    account_name=blob_service.account_name,
-                    container_name=container,
-                    blob_name=blob_name,
-                    account_key=account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=24)
-                )
-                public_url = f"{public_url}?{sas}"
-
-        return filename, public_url
+            etag = storage.upload(data, blob_name, ContentSettings(content_type=content_type))
+        _cache_file(blob_name, etag, file_path)
+        return filename, storage.public_url(blob_name, generate_sas)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading to blob storage: {str(e)}")
 
@@ -100,60 +310,220 @@ def upload_bytes_to_blob_storage(
         generate_sas: Whether to generate a SAS token for the returned URL.
     """
     try:
-        conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-        if not conn_str:
-            raise HTTPException(status_code=500, detail="Missing AZURE_STORAGE_CONNECTION_STRING")
+        storage = get_blob_storage()
+        cs = _content_settings(content_settings)
+        blob_name = storage.blob_name(filename, folder, getattr(cs, "content_type", None))
+        etag = storage.upload(video_content, blob_name, cs)
+        _cache_bytes(blob_name, etag, video_content)
+        return filename, storage.public_url(blob_name, generate_sas)
 
-        #file_id = uuid.uuid4().hex
-        blob_name = f"{folder}/{filename}" if folder else filename
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading bytes to blob storage: {str(e)}")
 
-        # Normalize ContentSettings
-        if isinstance(content_settings, dict):
-            try:
-                cs = ContentSettings(**content_settings)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Invalid content_settings dict: {e}")
-        else:
-            cs = content_settings  # assume ContentSettings
-
-        # Try to append extension based on content_type when possible
-        ctype = getattr(cs, "content_type", None)
-        if ctype == "image/jpeg":
-            blob_name += ".jpg"
-        elif ctype == "image/png":
-            blob_name += ".png"
-        elif ctype == "video/mp4":
-            blob_name += ".mp4"
-
-        container = os.getenv("AZURE_BLOB_CONTAINER", "public-data")
-        blob_service = BlobServiceClient.from_connection_string(conn_str)
-        blob_client = blob_service.get_blob_client(container=container, blob=blob_name)
-
-        # Upload raw bytes
-        blob_client.upload_blob(
-            video_content,
-            overwrite=True,
-            content_settings=cs
-        )
 
-        public_url = f"{blob_service.url}{container}/{blob_name}"
+async def aupload_to_blob_storage(
+    file_path: str,
+    content_type: str,
+    filename: str,
+    folder: str = "",
+    generate_sas: bool = False,
+    max_concurrency: Optional[int] = None,
+) -> Tuple[str, str]:
+    """
+    Awaitable version of upload_to_blob_storage using the shared aio client.
+
+    Args:
+        max_concurrency: Parallel block uploads for this file (defaults to the storage setting).
+    """
+    print("Uploading file to blob storage:", file_path)
+    try:
+        storage = get_blob_storage()
+        blob_name = storage.blob_name(filename, folder, content_type)
+        etag = await storage.aupload_file(file_path, blob_name, ContentSettings(content_type=content_type),
+                                          max_concurrency=max_concurrency)
+        _cache_file(blob_name, etag, file_path)
+        return filename, storage.public_url(blob_name, generate_sas)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading to blob storage: {str(e)}")
+
+
+async def aupload_bytes_to_blob_storage(
+    video_content: bytes,
+    content_settings: Union[ContentSettings, dict],
+    filename: str,
+    folder: str,
+    generate_sas: bool = False,
+    max_concurrency: Optional[int] = None,
+) -> Tuple[str, str]:
+    """
+    Awaitable version of upload_bytes_to_blob_storage using the shared aio client.
+
+    Args:
+        max_concurrency: Parallel block uploads for this blob (defaults to the storage setting).
+    """
+    try:
+        storage = get_blob_storage()
+        cs = _content_settings(content_settings)
+        blob_name = storage.blob_name(filename, folder, getattr(cs, "content_type", None))
+        etag = await storage.aupload(video_content, blob_name, cs, max_concurrency=max_concurrency)
+        _cache_bytes(blob_name, etag, video_content)
+        return filename, storage.public_url(blob_name, generate_sas)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading bytes to blob storage: {str(e)}")
+
+
+async def _read_blocks(chunks: AsyncIterator[bytes], block_size: int) -> AsyncIterator[bytes]:
+    """Regroups an arbitrary chunk stream into blocks of exactly block_size bytes (last one shorter)."""
+    buf = bytearray()
+    async for chunk in chunks:
+        buf += chunk
+        while len(buf) >= block_size:
+            yield bytes(buf[:block_size])
+            del buf[:block_size]
+    if buf:
+        yield bytes(buf)
+
+
+async def _tee_to_file(chunks: AsyncIterator[bytes], path: str) -> AsyncIterator[bytes]:
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
 
-        if generate_sas:
-            account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-            if account_key:
-                sas = generate_blob_sas(
-                    account_name=blob_service.account_name,
-                    container_name=container,
-                    blob_name=blob_name,
-                    account_key=account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=24)
-                )
-                public_url = f"{public_url}?{sas}"
+async def stage_blocks_to_blob(
+    blob_client: AsyncBlobClient,
+    chunks: AsyncIterator[bytes],
+    content_settings: ContentSettings,
+    block_size: int = STREAM_BLOCK_SIZE,
+    max_concurrency: int = STREAM_MAX_CONCURRENCY,
+) -> Tuple[int, bytes, Optional[str]]:
+    """
+    Upload a byte stream as a block blob without holding it in memory.
+
+    Blocks are staged in parallel (at most max_concurrency in flight, each one validated
+    with its own transactional MD5) while the MD5 of the whole blob is computed on the fly.
+    The block list is committed in order with that MD5 stored as Content-MD5.
+
+    Returns:
+        Tuple containing (total_bytes, md5_digest, etag)
+    """
+    md5 = hashlib.md5()
+    total = 0
+    block_ids = []
+    slots = asyncio.Semaphore(max_concurrency)
+    pending = set()
+    errors = []
+
+    async def stage(block_id: str, data: bytes):
+        try:
+            await blob_client.stage_block(block_id, data, length=len(data), validate_content=True)
+        except Exception as e:
+            errors.append(e)
+            raise
+        finally:
+            slots.release()
+
+    try:
+        async for block in _read_blocks(chunks, block_size):
+            md5.update(block)
+            total += len(block)
+            block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+            block_ids.append(block_id)
+            # Espera a que haya hueco antes de leer más: acota la memoria de la transferencia
+            await slots.acquire()
+            task = asyncio.create_task(stage(block_id, block))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            # Propaga cuanto antes un fallo de subida en lugar de seguir leyendo
+            if errors:
+                raise errors[0]
+        await asyncio.gather(*pending)
+        # A block that failed after the last check already left `pending` through its
+        # done callback, so gather() did not see it: never commit a list with a missing block
+        if errors:
+            raise errors[0]
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        raise
 
-        return filename, public_url
+    # The caller's ContentSettings may be shared (e.g. module-level defaults): copy before setting the MD5
+    content_settings = copy.copy(content_settings)
+    content_settings.content_md5 = bytearray(md5.digest())
+    result = await blob_client.commit_block_list(
+        [BlobBlock(block_id=b) for b in block_ids], content_settings=content_settings
+    )
+    return total, md5.digest(), (result or {}).get("etag")
+
+
+async def stream_url_to_blob_storage(
+    source_url: str,
+    content_settings: Union[ContentSettings, dict],
+    filename: str,
+    folder: str,
+    generate_sas: bool = False,
+    block_size: int = STREAM_BLOCK_SIZE,
+    max_concurrency: Optional[int] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> Tuple[str, str]:
+    """
+    Stream a remote file (e.g. a Runway output) straight into Azure Blob Storage and return (file_id, public_url).
+
+    The HTTP body is never buffered whole: it is piped into staged blocks of block_size
+    bytes with bounded parallel uploads (see stage_blocks_to_blob).
+
+    Args:
+        source_url: URL to download from.
+        content_settings: ContentSettings instance or dict with content metadata (must include content_type).
+        folder: Optional folder within the container.
+        generate_sas: Whether to generate a SAS token for the returned URL.
+        block_size: Size of each staged block in bytes.
+        max_concurrency: Maximum number of blocks uploading at the same time (defaults to the storage setting).
+        client: Shared HTTP client to download with (the app's pooled one). Without it a
+            one-off client is opened for this transfer.
+    """
+    try:
+        storage = get_blob_storage()
+        cs = _content_settings(content_settings)
+        blob_name = storage.blob_name(filename, folder, getattr(cs, "content_type", None))
+
+        # Con caché local activa se va escribiendo también una copia en disco (no en memoria)
+        cache = get_blob_cache()
+        tee_path = cache.new_part_path() if cache is not None else None
+        try:
+            http = client or httpx.AsyncClient(follow_redirects=True, timeout=60.0)
+            try:
+                async with http.stream("GET", source_url) as response:
+                    if response.status_code != 200:
+                        raise HTTPException(status_code=400, detail=f"Error downloading {source_url} (HTTP {response.status_code})")
+                    chunks = response.aiter_bytes(256 * 1024)
+                    if tee_path:
+                        chunks = _tee_to_file(chunks, tee_path)
+                    total, _, etag = await stage_blocks_to_blob(
+                        storage.async_blob_client(blob_name), chunks, cs,
+                        block_size=block_size, max_concurrency=max_concurrency or storage.max_concurrency,
+                    )
+            finally:
+                if client is None:
+                    await http.aclose()
+            print(f"Subidos {total} bytes en streaming a {blob_name}")
+            if tee_path:
+                _cache_file(blob_name, etag, tee_path, move=True)
+        finally:
+            if tee_path and os.path.exists(tee_path):
+                os.remove(tee_path)
+        return filename, storage.public_url(blob_name, generate_sas)
 
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading bytes to blob storage: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error streaming to blob storage: {str(e)}")
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import shutil
+import uuid
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+# Por encima de este tamaño (y si el servidor acepta Range) se descarga en tramos paralelos
+RANGE_THRESHOLD = 16 * 1024 * 1024
+RANGE_PARTS = 4
+CHUNK_SIZE = 1024 * 1024
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# Errores que justifican reintentar desde el último byte recibido
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class _TransientError(Exception):
+    pass
+
+
+def _ext_for(url: str, content_type: str = "") -> str:
+    """Extensión del fichero a partir de la URL o, si no tiene, del content-type."""
+    ext = os.path.splitext(urlparse(url).path)[1]
+    if ext:
+        return ext
+    if "mp4" in content_type or "mpeg" in content_type:
+        return ".mp4"
+    return ""
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def local_media_path(url: str, roots: Iterable[str]) -> Optional[str]:
+    """
+    Ruta local de las URLs /api/media/... que sirve la propia API (no hace falta descargarlas).
+
+    La URL llega del cliente: solo se aceptan rutas relativas que, resueltas (symlinks
+    incluidos), quedan dentro de uno de los directorios de `roots`.
+    """
+    if not url.startswith("/api/media/"):
+        return None
+    rel = url[len("/api/media/"):]
+    if not rel or os.path.isabs(rel) or ".." in rel.replace("\\", "/").split("/"):
+        return None
+    # Relativa al directorio de trabajo, como las genera get_media_url
+    path = os.path.realpath(rel)
+    for root in roots:
+        root = os.path.realpath(root)
+        if os.path.commonpath([root, path]) == root and os.path.isfile(path):
+            return path
+    return None
+
+
+async def _probe(client: httpx.AsyncClient, url: str) -> tuple[Optional[int], bool, str, Optional[str]]:
+    """Tamaño, soporte de Range, content-type y ETag del recurso (sin descargar el cuerpo)."""
+    try:
+        r = await client.head(url)
+        if r.status_code < 400:
+            size = r.headers.get("content-length")
+            ranges = r.headers.get("accept-ranges", "").lower() == "bytes"
+            return (int(size) if size else None), ranges, r.headers.get("content-type", ""), r.headers.get("etag")
+    except httpx.HTTPError:
+        pass
+    return None, False, "", None
+
+
+async def _fetch_range(client: httpx.AsyncClient, url: str, path: str, start: int, end: Optional[int],
+                       use_range: bool) -> int:
+    """
+    Descarga [start, end] en `path` (escribiendo en su posición) reintentando ante fallos
+    transitorios. Si el servidor acepta Range, cada reintento continúa desde el último byte
+    escrito; si no, vuelve a empezar. Devuelve el número de bytes escritos.
+    """
+    written = 0
+    for attempt in range(RETRIES + 1):
+        headers = {}
+        if use_range:
+            pos = start + written
+            headers["Range"] = f"bytes={pos}-{'' if end is None else end}"
+        else:
+            written = 0
+        try:
+            async with client.stream("GET", url, headers=headers) as r:
+                if r.status_code in _TRANSIENT_STATUS:
+                    raise _TransientError(f"HTTP {r.status_code}")
+                r.raise_for_status()
+                if use_range and r.status_code != 206:
+                    # El servidor ignoró el Range: solo es válido si pedíamos el fichero entero
+                    if start != 0 or end is not None:
+                        raise RuntimeError(f"El servidor no respetó el Range pedido en {url}")
+                    written = 0
+                with open(path, "r+b") as f:
+                    f.seek(start + written)
+                    async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                    if end is None:
+                        f.truncate()
+            return written
+        except (httpx.TransportError, _TransientError) as e:
+            if attempt == RETRIES:
+                raise
+            print(f"Descarga interrumpida ({e!r}) en {url}, reintentando desde el byte {start + written}")
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return written
+
+
+async def download_to_dir(
+    url: str,
+    dest_dir: str,
+    client: httpx.AsyncClient,
+    local_lookup: Optional[Callable[[str], Optional[str]]] = None,
+    on_downloaded: Optional[Callable[[str, str, Optional[str]], None]] = None,
+    cache_lookup: Optional[Callable[[str, Optional[str]], Optional[str]]] = None,
+    parts: int = RANGE_PARTS,
+) -> str:
+    """
+    Descarga `url` a `dest_dir` y devuelve la ruta del fichero (nombre con uuid).
+
+    - Si `local_lookup(url)` devuelve un fichero local, se enlaza/copia sin tocar la red.
+    - Si `cache_lookup(url, etag)` tiene la versión que anuncia el HEAD, se usa esa copia
+      (la caché se revalida en cada uso: solo cuesta el HEAD, no la descarga).
+    - Los ficheros grandes se piden en `parts` tramos Range en paralelo.
+    - Ante errores transitorios se reanuda desde el último byte recibido.
+    - Al terminar se llama a `on_downloaded(url, ruta, etag)` (p. ej. para guardarlo en caché).
+    """
+    local = local_lookup(url) if local_lookup else None
+    if local:
+        out_path = os.path.join(dest_dir, f"input_{uuid.uuid4()}{_ext_for(local)}")
+        _link_or_copy(local, out_path)
+        print("Entrada servida desde disco local:", url)
+        return out_path
+
+    size, ranges, content_type, etag = await _probe(client, url)
+    cached = cache_lookup(url, etag) if cache_lookup and etag else None
+    if cached:
+        out_path = os.path.join(dest_dir, f"input_{uuid.uuid4()}{_ext_for(url, content_type)}")
+        _link_or_copy(cached, out_path)
+        print("Entrada servida desde la caché local (ETag vigente):", url)
+        return out_path
+    out_path = os.path.join(dest_dir, f"input_{uuid.uuid4()}{_ext_for(url, content_type)}")
+    # Fichero reservado de antemano: cada tramo escribe en su posición
+    with open(out_path, "wb") as f:
+        if size:
+            f.truncate(size)
+
+    try:
+        if size and ranges and size > RANGE_THRESHOLD and parts > 1:
+            step = -(-size // parts)
+            bounds = [(s, min(s + step, size) - 1) for s in range(0, size, step)]
+            tasks = [asyncio.create_task(_fetch_range(client, url, out_path, s, e, True)) for s, e in bounds]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Un tramo falló del todo: se paran los demás antes de borrar el fichero
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        else:
+            await _fetch_range(client, url, out_path, 0, None, ranges)
+    except BaseException:
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+        raise
+    if on_downloaded:
+        on_downloaded(url, out_path, etag)
+    return out_path
+
+
+async def download_all(urls: list[str], dest_dir: str, client: httpx.AsyncClient,
+                       local_lookup: Optional[Callable[[str], Optional[str]]] = None,
+                       on_downloaded: Optional[Callable[[str, str, Optional[str]], None]] = None,
+                       cache_lookup: Optional[Callable[[str, Optional[str]], Optional[str]]] = None) -> list[str]:
+    """
+    Descarga varias URLs a la vez. Si alguna falla, borra las que sí terminaron y
+    relanza el primer error.
+    """
+    results = await asyncio.gather(
+        *(download_to_dir(u, dest_dir, client, local_lookup, on_downloaded, cache_lookup) for u in urls), return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        for r in results:
+            if isinstance(r, str) and os.path.exists(r):
+                os.remove(r)
+        raise errors[0]
+    return results
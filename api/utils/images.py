@@ -1,16 +1,138 @@
-from PIL import Image
+from PIL import Image, ImageOps
 import io
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
 
-def compress_image(image_data: bytes, max_size_mb: float = 4.5, quality: int = 85) -> bytes:
-    img = Image.open(io.BytesIO(image_data))
+# Lado mayor por defecto: las fotos de móvil (12-48 MP) se reducen antes de codificar.
+# Runway genera a 1280x720, así que por encima de esto solo se paga en bytes y tiempo.
+MAX_DIMENSION = 2048
+MIN_QUALITY = 30
+# Fotos de pareja normalizadas: JPEG sin metadatos a esta calidad
+PHOTO_QUALITY = 90
+_EXIF_ORIENTATION = 0x0112
+# Por encima de esto no se decodifica (un PNG de 100 MP son 400 MB en RGBA)
+MAX_PHOTO_PIXELS = 50_000_000
+
+
+@dataclass
+class CompressionStats:
+    quality: int
+    encodes: int
+    size: int
+    original_size: Tuple[int, int]
+    final_size: Tuple[int, int]
+    elapsed_ms: float
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
     if img.mode == "RGBA":
         bg = Image.new("RGB", img.size, (255, 255, 255))
         bg.paste(img, mask=img.split()[3])
-        img = bg
+        return bg
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def _encode(img: Image.Image, quality: int) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def compress_image_with_stats(
+    image_data: bytes,
+    max_size_mb: float = 4.5,
+    quality: int = 85,
+    max_dimension: Optional[int] = MAX_DIMENSION,
+    min_quality: int = MIN_QUALITY,
+) -> Tuple[bytes, CompressionStats]:
+    """
+    Codifica la imagen como JPEG por debajo de `max_size_mb`.
+
+    Primero reduce a `max_dimension` de lado mayor (en JPEG, ya al decodificar con
+    `draft()`, que descarta resolución en el propio decoder), después prueba `quality`
+    y, si no cabe, busca por bisección la calidad más alta que cabe (mínimo `min_quality`).
+    Si ni la calidad mínima cabe, devuelve esa (como antes).
+    """
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(image_data))
+    original_size = img.size
+    if max_dimension and max(img.size) > max_dimension and img.format == "JPEG":
+        # Escala 1/2, 1/4 o 1/8 en el decoder sin bajar de max_dimension. draft() exige que los dos
+        # lados queden por encima de la caja, así que se le pasa la caja con la proporción de la foto
+        s = max_dimension / max(img.size)
+        img.draft("RGB", (math.ceil(img.width * s), math.ceil(img.height * s)))
+    img = _to_rgb(img)
+    if max_dimension and max(img.size) > max_dimension:
+        # BILINEAR de Pillow filtra con soporte proporcional a la escala (no es muestreo por
+        # punto): para reducciones de 2-4x rinde casi como LANCZOS a la mitad de coste
+        img.thumbnail((max_dimension, max_dimension), Image.BILINEAR, reducing_gap=2.0)
+
+    limit = max_size_mb * 1024 * 1024
+    encodes = 1
+    best_q, best = quality, _encode(img, quality)
+    if len(best) > limit:
+        lo, hi = min_quality, quality - 1
+        fallback = None
+        while lo <= hi:
+            q = (lo + hi) // 2
+            data = _encode(img, q)
+            encodes += 1
+            if len(data) <= limit:
+                best_q, best = q, data
+                lo = q + 1
+            else:
+                if q == min_quality:
+                    fallback = data
+                hi = q - 1
+        if len(best) > limit:
+            best_q = min_quality
+            best = fallback if fallback is not None else _encode(img, min_quality)
+            encodes += fallback is None
+
+    stats = CompressionStats(
+        quality=best_q,
+        encodes=encodes,
+        size=len(best),
+        original_size=original_size,
+        final_size=img.size,
+        elapsed_ms=(time.perf_counter() - start) * 1000.0,
+    )
+    return best, stats
+
+
+def compress_image(image_data: bytes, max_size_mb: float = 4.5, quality: int = 85,
+                   max_dimension: Optional[int] = MAX_DIMENSION) -> bytes:
+    data, stats = compress_image_with_stats(image_data, max_size_mb, quality, max_dimension)
+    print(f"compress_image: {stats.original_size} -> {stats.final_size}, q={stats.quality}, "
+          f"{stats.encodes} encodes, {stats.size / 1024:.0f} KB en {stats.elapsed_ms:.0f} ms")
+    return data
+
+
+def normalize_photo(source: Union[bytes, str], size: Tuple[int, int] = (1280, 720), quality: int = PHOTO_QUALITY,
+                    max_pixels: int = MAX_PHOTO_PIXELS) -> bytes:
+    """
+    Deja la foto subida lista para Runway: endereza según la orientación EXIF, recorta al
+    centro y escala a `size` (la proporción con la que se llama a Runway) y la guarda como
+    JPEG sin metadatos (EXIF, GPS, perfiles). Decodifica una sola vez y, en JPEG, ya reducida
+    en el decoder con `draft()`. `source` son los bytes o la ruta del fichero subido.
+    Lanza ValueError si la imagen supera `max_pixels`. Es bloqueante: llamar fuera del event loop.
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    if img.width * img.height > max_pixels:
+        raise ValueError(f"Image too large ({img.width}x{img.height}, max {max_pixels} pixels)")
+    if img.format == "JPEG":
+        # La orientación se aplica después: si la foto va girada 90°, el draft va al revés
+        rotated = img.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8)
+        img.draft("RGB", (size[1], size[0]) if rotated else size)
+    img = ImageOps.exif_transpose(img)
+    img = _to_rgb(img)
+    img = ImageOps.fit(img, size, Image.BICUBIC)
+
     out = io.BytesIO()
+    # Imagen nueva sin info: no arrastra exif ni icc_profile del original
     img.save(out, format="JPEG", quality=quality, optimize=True)
-    while len(out.getvalue())/(1024*1024) > max_size_mb and quality > 30:
-        quality -= 10
-        out = io.BytesIO()
-        img.save(out, format="JPEG", quality=quality, optimize=True)
     return out.getvalue()
@@ -0,0 +1,49 @@
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(data: Any, event: Optional[str] = None) -> str:
+    """Serializa un evento en formato text/event-stream."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """Envuelve un generador de eventos SSE en una respuesta sin buffering."""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def state_stream(
+    snapshot: Callable[[], dict],
+    wait_change: Callable[[float], Awaitable[bool]],
+    is_final: Callable[[dict], bool],
+    keepalive: float = 15.0,
+) -> AsyncIterator[str]:
+    """
+    Emite el estado actual y cada cambio posterior hasta llegar a un estado final.
+    Si no hay cambios en `keepalive` segundos manda un comentario para mantener viva la conexión.
+
+    El estado se vuelve a leer tras cada espera, también cuando vence sin aviso: un cambio
+    que llegue mientras el generador está suspendido en el `yield` (incluido el final) no
+    despierta el `wait_change` siguiente, pero se recoge como mucho un `keepalive` después.
+    """
+    state = snapshot()
+    yield format_sse(state, event=state.get("status"))
+    while not is_final(state):
+        await wait_change(keepalive)
+        current = snapshot()
+        if current == state:
+            yield ": keepalive\n\n"
+            continue
+        state = current
+        yield format_sse(state, event=state.get("status"))
@@ -0,0 +1,124 @@
+import asyncio
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+# Margen para cabeceras y boundaries del multipart al comparar con Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Firmas (magic bytes) de los formatos aceptados -> content-type real
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+]
+_SNIFF_BYTES = 12
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Tipo de imagen según sus primeros bytes, o None si no es uno de los aceptados."""
+    for magic, content_type in _SIGNATURES:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def stream_upload_to_file(
+    request: Request,
+    field: str,
+    dest_path: str,
+    max_bytes: int,
+    block_size: int = UPLOAD_BLOCK_SIZE,
+) -> tuple[int, str]:
+    """
+    Lee un multipart/form-data del cuerpo de la petición según llega y vuelca el fichero
+    del campo `field` en `dest_path`, en bloques de `block_size` (memoria constante por
+    subida, sin esperar a que Starlette reciba y guarde el cuerpo completo).
+
+    - 413 si Content-Length ya anuncia más de `max_bytes`, o en cuanto el fichero los supera.
+    - 400 si los primeros bytes no son JPEG, PNG o WebP (no se fía del content-type del cliente).
+
+    Devuelve (bytes escritos, content-type detectado). Si falla, `dest_path` se borra.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+
+    # El parser es síncrono y trabaja por callbacks: se recogen los trozos del campo que
+    # interesa y se procesan (validación, escritura) entre un chunk de red y el siguiente
+    state = {"name": None, "header": b"", "headers": {}, "done": False}
+    pending: list[bytes] = []
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["header"] = data[start:end].lower()
+
+    def on_header_value(data, start, end):
+        h = state["headers"]
+        h[state["header"]] = h.get(state["header"], b"") + data[start:end]
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["name"] = disposition.get(b"name", b"").decode("latin-1")
+
+    def on_part_data(data, start, end):
+        if state["name"] == field and not state["done"]:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        if state["name"] == field:
+            state["done"] = True
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    size = 0
+    detected: Optional[str] = None
+    block = bytearray()
+    f = open(dest_path, "wb")
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+            for data in pending:
+                size += len(data)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+                block += data
+            pending.clear()
+            if detected is None and block and (len(block) >= _SNIFF_BYTES or state["done"]):
+                detected = sniff_image_type(bytes(block[:_SNIFF_BYTES]))
+                if detected is None:
+                    raise HTTPException(status_code=400, detail="Unsupported image type")
+            if len(block) >= block_size or (state["done"] and block):
+                await asyncio.to_thread(f.write, bytes(block))
+                block.clear()
+            if state["done"]:
+                # El resto del cuerpo (otros campos) no interesa
+                break
+        if not state["done"] or size == 0:
+            raise HTTPException(status_code=400, detail=f"Missing or incomplete '{field}' file")
+    except BaseException:
+        f.close()
+        os.remove(dest_path)
+        raise
+    f.close()
+    return size, detected
@@ -29,7 +29,37 @@ export default function ImagesPreviewPage() {
   // Evita ejecución doble en StrictMode
   const initCalledRef = useRef(false);
 
-  // Generate cartel (text to image)
+  // La generación corre en segundo plano en el backend: nos suscribimos a su progreso por SSE
+  const runGeneration = async (body) => {
+    const response = await fetch(`${API_BASE_URL}/api/generations`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(body)
+    });
+    const queued = await response.json();
+    if (!response.ok || !queued.generation_id) {
+      console.error('Error response:', queued);
+      throw new Error(queued.detail || queued.message || 'Error al encolar la generación');
+    }
+
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`${API_BASE_URL}/api/generations/${queued.generation_id}/events`);
+      source.addEventListener('done', (e) => {
+        source.close();
+        resolve(JSON.parse(e.data));
+      });
+      source.addEventListener('error', (e) => {
+        source.close();
+        // 'error' llega tanto como evento del backend (con datos) como por fallo de conexión
+        const data = e.data ? JSON.parse(e.data) : null;
+        reject(new Error(data?.error || 'Error de conexión con el servidor'));
+      });
+    });
+  };
+
+  // Generate cartel (image to video)
   const generarCartel = async () => {
     console.log("Generando cartel", dataContext.persona1.nombre, dataContext.persona2.nombre);
     
@@ -41,35 +71,13 @@ export default function ImagesPreviewPage() {
     setCartel(prev => ({ ...prev, loading: true, error: '' }));
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/create_cartel_video`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ 
-          id: dataContext.id,
-          nombre1: dataContext.persona1.nombre,
-          nombre2: dataContext.persona2.nombre,
-          image_url: dataContext.cartelImgUrl,
-          demo: isDemo
-        })
+      const data = await runGeneration({
+        kind: 'cartel',
+        id: dataContext.id,
+        image_url: dataContext.cartelImgUrl,
+        demo: isDemo
       });
 
-      const data = await response.json();
-
-      if (!response.ok) {
-        console.error('Error response:', data);
-        if (data.placeholder_url) {
-          return setCartel(prev => ({
-            ...prev,
-            url: `${API_BASE_URL}${data.placeholder_url}`,
-            loading: false,
-            isPlaceholder: true
-          }));
-        }
-        throw new Error(data.message || 'Error al generar el cartel');
-      }
-
       setCartel(prev => ({
         ...prev,
         url: `${data.video_url}`,
@@ -100,26 +108,14 @@ export default function ImagesPreviewPage() {
     setPareja(prev => ({ ...prev, loading: true, error: '' }));
     
     try {
-      const response = await fetch(`${API_BASE_URL}/api/create_video_pareja`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ 
-          id: dataContext.id,
-          image_url: dataContext.imagenParejaUrl,
-          demo: isDemo
-        })
+      const data = await runGeneration({
+        kind: 'pareja',
+        id: dataContext.id,
+        image_url: dataContext.imagenParejaUrl,
+        demo: isDemo
       });
-      
-      const data = await response.json();
       console.log("Video generation response:", data);
       
-      if (!response.ok) {
-        console.error('Error response:', data);
-        throw new Error(data.message || 'Error al generar el video');
-      }
-      
       // Use the URL provided by the backend
       setPareja(prev => ({
         ...prev,
@@ -216,6 +212,17 @@ export default function ImagesPreviewPage() {
     );
   };
 
+  // El render se encola en el backend: consultamos el estado hasta que termine
+  const waitForRenderJob = async (jobId, intervalMs = 3000) => {
+    while (true) {
+      const res = await fetch(`${API_BASE_URL}/api/render_jobs/${jobId}`);
+      const job = await res.json();
+      if (!res.ok) throw new Error(job.detail || 'Error consultando el render');
+      if (job.status === 'done' || job.status === 'error') return job;
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  };
+
   const handleGenerarVideoFinal = async () => {
     if (!cartel.url /*|| !pareja.url*/) {
       setFinalVideoError('Por favor genera primero el cartel, la polaroid y la pareja');
@@ -247,18 +254,25 @@ export default function ImagesPreviewPage() {
         body: JSON.stringify(requestData),
       });
 
-      const data = await response.json();
-      console.log('Video generation response:', data);
+      const queued = await response.json();
+      console.log('Video generation response:', queued);
+
+      if (!response.ok || !queued.job_id) {
+        setFinalVideoError(queued.message || 'Error al generar el video final');
+        return;
+      }
+
+      const data = await waitForRenderJob(queued.job_id);
 
-      if (data.status === 'success') {
+      if (data.status === 'done') {
         // Navegar a la página de visualización del video final
         navigate('/generacion_video', { 
           state: { 
-            videoUrl: data.video_path
+            videoUrl: data.result.video_path
           }
         });
       } else {
-        setFinalVideoError(data.message || 'Error al generar el video final');
+        setFinalVideoError(data.error || 'Error al generar el video final');
       }
     } catch (error) {
       console.error('Error generating final video:', error);